@@ -1,14 +1,27 @@
+import time
+_PROCESS_START = time.perf_counter() # コールドスタート計測の起点
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import os
 import click
-from db_instance import db
+from db_instance import db, init_replica_routing
 from flask_jwt_extended import JWTManager
+from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash
 import uuid
+import metrics
+import registration_store
+import ratelimit
+import trending
+import tweet_writes
+import fragment_cache
+import snowflake
 
 # JWTManagerのインスタンスをグローバルに作成
 jwt = JWTManager()
+# スキーマ変更は migrations/ 配下のバージョン付きマイグレーションで行う (flask db upgrade)
+migrate = Migrate()
 
 def register_cli_commands(app):
     @app.cli.command('init-db')
@@ -17,11 +30,206 @@ def register_cli_commands(app):
         db.create_all()
         click.echo('Initialized the database.')
 
+    @app.cli.command('create-admin')
+    @click.option('--username', default='admin', show_default=True)
+    @click.option('--email', default='admin@example.com', show_default=True)
+    @click.option('--password', envvar='ADMIN_PASSWORD', prompt=True, hide_input=True, confirmation_prompt=True)
+    def create_admin_command(username, email, password):
+        """Create the admin user if it does not exist yet."""
+        if not bootstrap_admin(username, email, password):
+            click.echo(f'Admin user {username!r} already exists.')
+            return
+        click.echo(f'Admin user {username!r} created.')
+
+    @app.cli.command('seed')
+    @click.option('--users', 'n_users', default=1000, show_default=True, help='Number of users to create.')
+    @click.option('--tweets', 'n_tweets', default=10000, show_default=True, help='Number of tweets to create.')
+    @click.option('--follows-per-user', default=20, show_default=True, help='Average number of accounts each user follows.')
+    @click.option('--batch-size', default=10000, show_default=True, help='Rows per COPY / executemany batch.')
+    @click.option('--password', default='password', show_default=True, help='Password shared by all seeded users.')
+    @click.option('--random-seed', default=42, show_default=True)
+    def seed_command(n_users, n_tweets, follows_per_user, batch_size, password, random_seed):
+        """Bulk-load synthetic users, tweets and a power-law follow graph for benchmarks."""
+        import seed
+        import stats
+        started = time.perf_counter()
+        seed.seed_database(n_users, n_tweets, follows_per_user, batch_size=batch_size,
+                           password=password, random_seed=random_seed, echo=click.echo)
+        stats.reconcile() # ダッシュボードのカウンターを投入後のデータに合わせる
+        click.echo(f'Seeding finished in {time.perf_counter() - started:.1f} s.')
+
+    @app.cli.command('purge-registrations')
+    def purge_registrations_command():
+        """Delete expired pending registrations and their uploaded files."""
+        import tasks
+        count = registration_store.purge_expired()
+        tasks.wait_for_file_deletions()
+        click.echo(f'Purged {count} expired registrations.')
+
+    @app.cli.command('reindex-tags')
+    @click.option('--batch-size', default=10000, show_default=True)
+    def reindex_tags_command(batch_size):
+        """Rebuild the hashtag / mention index from all existing tweets."""
+        import hashtags
+        total = hashtags.rebuild_index(batch_size=batch_size, echo=click.echo)
+        click.echo(f'Indexed {total} tweets.')
+
+    @app.cli.command('export-user')
+    @click.argument('username')
+    @click.option('--output', '-o', default='-', show_default=True, help='Output file (- for stdout).')
+    def export_user_command(username, output):
+        """Export a user's profile, tweets and follows as NDJSON."""
+        import user_data
+        from models import User
+        from serializers import iter_ndjson
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'User {username!r} not found.')
+        with click.open_file(output, 'wb') as f:
+            for chunk in iter_ndjson(user_data.export_records(user, yield_per=app.config['STREAM_YIELD_PER'])):
+                f.write(chunk)
+
+    @app.cli.command('import-user')
+    @click.argument('input_file', type=click.File('rb'))
+    @click.option('--username', help='Import into this user (default: the username in the profile record).')
+    @click.option('--chunk-size', default=None, type=int, help='Records per batch (default: IMPORT_CHUNK_SIZE).')
+    def import_user_command(input_file, username, chunk_size):
+        """Import tweets and follows from an NDJSON export, creating the user from its profile record if needed."""
+        import itertools
+        import stats
+        import user_data
+        from models import User
+        records = user_data.read_records(input_file)
+        try:
+            first = next(records, None)
+            profile = first[1] if first and first[1]['type'] == 'profile' else {}
+            username = username or profile.get('username')
+            if not username:
+                raise click.ClickException('No --username given and the input has no profile record.')
+            user = User.query.filter_by(username=username).first()
+            if not user:
+                if not profile.get('email') or profile.get('user_age') is None:
+                    raise click.ClickException(f'User {username!r} not found and the profile record cannot create it.')
+                password = click.prompt(f'Password for new user {username!r}', hide_input=True, confirmation_prompt=True)
+                user = User(username=username, email=profile['email'], user_age=profile['user_age'],
+                            bio=profile.get('bio'), profile_image=profile.get('profile_image'),
+                            password_hash=generate_password_hash(password))
+                db.session.add(user)
+                stats.record_registration('pending')
+                db.session.commit()
+                click.echo(f'Created user {username!r}.')
+            records = itertools.chain([first] if first else [], records)
+            counts = user_data.import_records(user, records, chunk_size=chunk_size or app.config['IMPORT_CHUNK_SIZE'])
+        except user_data.ImportFormatError as e:
+            raise click.ClickException(f'{e} (imported before the error: {getattr(e, "imported", None)})')
+        click.echo(f'Imported {counts["tweets"]} tweets and {counts["follows"]} follows into {username!r}.')
+
+    @app.cli.command('create-partitions')
+    @click.option('--months-ahead', default=None, type=int, help='Months to create beyond the current one (default: PARTITION_MONTHS_AHEAD).')
+    def create_partitions_command(months_ahead):
+        """Create monthly tweet partitions ahead of time (PostgreSQL only; run periodically, e.g. from cron)."""
+        import tweet_partitions
+        if not tweet_partitions.is_supported():
+            click.echo('Tweet partitioning is only used on PostgreSQL; nothing to do.')
+            return
+        if months_ahead is None:
+            months_ahead = app.config['PARTITION_MONTHS_AHEAD']
+        created = tweet_partitions.create_partitions(months_ahead, echo=click.echo)
+        click.echo(f'Created {len(created)} partitions.')
+
+    @app.cli.command('archive-partitions')
+    @click.option('--older-than-months', default=None, type=int, help='Archive partitions older than this (default: ARCHIVE_AFTER_MONTHS).')
+    @click.option('--dry-run', is_flag=True, help='Only list the partitions that would be archived.')
+    def archive_partitions_command(older_than_months, dry_run):
+        """Move old tweet partitions into compressed archive files under ARCHIVE_DIR (PostgreSQL only)."""
+        import tweet_partitions
+        if not tweet_partitions.is_supported():
+            click.echo('Tweet partitioning is only used on PostgreSQL; nothing to do.')
+            return
+        if older_than_months is None:
+            older_than_months = app.config['ARCHIVE_AFTER_MONTHS']
+        for partition in tweet_partitions.archive_candidates(older_than_months):
+            if dry_run:
+                click.echo(f'{partition[0]}: would be archived')
+                continue
+            try:
+                count = tweet_partitions.archive_partition(partition, app.config['ARCHIVE_DIR'],
+                                                           yield_per=app.config['STREAM_YIELD_PER'])
+            except FileExistsError as e:
+                raise click.ClickException(f'{e} (flask restore-partition {partition[0]})')
+            click.echo(f'{partition[0]}: archived {count} tweets')
+
+    @app.cli.command('restore-partition')
+    @click.argument('name')
+    def restore_partition_command(name):
+        """Move an archived tweet partition (e.g. tweets_p2024_01) from ARCHIVE_DIR back into the database (PostgreSQL only)."""
+        import tweet_partitions
+        if not tweet_partitions.is_supported():
+            click.echo('Tweet partitioning is only used on PostgreSQL; nothing to do.')
+            return
+        path = tweet_partitions.archive_path(app.config['ARCHIVE_DIR'], name)
+        if not os.path.exists(path):
+            raise click.ClickException(f'{path} does not exist.')
+        count = tweet_partitions.restore_partition(path)
+        click.echo(f'{name}: restored {count} tweets')
+
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        """Recompute dashboard counters from the source tables (run periodically, e.g. from cron)."""
+        import stats
+        corrections = stats.reconcile()
+        click.echo(f'Reconciled dashboard counters ({len(corrections)} corrected).')
+
 def allowed_file(filename, app_config):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app_config['ALLOWED_EXTENSIONS']
 
+def upload_filepath(image_path, upload_folder=None):
+    """'/static/uploads/xxx.png' 形式の画像パスをサーバー上のファイルパスに変換する"""
+    if not image_path or 'uploads/' not in image_path:
+        return None
+    from flask import current_app
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    return os.path.join(upload_folder, os.path.basename(image_path.split('uploads/', 1)[1]))
+
+def bootstrap_admin(username='admin', email='admin@example.com', password='admin_password'):
+    """Adminユーザーが存在しない場合に作成する (作成した場合はTrueを返す)"""
+    from models import User
+    import stats
+
+    if User.query.filter_by(username=username).first():
+        return False
+    admin_user = User(
+        username=username,
+        email=email,
+        user_age=99,
+        password_hash=generate_password_hash(password),
+        role='admin',
+        is_verified=True,
+        verification_status='approved'
+    )
+    db.session.add(admin_user)
+    stats.record_registration('approved')
+    db.session.commit()
+    return True
+
+def register_startup_timing(app, create_app_started):
+    """create_app の所要時間と、プロセス起動から最初のリクエストまでの時間を記録する"""
+    app.config['STARTUP_METRICS'] = {
+        'create_app_ms': (time.perf_counter() - create_app_started) * 1000,
+        'first_request_ms': None,
+    }
+    app.logger.info('create_app completed in %.1f ms', app.config['STARTUP_METRICS']['create_app_ms'])
+
+    @app.before_request
+    def record_first_request():
+        metrics = app.config['STARTUP_METRICS']
+        if metrics['first_request_ms'] is None:
+            metrics['first_request_ms'] = (time.perf_counter() - _PROCESS_START) * 1000
+            app.logger.info('Cold start: first request %.1f ms after process start', metrics['first_request_ms'])
+
 def create_app():
+    create_app_started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object('config.Config')
 
@@ -30,13 +238,23 @@ def create_app():
     app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.config['ARCHIVE_DIR'] = os.path.join(app.root_path, app.config['ARCHIVE_DIR'])
 
+    snowflake.init_app(app) # ツイートIDの発行に使うワーカーID
     db.init_app(app)
     jwt.init_app(app)
+    migrate.init_app(app, db)
+    init_replica_routing(app)
+    metrics.init_app(app) # レイテンシ・SQL発行数の計測と /metrics エンドポイント
+    registration_store.init_app(app) # 多段階登録の途中データの保存先
+    ratelimit.init_app(app)
+    trending.init_app(app) # トレンドタグの集計バッファ
+    tweet_writes.init_app(app) # ツイートのグループコミット
+    fragment_cache.init_app(app) # プロフィールページのフラグメントキャッシュ
 
     # Blueprintの登録
     from routes import auth_routes, main_routes, api_routes, verification_routes, admin_routes # admin_routesを追加
-    from models import User # Userモデルをインポート
+    import models # マイグレーションの自動生成でモデルを認識させるためにインポート
 
     app.register_blueprint(auth_routes.bp)
     app.register_blueprint(main_routes.bp)
@@ -46,25 +264,18 @@ def create_app():
 
     register_cli_commands(app)
     
-    with app.app_context():
-        db.create_all()
-        print("Database tables created or already exist.")
-
-        # Adminユーザーが存在しない場合、自動的に作成
-        if not User.query.filter_by(username='admin').first():
-            admin_user = User(
-                username='admin',
-                email='admin@example.com',
-                user_age=99,
-                password_hash=generate_password_hash('admin_password'), # 強固なパスワードを設定してください
-                role='admin',
-                is_verified=True,
-                verification_status='approved'
-            )
-            db.session.add(admin_user)
-            db.session.commit()
-            print("Default admin user created.")
+    # 開発用: AUTO_BOOTSTRAP_DB が有効な場合のみ起動時にテーブルとAdminユーザーを作成する
+    # 本番では起動時にDBへアクセスせず、flask db upgrade / flask create-admin を別ステップで実行する
+    if app.config['AUTO_BOOTSTRAP_DB']:
+        with app.app_context():
+            db.create_all()
+            print("Database tables created or already exist.")
+
+            # Adminユーザーが存在しない場合、自動的に作成
+            if bootstrap_admin(): # 強固なパスワードを設定してください
+                print("Default admin user created.")
 
+    register_startup_timing(app, create_app_started)
     return app
 
 if __name__ == '__main__':
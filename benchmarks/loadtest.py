@@ -0,0 +1,239 @@
+# era/benchmarks/loadtest.py
+"""固定並列数の負荷試験
+
+`flask seed` で投入したユーザー (seed<id>, パスワード共通) でログインし、
+main.index / api.create_tweet_api / api.get_my_tweets_api / main.follow / auth.login を
+決まった比率で呼び出して、操作ごとの p50/p99 レイテンシとスループットを出力する。
+
+デフォルトではアプリをプロセス内で起動して Flask のテストクライアントから叩くため、
+ネットワークや外部ツールは不要。--base-url を指定すると起動中のサーバーに対して実行する。
+
+    python benchmarks/loadtest.py --concurrency 8 --duration 30 --output result.json
+    python benchmarks/loadtest.py --concurrency 8 --duration 30 --baseline result.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (操作名, 重み)
+OPERATIONS = (
+    ('main.index', 40),
+    ('api.get_my_tweets_api', 20),
+    ('api.create_tweet_api', 20),
+    ('main.follow', 10),
+    ('auth.login', 10),
+)
+
+
+class InProcessClient:
+    """Flask のテストクライアントでリクエストを送る (オフライン実行用)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        response = self.client.open(path, method=method, json=json_body, data=form, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """起動中のサーバーに urllib でリクエストを送る"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect()
+        )
+
+    def request(self, method, path, json_body=None, form=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # リダイレクト先のページまで計測に含めないよう、302 をそのまま返す
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Worker(threading.Thread):
+    def __init__(self, client, username, password, usernames, deadline, rng):
+        super().__init__(daemon=True)
+        self.client = client
+        self.username = username
+        self.password = password
+        self.usernames = usernames
+        self.deadline = deadline
+        self.rng = rng
+        self.samples = {name: [] for name, _ in OPERATIONS}
+        self.errors = {name: 0 for name, _ in OPERATIONS}
+        self.token = None
+
+    def login(self):
+        # Webセッション (main.*) と JWT (api.*) の両方を用意する
+        self.client.request('POST', '/auth/login', form={'username': self.username, 'password': self.password})
+        status, body = self.client.request('POST', '/auth/login', json_body={'username': self.username, 'password': self.password})
+        if status != 200:
+            raise RuntimeError(f'Login failed for {self.username}: {status}')
+        self.token = body['access_token']
+
+    def call(self, name):
+        auth = {'Authorization': f'Bearer {self.token}'}
+        if name == 'main.index':
+            return self.client.request('GET', '/')
+        if name == 'api.get_my_tweets_api':
+            return self.client.request('GET', '/api/my_tweets', headers=auth)
+        if name == 'api.create_tweet_api':
+            return self.client.request('POST', '/api/tweets', json_body={'body': f'load test {self.rng.random()}'}, headers=auth)
+        if name == 'main.follow':
+            return self.client.request('GET', f'/follow/{self.rng.choice(self.usernames)}')
+        if name == 'auth.login':
+            return self.client.request('POST', '/auth/login', json_body={'username': self.username, 'password': self.password})
+        raise ValueError(name)
+
+    def run(self):
+        names = [name for name, _ in OPERATIONS]
+        weights = [weight for _, weight in OPERATIONS]
+        while time.perf_counter() < self.deadline:
+            name = self.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, _ = self.call(name)
+                failed = status >= 400
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - started
+            if failed:
+                self.errors[name] += 1
+            else:
+                self.samples[name].append(elapsed)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(workers, duration):
+    result = {}
+    for name, _ in OPERATIONS:
+        latencies = sorted(sample for worker in workers for sample in worker.samples[name])
+        errors = sum(worker.errors[name] for worker in workers)
+        result[name] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': len(latencies) / duration,
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        }
+    total = sum(op['requests'] for op in result.values())
+    result['total'] = {'requests': total, 'throughput_rps': total / duration}
+    return result
+
+
+def print_report(result, baseline=None):
+    print(f'{"operation":<26}{"reqs":>8}{"errors":>8}{"rps":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, _ in OPERATIONS:
+        op = result[name]
+        line = f'{name:<26}{op["requests"]:>8}{op["errors"]:>8}{op["throughput_rps"]:>10.1f}'
+        line += f'{op["p50_ms"]:>10.1f}{op["p99_ms"]:>10.1f}' if op['requests'] else f'{"-":>10}{"-":>10}'
+        if baseline and baseline.get(name, {}).get('p99_ms') and op['p99_ms']:
+            before = baseline[name]
+            line += f'   (p50 {_change(before["p50_ms"], op["p50_ms"])}, p99 {_change(before["p99_ms"], op["p99_ms"])}, rps {_change(before["throughput_rps"], op["throughput_rps"])})'
+        print(line)
+    print(f'total: {result["total"]["requests"]} requests, {result["total"]["throughput_rps"]:.1f} req/s')
+
+
+def _change(before, after):
+    return f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--users', type=int, default=100, help='number of seeded users to log in as')
+    parser.add_argument('--user-prefix', default='seed')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--base-url', help='run against a live server instead of in-process')
+    parser.add_argument('--first-user-id', type=int, default=2, help='with --base-url: id of the first seeded user')
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--baseline', help='compare against a previous JSON result')
+    args = parser.parse_args()
+
+    rng = random.Random(args.random_seed)
+    if args.base_url:
+        make_client = lambda: HttpClient(args.base_url)
+        usernames = [f'{args.user_prefix}{i}' for i in range(args.first_user_id, args.first_user_id + args.users)]
+    else:
+        from app import create_app
+        from models import User
+        app = create_app()
+        with app.app_context():
+            usernames = [u.username for u in User.query.filter(User.username.like(f'{args.user_prefix}%'))
+                         .order_by(User.id).limit(args.users)]
+        if not usernames:
+            parser.error('No seeded users found. Run `flask --app app seed` first.')
+        make_client = lambda: InProcessClient(app)
+
+    workers = []
+    for i in range(args.concurrency):
+        worker = Worker(make_client(), usernames[i % len(usernames)], args.password, usernames, 0,
+                        random.Random(rng.random()))
+        worker.login()
+        workers.append(worker)
+
+    started = time.perf_counter()
+    for worker in workers:
+        worker.deadline = started + args.duration
+        worker.start()
+    for worker in workers:
+        worker.join()
+    duration = time.perf_counter() - started
+
+    result = summarize(workers, duration)
+    result['config'] = {'concurrency': args.concurrency, 'duration': args.duration, 'base_url': args.base_url}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# era/benchmarks/tweet_write_bench.py
+"""ツイート書き込みのスループット比較
+
+同じ並列数・同じ時間で、次の書き込み方式ごとに1秒あたりの投稿件数とリクエストの p50/p99 を計測する。
+
+    single  POST /api/tweets を1件ずつ (1投稿 = 1トランザクション、現行の方式)
+    group   POST /api/tweets を TWEET_GROUP_COMMIT 有効で (同時の投稿をまとめてコミット)
+    batch   POST /api/tweets/batch に --batch-size 件ずつ
+
+`flask seed` で投入したユーザーで、アプリをプロセス内で起動してテストクライアントから叩く。
+レート制限は計測の邪魔になるので無効にする。
+
+    python benchmarks/tweet_write_bench.py --concurrency 16 --duration 10
+    python benchmarks/tweet_write_bench.py --modes single,group --output result.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import InProcessClient, percentile
+
+MODES = ('single', 'group', 'batch')
+
+
+class Writer(threading.Thread):
+    def __init__(self, client, token, mode, batch_size, deadline):
+        super().__init__(daemon=True)
+        self.client = client
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.mode = mode
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.latencies = []
+        self.tweets = 0
+        self.errors = 0
+
+    def run(self):
+        n = 0
+        while time.perf_counter() < self.deadline:
+            started = time.perf_counter()
+            if self.mode == 'batch':
+                body = {'tweets': [{'body': f'bench #bench {n + i}'} for i in range(self.batch_size)]}
+                status, _ = self.client.request('POST', '/api/tweets/batch', json_body=body, headers=self.headers)
+                count = self.batch_size
+            else:
+                status, _ = self.client.request('POST', '/api/tweets', json_body={'body': f'bench #bench {n}'},
+                                                headers=self.headers)
+                count = 1
+            n += count
+            if status == 201:
+                self.latencies.append(time.perf_counter() - started)
+                self.tweets += count
+            else:
+                self.errors += 1
+
+
+def run_mode(app, tokens, mode, concurrency, duration, batch_size):
+    app.config['TWEET_GROUP_COMMIT'] = mode == 'group'
+    started = time.perf_counter()
+    writers = [Writer(InProcessClient(app), tokens[i % len(tokens)], mode, batch_size, started + duration)
+               for i in range(concurrency)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(sample for writer in writers for sample in writer.latencies)
+    tweets = sum(writer.tweets for writer in writers)
+    return {
+        'requests': len(latencies),
+        'errors': sum(writer.errors for writer in writers),
+        'tweets': tweets,
+        'tweets_per_second': tweets / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES), help='comma separated subset of ' + ','.join(MODES))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per mode')
+    parser.add_argument('--batch-size', type=int, default=20, help='tweets per request in batch mode')
+    parser.add_argument('--users', type=int, default=100, help='number of seeded users to post as')
+    parser.add_argument('--user-prefix', default='seed')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f'unknown mode {mode!r}')
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from models import User
+    app = create_app()
+    app.config['RATELIMIT_ENABLED'] = False
+    app.config['TWEET_BATCH_MAX_SIZE'] = max(app.config['TWEET_BATCH_MAX_SIZE'], args.batch_size)
+    with app.app_context():
+        usernames = [u.username for u in User.query.filter(User.username.like(f'{args.user_prefix}%'))
+                     .order_by(User.id).limit(args.users)]
+        tokens = [create_access_token(identity=username) for username in usernames]
+    if not tokens:
+        parser.error('No seeded users found. Run `flask --app app seed` first.')
+
+    result = {}
+    print(f'{"mode":<10}{"reqs":>8}{"errors":>8}{"tweets/s":>12}{"p50 ms":>10}{"p99 ms":>10}')
+    for mode in modes:
+        r = run_mode(app, tokens, mode, args.concurrency, args.duration, args.batch_size)
+        result[mode] = r
+        line = f'{mode:<10}{r["requests"]:>8}{r["errors"]:>8}{r["tweets_per_second"]:>12.1f}'
+        line += f'{r["p50_ms"]:>10.1f}{r["p99_ms"]:>10.1f}' if r['requests'] else f'{"-":>10}{"-":>10}'
+        if 'single' in result and mode != 'single' and result['single']['tweets_per_second']:
+            line += f'   (x{r["tweets_per_second"] / result["single"]["tweets_per_second"]:.1f} vs single)'
+        print(line)
+    result['config'] = {'concurrency': args.concurrency, 'duration': args.duration, 'batch_size': args.batch_size}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,133 @@
 import os
 
+def engine_options(database_uri):
+    """DB接続URIに応じたコネクションプールの設定を環境変数から組み立てる"""
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'), # 切断済みの接続を使う前に検出
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)), # 秒。DB側やLBのアイドル切断より短くする
+    }
+    if database_uri.startswith('sqlite'):
+        return options
+
+    options.update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)), # プールが空いた接続を待つ最大秒数
+    })
+    statement_timeout_ms = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout_ms and database_uri.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout_ms}'}
+    return options
+
+def snowflake_worker_id(value):
+    """環境変数 SNOWFLAKE_WORKER_ID の値を、数値ならワーカーID (int)、'pid' ならそのまま、未設定なら None にする"""
+    if not value:
+        return None
+    return value if value == 'pid' else int(value)
+
 class Config:
     # Docker Composeで定義するPostgreSQLサービス名と、ユーザー、パスワード、DB名を指定
     # Docker Composeのservice名がdbなので、ホスト名をdbにする
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
                               'postgresql://user:password@db:5432/sns_db'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # 読み取り専用エンドポイントを振り分けるリードレプリカ (未設定ならすべてプライマリを使う)
+    # ローカルで試す場合は、プライマリを複製したSQLiteファイルや2台目のPostgreSQLを指定する
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = {
+        'replica': {'url': DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL)}
+    } if DATABASE_REPLICA_URL else {}
+    # 自分が書き込んだ直後はこの秒数だけプライマリから読む (read-your-writes)
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    # 最終書き込み時刻の保存先 ('memory': ワーカー1つ, 'sqlite': 同一ホストのワーカー間で共有)。
+    # ログイン中のユーザーはユーザー単位で記録するので、Cookie を返さない JWT クライアントにも効く
+    REPLICA_STICKY_STORAGE = os.environ.get('REPLICA_STICKY_STORAGE', 'memory')
+    REPLICA_STICKY_STORAGE_PATH = os.environ.get('REPLICA_STICKY_STORAGE_PATH', '/tmp/era_replica_sticky.sqlite3')
     SQLALCHEMY_TRACK_MODIFICATIONS = False # シグナル追跡を無効化 (非推奨機能のため)
 
+    # 起動時に db.create_all() とAdminユーザー作成を行うか (ローカル開発用)。
+    # 無効の場合、create_app はDBに一切アクセスしない。スキーマは flask db upgrade で適用する
+    AUTO_BOOTSTRAP_DB = os.environ.get('AUTO_BOOTSTRAP_DB', 'false').lower() in ('1', 'true', 'yes')
+
     # セッション管理などに使用する秘密鍵
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_super_secret_key_here'
     
     # JWTの設定
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'super-secret-jwt-key'
 
+    # 管理画面: 本人確認キューの1ページあたりの件数と、一括承認/拒否で受け付ける最大件数
+    ADMIN_QUEUE_PAGE_SIZE = int(os.environ.get('ADMIN_QUEUE_PAGE_SIZE', 20))
+    ADMIN_BULK_MAX_IDS = int(os.environ.get('ADMIN_BULK_MAX_IDS', 500))
+
+    # この時間 (ミリ秒) 以上かかったリクエストをログに出力する
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+
+    # 一覧系APIのストリーミング: サーバーサイドカーソルで一度に読む行数、JSONエンコーダー、圧縮するサイズの下限
+    STREAM_YIELD_PER = int(os.environ.get('STREAM_YIELD_PER', 1000))
+    JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto') # 'auto', 'orjson', 'ujson', 'json'
+    STREAM_COMPRESS_MIN_BYTES = int(os.environ.get('STREAM_COMPRESS_MIN_BYTES', 1024))
+
+    # 多段階登録の途中データの保存先 ('memory': プロセス内LRU (開発用), 'sqlite': ワーカー間で共有するローカルファイル)
+    REGISTRATION_STORE = os.environ.get('REGISTRATION_STORE', 'memory')
+    REGISTRATION_STORE_PATH = os.environ.get('REGISTRATION_STORE_PATH', '/tmp/era_registrations.sqlite3')
+    REGISTRATION_STORE_MAX_ENTRIES = int(os.environ.get('REGISTRATION_STORE_MAX_ENTRIES', 10000))
+    REGISTRATION_TTL_SECONDS = int(os.environ.get('REGISTRATION_TTL_SECONDS', 30 * 60)) # 登録途中データの有効期限
+    REGISTRATION_PURGE_INTERVAL_SECONDS = int(os.environ.get('REGISTRATION_PURGE_INTERVAL_SECONDS', 60))
+
+    # レート制限 (トークンバケット)。period_seconds の間に capacity 回までリクエストでき、トークンは連続的に回復する
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', 'memory') # 'memory' (ワーカー1つ) or 'sqlite' (ワーカー間で共有)
+    RATELIMIT_STORAGE_PATH = os.environ.get('RATELIMIT_STORAGE_PATH', '/tmp/era_ratelimit.sqlite3')
+    RATE_LIMITS = {
+        'login': {'capacity': 10, 'period_seconds': 60},
+        'tweet_write': {'capacity': 30, 'period_seconds': 60},
+        'face_verify': {'capacity': 5, 'period_seconds': 60}, # dlib による顔照合は重いので厳しめにする
+        'data_import': {'capacity': 5, 'period_seconds': 60 * 60},
+    }
+
+    # 検索APIの1ページあたりの件数 (limit パラメータの上限は SEARCH_MAX_PAGE_SIZE)
+    SEARCH_PAGE_SIZE = 20
+    USER_SEARCH_PAGE_SIZE = 10
+    SEARCH_MAX_PAGE_SIZE = 100
+    # ツイート検索は新しい方から SEARCH_WINDOW_HOURS 分ずつ (窓を4倍ずつ広げながら) 探し、
+    # 1回のリクエストで遡るのは SEARCH_MAX_SCAN_DAYS 分まで (一致する行の取り出しと並べ替えの量を抑える)
+    SEARCH_WINDOW_HOURS = int(os.environ.get('SEARCH_WINDOW_HOURS', 24))
+    SEARCH_MAX_SCAN_DAYS = int(os.environ.get('SEARCH_MAX_SCAN_DAYS', 30))
+
+    # トレンドのハッシュタグ: TRENDING_BUCKET_SECONDS 刻みのバケットで直近 TRENDING_WINDOW_SECONDS 分を集計する
+    TRENDING_BUCKET_SECONDS = int(os.environ.get('TRENDING_BUCKET_SECONDS', 60))
+    TRENDING_WINDOW_SECONDS = int(os.environ.get('TRENDING_WINDOW_SECONDS', 60 * 60))
+    TRENDING_FLUSH_INTERVAL_SECONDS = int(os.environ.get('TRENDING_FLUSH_INTERVAL_SECONDS', 10)) # ワーカー内の集計を反映スレッドがDBへ書き込む間隔
+    TRENDING_CACHE_SECONDS = int(os.environ.get('TRENDING_CACHE_SECONDS', 30))
+    TRENDING_LIMIT = 10
+
+    # NDJSON インポートで1回の INSERT・コミットにまとめるレコード数
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+    # ツイート投稿: バッチAPIの1回あたりの上限件数と、1件ずつの投稿をまとめてコミットするグループコミット
+    TWEET_BATCH_MAX_SIZE = int(os.environ.get('TWEET_BATCH_MAX_SIZE', 20))
+    TWEET_GROUP_COMMIT = os.environ.get('TWEET_GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')
+    TWEET_GROUP_COMMIT_WINDOW_MS = float(os.environ.get('TWEET_GROUP_COMMIT_WINDOW_MS', 2)) # 同じコミットにまとめる投稿を待つ時間
+    TWEET_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('TWEET_GROUP_COMMIT_MAX_BATCH', 100))
+    TWEET_GROUP_COMMIT_TIMEOUT_SECONDS = float(os.environ.get('TWEET_GROUP_COMMIT_TIMEOUT_SECONDS', 5))
+
+    # プロフィールページのHTMLフラグメントキャッシュの上限 (ワーカーごと、バイト数。0 で無効)
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    # ツイートIDの Snowflake ワーカーID (0-1023)。プロセス (gunicorn のワーカーやCLI) ごとに異なる値にする。
+    # 未設定では起動できない (テストを除く)。'pid' でプロセスIDから決める (開発用、ホスト間で重複しうる)
+    SNOWFLAKE_WORKER_ID = snowflake_worker_id(os.environ.get('SNOWFLAKE_WORKER_ID'))
+
+    # タイムライン・プロフィールの1ページあたりのツイート数
+    TIMELINE_PAGE_SIZE = int(os.environ.get('TIMELINE_PAGE_SIZE', 50))
+
+    # ツイートの月別パーティション (PostgreSQL のみ): flask create-partitions で何か月先まで作っておくか
+    # (パーティションが無い月には投稿できない)、
+    # flask archive-partitions で何か月より古いパーティションをアーカイブファイルに移すか、その保存先 (相対パスはアプリのルートから)
+    PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+    ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', 12))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
     # デバッグモードの設定
     DEBUG = True
\ No newline at end of file
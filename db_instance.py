@@ -1,4 +1,166 @@
 # era/db_instance.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, has_request_context, request, session, current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from ratelimit import client_identity
 
-db = SQLAlchemy()
\ No newline at end of file
+REPLICA_BIND_KEY = 'replica'
+
+
+class RoutingSession(Session):
+    """replica_reads が付いたエンドポイントの SELECT をリードレプリカへ振り分けるセッション"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and has_request_context()
+            and g.get('use_replica', False)
+            and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None # SELECT ... FOR UPDATE はプライマリで実行する
+            and REPLICA_BIND_KEY in self._db.engines
+        ):
+            return self._db.engines[REPLICA_BIND_KEY]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_request_wrote(db_session, flush_context):
+    # このリクエストで書き込みがあったことを記録し、after_request でセッションに反映する
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_request_wrote_on_execute(orm_execute_state):
+    # session.execute() による一括の INSERT/UPDATE/DELETE は flush を経由しないので、ここでも記録する
+    if has_request_context() and not orm_execute_state.is_select:
+        g.db_wrote = True
+
+
+class MemoryWriteTimes:
+    """開発用: ユーザーごとの最終書き込み時刻をプロセス内に保持する (ワーカー間では共有されない)"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # identity -> 最終書き込み時刻
+        self._lock = threading.Lock()
+
+    def get(self, identity):
+        with self._lock:
+            return self._entries.get(identity)
+
+    def set(self, identity, written_at):
+        with self._lock:
+            self._entries[identity] = written_at
+            self._entries.move_to_end(identity)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteWriteTimes:
+    """同一ホストの全ワーカーで共有するローカルのSQLiteファイルに最終書き込み時刻を保持する"""
+
+    def __init__(self, path, retention_seconds, purge_interval_seconds=60):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = time.time()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS last_writes (identity TEXT PRIMARY KEY, written_at REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=OFF') # 消えても数秒間プライマリから読まなくなるだけなので fsync しない
+            self._local.conn = conn
+        return conn
+
+    def get(self, identity):
+        row = self._connect().execute('SELECT written_at FROM last_writes WHERE identity = ?', (identity,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, identity, written_at):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO last_writes (identity, written_at) VALUES (?, ?)', (identity, written_at))
+        # 判定に使わなくなった古い行は一定間隔ごとにまとめて削除する
+        if written_at - self._last_purge >= self.purge_interval_seconds:
+            self._last_purge = written_at
+            conn.execute('DELETE FROM last_writes WHERE written_at < ?', (written_at - self.retention_seconds,))
+
+
+def _request_identity():
+    identity = client_identity()
+    if identity is None and 'Authorization' in request.headers:
+        # jwt_required が付いていないエンドポイントでも、トークンがあればそのユーザーとして判定する
+        from flask_jwt_extended import verify_jwt_in_request
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception: # 不正なトークンは未ログインとして扱う
+            return None
+        identity = client_identity()
+    return identity
+
+
+def _last_write_at():
+    # ログイン中のユーザーはセッションCookieを返さないAPIクライアントも含めてユーザー単位で判定し、
+    # 未ログインのクライアントはセッションCookieで判定する
+    identity = _request_identity()
+    if identity:
+        return current_app.extensions['replica_write_times'].get(identity)
+    return session.get('last_write_at')
+
+
+def recently_wrote():
+    """ログイン中のユーザー (またはクライアント) が REPLICA_STICKY_SECONDS 以内に書き込みを行ったか"""
+    last_write_at = _last_write_at()
+    return last_write_at is not None and time.time() - last_write_at < current_app.config['REPLICA_STICKY_SECONDS']
+
+
+def replica_reads(view):
+    """GET/HEAD リクエストの読み取りをリードレプリカで行うデコレータ (直近に書き込んだユーザーは除く)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and REPLICA_BIND_KEY in current_app.config['SQLALCHEMY_BINDS'] \
+                and not recently_wrote():
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replica_routing(app):
+    storage = app.config['REPLICA_STICKY_STORAGE']
+    if storage == 'sqlite':
+        write_times = SQLiteWriteTimes(app.config['REPLICA_STICKY_STORAGE_PATH'], app.config['REPLICA_STICKY_SECONDS'])
+    elif storage == 'memory':
+        write_times = MemoryWriteTimes()
+    else:
+        raise ValueError(f'Unknown REPLICA_STICKY_STORAGE: {storage!r}')
+    app.extensions['replica_write_times'] = write_times
+
+    @app.after_request
+    def remember_last_write(response):
+        # レプリカを使わない構成では記録しない
+        if not g.get('db_wrote', False) or REPLICA_BIND_KEY not in app.config['SQLALCHEMY_BINDS']:
+            return response
+        now = time.time()
+        identity = _request_identity()
+        if identity:
+            write_times.set(identity, now)
+        else:
+            session['last_write_at'] = now
+        return response
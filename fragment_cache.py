@@ -0,0 +1,61 @@
+# era/fragment_cache.py
+# レンダリング済みのHTMLフラグメントのキャッシュ (ワーカーごとのプロセス内LRU、合計バイト数で上限をかける)
+#
+# キーに内容のバージョン (ユーザーIDと profile_version、最新のツイートIDなど) を含めるので、
+# 更新時にキャッシュを消す必要はない。古いキーの値は参照されなくなり、LRUで追い出される。
+import threading
+from collections import OrderedDict
+from flask import current_app
+from markupsafe import Markup
+from models import User
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # key -> (str, UTF-8でのバイト数)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes // 8:
+            return # 1件で大半を占めるような大きなフラグメントはキャッシュしない
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+def init_app(app):
+    app.extensions['fragment_cache'] = LRUCache(app.config['FRAGMENT_CACHE_MAX_BYTES'])
+
+
+def cached(key, render):
+    """key のフラグメントがあれば返し、無ければ render() の結果を保存して返す"""
+    cache = current_app.extensions['fragment_cache']
+    if not cache.max_bytes:
+        return Markup(render())
+    html = cache.get(key)
+    if html is None:
+        html = str(render())
+        cache.set(key, html)
+    return Markup(html)
+
+
+def bump_profile_version(user):
+    """プロフィールの表示内容を変更したときに呼ぶ (同時更新でも取りこぼさないようSQL側で加算する)"""
+    user.profile_version = User.profile_version + 1
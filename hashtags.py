@@ -0,0 +1,108 @@
+# era/hashtags.py
+# ハッシュタグ・メンションの抽出と転置インデックス (tweet_tags / tweet_mentions) の更新・読み出し
+#
+# 投稿時に本文から抽出して (タグ or ユーザーID, ツイートID) の行を書いておくことで、
+# タグ別・メンション別の一覧を本文の全件走査なしに主キーの範囲読みで返せる。
+import re
+from sqlalchemy import delete, insert, select
+from db_instance import db
+from models import Tweet, TweetMention, TweetTag, User
+import trending
+
+TAG_MAX_LENGTH = 100
+
+# 直前が英数字や '&' (HTML実体参照) の場合は対象外。全角の '＃' '＠' も受け付ける
+HASHTAG_RE = re.compile(r'(?<![\w&])[#＃](\w+)')
+MENTION_RE = re.compile(r'(?<![\w@])[@＠](\w+)')
+
+
+def normalize_tag(tag):
+    """'#Python' -> 'python' (先頭の '#' を除いて大文字小文字を区別しない形にする)"""
+    return tag.lstrip('#＃').casefold()[:TAG_MAX_LENGTH]
+
+
+def extract_tags(body):
+    """本文中のハッシュタグを出現順・重複なしで返す (数字だけのタグは除く)"""
+    tags = (normalize_tag(match) for match in HASHTAG_RE.findall(body or ''))
+    return list(dict.fromkeys(tag for tag in tags if not tag.isdigit()))
+
+
+def extract_mentions(body):
+    """本文中の @ユーザー名 を出現順・重複なしで返す"""
+    return list(dict.fromkeys(MENTION_RE.findall(body or '')))
+
+
+def index_tweets(tweets, count_trending=True):
+    """[(tweet_id, body), ...] のタグ・メンションをインデックスに追加する
+
+    呼び出し元のトランザクション内で実行される。count_trending=True の場合、
+    コミットされたタグがトレンドの集計にも加算される (過去データの再構築では False にする)。
+    """
+    tag_rows = []
+    mentions = []
+    for tweet_id, body in tweets:
+        tag_rows += [{'tag': tag, 'tweet_id': tweet_id} for tag in extract_tags(body)]
+        mentions += [(name, tweet_id) for name in extract_mentions(body)]
+
+    mention_rows = []
+    if mentions:
+        # メンション先のユーザーIDはまとめて1回のクエリで引く (存在しないユーザー名は無視する)
+        user_ids = dict(db.session.execute(
+            select(User.username, User.id).where(User.username.in_({name for name, _ in mentions}))
+        ).all())
+        mention_rows = [{'user_id': user_ids[name], 'tweet_id': tweet_id}
+                        for name, tweet_id in mentions if name in user_ids]
+
+    if tag_rows:
+        db.session.execute(insert(TweetTag), tag_rows)
+        if count_trending:
+            trending.record_tags([row['tag'] for row in tag_rows])
+    if mention_rows:
+        db.session.execute(insert(TweetMention), mention_rows)
+
+
+def rebuild_index(batch_size=10000, echo=None):
+    """全ツイートからインデックスを作り直す (既存データの移行用)。ツイートIDの昇順にバッチごとにコミットする"""
+    db.session.execute(delete(TweetTag))
+    db.session.execute(delete(TweetMention))
+    db.session.commit()
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Tweet.id, Tweet.body).where(Tweet.id > last_id).order_by(Tweet.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        index_tweets(rows, count_trending=False)
+        db.session.commit()
+        last_id = rows[-1].id
+        total += len(rows)
+        if echo:
+            echo(f'  indexed {total} tweets')
+    return total
+
+
+def _timeline(index_column, index_tweet_id, key, before_id, limit):
+    stmt = (
+        select(Tweet.id, Tweet.body, Tweet.timestamp, User.username)
+        .select_from(index_column.table)
+        .join(Tweet, Tweet.id == index_tweet_id)
+        .join(User, User.id == Tweet.user_id)
+        .where(index_column == key)
+        .order_by(index_tweet_id.desc()) # 転置インデックスの主キー順に読む
+        .limit(limit)
+    )
+    if before_id is not None:
+        stmt = stmt.where(index_tweet_id < before_id)
+    return db.session.execute(stmt).all()
+
+
+def tweets_with_tag(tag, before_id=None, limit=20):
+    """タグを含むツイートを id の降順で返す ([(id, body, timestamp, username), ...])"""
+    return _timeline(TweetTag.tag, TweetTag.tweet_id, normalize_tag(tag), before_id, limit)
+
+
+def tweets_mentioning(user_id, before_id=None, limit=20):
+    """ユーザーがメンションされたツイートを id の降順で返す"""
+    return _timeline(TweetMention.user_id, TweetMention.tweet_id, user_id, before_id, limit)
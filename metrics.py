@@ -0,0 +1,191 @@
+# era/metrics.py
+# リクエストのレイテンシ・SQL発行数・顔認証の処理時間を集計し、Prometheus形式で公開する
+#
+# 集計値はスレッドごとに保持し、書き込み時にロックを取らない。
+# /metrics の読み出し時に全スレッド分を合算する。スレッドが終了したら (リクエストごとにスレッドを
+# 作る開発用サーバーなど)、その集計値を終了済みスレッドの合計に移して登録から外す。
+import bisect
+import itertools
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_HISTOGRAM_HELP = {
+    'http_request_duration_seconds': ('Request latency per endpoint', LATENCY_BUCKETS),
+    'http_request_sql_statements': ('SQL statements executed per request', SQL_COUNT_BUCKETS),
+    'http_request_db_seconds': ('Total time spent in SQL per request', LATENCY_BUCKETS),
+    'face_verification_stage_seconds': ('Face verification stage timings', LATENCY_BUCKETS),
+    'tweet_group_commit_batch_size': ('Tweets written per group commit', BATCH_SIZE_BUCKETS),
+}
+
+_local = threading.local()
+_live_histograms = {} # 登録番号 -> 実行中のスレッドの histograms
+_retired_histograms = {} # 終了したスレッドの集計値の合計
+_registry_lock = threading.Lock() # スレッドの登録・終了時と読み出し時だけ使う
+_registration_ids = itertools.count()
+
+
+class _ThreadStats:
+    def __init__(self):
+        # (メトリクス名, ラベルのタプル) -> [バケットごとの件数..., 合計値, 件数]
+        self.histograms = {}
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        hist = self.histograms.get(key)
+        buckets = _HISTOGRAM_HELP[name][1]
+        if hist is None:
+            hist = [0] * (len(buckets) + 2)
+            self.histograms[key] = hist
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            hist[index] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+
+def _thread_stats():
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _ThreadStats()
+        registration_id = next(_registration_ids)
+        with _registry_lock:
+            _live_histograms[registration_id] = stats.histograms
+        # スレッドが終了するとスレッドローカルの値が破棄されるので、そのときに合計へ移す
+        weakref.finalize(stats, _retire, registration_id)
+        _local.stats = stats
+    return stats
+
+
+def _retire(registration_id):
+    with _registry_lock:
+        histograms = _live_histograms.pop(registration_id, None)
+        if histograms:
+            _merge_into(_retired_histograms, histograms)
+
+
+def observe(name, value, **labels):
+    _thread_stats().observe(name, tuple(sorted(labels.items())), value)
+
+
+@contextmanager
+def timed(stage):
+    """顔認証などの処理段階の所要時間を計測する"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('face_verification_stage_seconds', time.perf_counter() - started, stage=stage)
+
+
+# --- SQLAlchemy のイベントフック ---
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context() and 'metrics_started' in g:
+        g.sql_statements += 1
+        g.sql_seconds += time.perf_counter() - started
+
+
+# --- 出力 ---
+
+def _merge_into(merged, histograms):
+    for key, hist in list(histograms.items()):
+        total = merged.get(key)
+        if total is None:
+            merged[key] = list(hist)
+        else:
+            for i, value in enumerate(hist):
+                total[i] += value
+
+
+def _merged_histograms():
+    with _registry_lock:
+        merged = {key: list(hist) for key, hist in _retired_histograms.items()}
+        live = list(_live_histograms.values())
+    for histograms in live:
+        _merge_into(merged, histograms)
+    return merged
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus():
+    merged = _merged_histograms()
+    lines = []
+    for name, (help_text, buckets) in _HISTOGRAM_HELP.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric_name, labels), hist in sorted(merged.items()):
+            if metric_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, hist):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {hist[-1]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {hist[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {hist[-1]}')
+
+    startup = current_app.config.get('STARTUP_METRICS') or {}
+    lines.append('# HELP app_startup_milliseconds Cold start timings')
+    lines.append('# TYPE app_startup_milliseconds gauge')
+    for phase, value in sorted(startup.items()):
+        if value is not None:
+            lines.append(f'app_startup_milliseconds{_format_labels([("phase", phase)])} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """リクエストフックと /metrics エンドポイントを登録する"""
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        observe('http_request_duration_seconds', elapsed,
+                endpoint=endpoint, method=request.method, status=response.status_code)
+        observe('http_request_sql_statements', g.sql_statements, endpoint=endpoint)
+        observe('http_request_db_seconds', g.sql_seconds, endpoint=endpoint)
+
+        if elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+            app.logger.warning(
+                'Slow request: %s %s (%s) %.1f ms, %d SQL statements, %.1f ms in DB',
+                request.method, request.path, endpoint, elapsed * 1000, g.sql_statements, g.sql_seconds * 1000
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,66 @@
+"""baseline schema (users, tweets, follows)
+
+既存の db.create_all() で作成済みのDBは `flask db stamp 0001` を実行してから upgrade する。
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 13:25:39.994151
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.Column('user_age', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('password_hash', sa.String(length=128), nullable=True),
+    sa.Column('role', sa.String(length=50), nullable=True),
+    sa.Column('bio', sa.String(length=500), nullable=True),
+    sa.Column('profile_image', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('id_card_image', sa.String(length=200), nullable=True),
+    sa.Column('face_scan_image', sa.String(length=200), nullable=True),
+    sa.Column('is_verified', sa.Boolean(), nullable=True),
+    sa.Column('verification_status', sa.String(length=50), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('follows',
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('followed_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['followed_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('follower_id', 'followed_id')
+    )
+    op.create_table('tweets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('body', sa.String(length=280), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tweets', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tweets_timestamp'), ['timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tweets', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tweets_timestamp'))
+
+    op.drop_table('tweets')
+    op.drop_table('follows')
+    op.drop_table('users')
@@ -0,0 +1,35 @@
+"""verification queue index and dashboard counters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 13:30:02.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_verification_status_id', ['verification_status', 'id'], unique=False)
+
+    op.create_table('stat_counters',
+    sa.Column('key', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    # 既存データ分のカウンターは `flask reconcile-stats` で作成する
+
+
+def downgrade():
+    op.drop_table('stat_counters')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_verification_status_id')
@@ -0,0 +1,57 @@
+"""full-text tweet search and username prefix search indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 14:02:47.530611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # 生成列なので INSERT/UPDATE 時に自動で更新される
+        op.execute(
+            "ALTER TABLE tweets ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED"
+        )
+        op.execute("CREATE INDEX ix_tweets_search_vector ON tweets USING GIN (search_vector)")
+        op.execute('CREATE INDEX ix_users_username_prefix ON users (username COLLATE "C")')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE tweets_fts USING fts5(body, content='tweets', content_rowid='id')")
+        op.execute(
+            "CREATE TRIGGER tweets_fts_ai AFTER INSERT ON tweets BEGIN "
+            "INSERT INTO tweets_fts (rowid, body) VALUES (new.id, new.body); END"
+        )
+        op.execute(
+            "CREATE TRIGGER tweets_fts_ad AFTER DELETE ON tweets BEGIN "
+            "INSERT INTO tweets_fts (tweets_fts, rowid, body) VALUES ('delete', old.id, old.body); END"
+        )
+        op.execute(
+            "CREATE TRIGGER tweets_fts_au AFTER UPDATE ON tweets BEGIN "
+            "INSERT INTO tweets_fts (tweets_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+            "INSERT INTO tweets_fts (rowid, body) VALUES (new.id, new.body); END"
+        )
+        op.execute("INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')") # 既存のツイートを索引に追加
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_users_username_prefix")
+        op.execute("DROP INDEX ix_tweets_search_vector")
+        op.execute("ALTER TABLE tweets DROP COLUMN search_vector")
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER tweets_fts_au")
+        op.execute("DROP TRIGGER tweets_fts_ad")
+        op.execute("DROP TRIGGER tweets_fts_ai")
+        op.execute("DROP TABLE tweets_fts")
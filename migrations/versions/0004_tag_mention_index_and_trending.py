@@ -0,0 +1,45 @@
+"""hashtag / mention inverted index and trending buckets
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 16:12:40.501377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tweet_tags',
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tag', 'tweet_id')
+    )
+    op.create_table('tweet_mentions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'tweet_id')
+    )
+    op.create_table('tag_trend_buckets',
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket', 'tag')
+    )
+    # 既存ツイートのインデックスは `flask reindex-tags` で作成する
+
+
+def downgrade():
+    op.drop_table('tag_trend_buckets')
+    op.drop_table('tweet_mentions')
+    op.drop_table('tweet_tags')
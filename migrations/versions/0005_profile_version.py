@@ -0,0 +1,32 @@
+"""profile version stamp and per-user tweet index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 17:05:11.342918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_version', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('tweets', schema=None) as batch_op:
+        batch_op.create_index('ix_tweets_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tweets', schema=None) as batch_op:
+        batch_op.drop_index('ix_tweets_user_id_id')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('profile_version')
@@ -0,0 +1,45 @@
+"""64-bit Snowflake tweet ids
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 18:20:36.905114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # IDはアプリ側で発行するので、連番のシーケンスは使わない。既存の連番IDはそのまま残る
+        # (どの Snowflake ID よりも小さいので、新着順の並びは変わらない)
+        op.alter_column('tweet_tags', 'tweet_id', type_=sa.BigInteger(), existing_nullable=False)
+        op.alter_column('tweet_mentions', 'tweet_id', type_=sa.BigInteger(), existing_nullable=False)
+        op.alter_column('tweets', 'id', type_=sa.BigInteger(), server_default=None, existing_nullable=False)
+        op.execute('DROP SEQUENCE IF EXISTS tweets_id_seq')
+    # SQLite の INTEGER PRIMARY KEY は元から64ビットなので型の変更は不要
+
+    # 新着順の並び替えは主キーで行うようになったため、投稿日時のインデックスは不要
+    op.drop_index('ix_tweets_timestamp', table_name='tweets')
+
+
+def downgrade():
+    op.create_index('ix_tweets_timestamp', 'tweets', ['timestamp'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # Snowflake ID のツイートが既にある場合は32ビットに収まらないため失敗する
+        op.execute('CREATE SEQUENCE tweets_id_seq OWNED BY tweets.id')
+        op.execute("SELECT setval('tweets_id_seq', COALESCE((SELECT MAX(id) FROM tweets), 0) + 1, false)")
+        op.alter_column('tweets', 'id', type_=sa.Integer(), server_default=sa.text("nextval('tweets_id_seq')"),
+                        existing_nullable=False)
+        op.alter_column('tweet_mentions', 'tweet_id', type_=sa.Integer(), existing_nullable=False)
+        op.alter_column('tweet_tags', 'tweet_id', type_=sa.Integer(), existing_nullable=False)
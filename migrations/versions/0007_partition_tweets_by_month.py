@@ -0,0 +1,90 @@
+"""Partition tweets by month (PostgreSQL)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 21:05:12.418530
+
+"""
+from datetime import datetime
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+# snowflake.py と同じ定数 (マイグレーションはアプリのモジュールに依存させない)
+SNOWFLAKE_EPOCH_MS = 1704067200000
+SNOWFLAKE_TIMESTAMP_SHIFT = 22
+
+
+def _next_month_min_id(now):
+    month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    ms = int((month - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return max(ms - SNOWFLAKE_EPOCH_MS, 0) << SNOWFLAKE_TIMESTAMP_SHIFT
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # SQLite などでは分割しない
+        return
+
+    # 既存のテーブルを今月末までのパーティション (tweets_legacy) にする。
+    # インデックス名はスキーマ内で一意なので、親テーブル側で使う名前を空けておく
+    op.execute('ALTER TABLE tweets RENAME TO tweets_legacy')
+    op.execute('ALTER INDEX tweets_pkey RENAME TO tweets_legacy_pkey')
+    op.execute('ALTER INDEX ix_tweets_user_id_id RENAME TO tweets_legacy_user_id_id_idx')
+    op.execute('ALTER INDEX ix_tweets_search_vector RENAME TO tweets_legacy_search_vector_idx')
+
+    op.execute(
+        "CREATE TABLE tweets ("
+        " id BIGINT NOT NULL,"
+        " body VARCHAR(280) NOT NULL,"
+        " timestamp TIMESTAMP WITHOUT TIME ZONE,"
+        " user_id INTEGER NOT NULL REFERENCES users (id),"
+        " search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED,"
+        " CONSTRAINT tweets_pkey PRIMARY KEY (id)"
+        ") PARTITION BY RANGE (id)"
+    )
+    op.execute('CREATE INDEX ix_tweets_user_id_id ON tweets (user_id, id)')
+    op.execute('CREATE INDEX ix_tweets_search_vector ON tweets USING GIN (search_vector)')
+    # 同じ定義のインデックスは tweets_legacy の既存のものがそのまま親のインデックスの一部になる
+    op.execute(
+        f'ALTER TABLE tweets ATTACH PARTITION tweets_legacy '
+        f'FOR VALUES FROM (MINVALUE) TO ({_next_month_min_id(datetime.utcnow())})'
+    )
+    op.execute('CREATE TABLE tweets_default PARTITION OF tweets DEFAULT')
+
+    # 外部キーは tweets_legacy を向いたままなので、親テーブルに張り直す
+    for table in ('tweet_tags', 'tweet_mentions'):
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT {table}_tweet_id_fkey')
+        op.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_tweet_id_fkey '
+            f'FOREIGN KEY (tweet_id) REFERENCES tweets (id) ON DELETE CASCADE'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # アーカイブファイルに移したツイートは戻らない
+    for table in ('tweet_tags', 'tweet_mentions'):
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT {table}_tweet_id_fkey')
+    op.execute('ALTER TABLE tweets DETACH PARTITION tweets_legacy')
+    op.execute(
+        'INSERT INTO tweets_legacy (id, body, timestamp, user_id) '
+        'SELECT id, body, timestamp, user_id FROM tweets'
+    )
+    op.execute('DROP TABLE tweets') # 月別パーティションとデフォルトパーティションも削除される
+    op.execute('ALTER TABLE tweets_legacy RENAME TO tweets')
+    op.execute('ALTER INDEX tweets_legacy_pkey RENAME TO tweets_pkey')
+    op.execute('ALTER INDEX tweets_legacy_user_id_id_idx RENAME TO ix_tweets_user_id_id')
+    op.execute('ALTER INDEX tweets_legacy_search_vector_idx RENAME TO ix_tweets_search_vector')
+    for table in ('tweet_tags', 'tweet_mentions'):
+        op.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_tweet_id_fkey '
+            f'FOREIGN KEY (tweet_id) REFERENCES tweets (id) ON DELETE CASCADE'
+        )
@@ -0,0 +1,27 @@
+"""Trigram index for substring search of unsegmented (Japanese) text
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 23:12:41.206733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # 日本語は 'simple' の tsvector では単語に分割されないので、本文の部分一致 (LIKE) をトライグラムで索引する
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_tweets_body_trgm ON tweets USING GIN (body gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_tweets_body_trgm')
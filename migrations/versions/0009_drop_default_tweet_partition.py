@@ -0,0 +1,97 @@
+"""Drop the default tweet partition (PostgreSQL)
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-20 10:41:07.583214
+
+"""
+import os
+import re
+from datetime import datetime
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+# snowflake.py と同じ定数 (マイグレーションはアプリのモジュールに依存させない)
+SNOWFLAKE_EPOCH_MS = 1704067200000
+SNOWFLAKE_TIMESTAMP_SHIFT = 22
+
+_BOUND_RE = re.compile(r"FOR VALUES FROM \('?(MINVALUE|-?\d+)'?\) TO \('?(MAXVALUE|-?\d+)'?\)")
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _min_id(month):
+    ms = int((month - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return max(ms - SNOWFLAKE_EPOCH_MS, 0) << SNOWFLAKE_TIMESTAMP_SHIFT
+
+
+def _bounds(bind):
+    rows = bind.execute(text(
+        "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'tweets'::regclass"
+    )).scalars()
+    bounds = []
+    for bound in rows:
+        lower, upper = _BOUND_RE.search(bound).groups()
+        bounds.append((None if lower == 'MINVALUE' else int(lower), None if upper == 'MAXVALUE' else int(upper)))
+    return bounds
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # PostgreSQL 15 以前ではデフォルトパーティションがあると ORDER BY id DESC LIMIT のパーティション除外が
+    # 効かないので削除する。入っている行の月と、今月から PARTITION_MONTHS_AHEAD か月先までの月別パーティションを
+    # 作り、行を移す (以後は flask create-partitions で先の月まで作っておく)
+    now = datetime.utcnow()
+    current = datetime(now.year, now.month, 1)
+    months = {_add_months(current, i) for i in range(int(os.environ.get('PARTITION_MONTHS_AHEAD', 3)) + 1)}
+    months.update(bind.execute(text(
+        f"SELECT DISTINCT date_trunc('month', to_timestamp("
+        f"((id >> {SNOWFLAKE_TIMESTAMP_SHIFT}) + {SNOWFLAKE_EPOCH_MS}) / 1000.0) AT TIME ZONE 'UTC') "
+        f"FROM tweets_default"
+    )).scalars())
+
+    # 参照しているタグ・メンションがあると切り離せないので、外部キーは移し終えてから張り直す
+    for table in ('tweet_tags', 'tweet_mentions'):
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT {table}_tweet_id_fkey')
+    op.execute('ALTER TABLE tweets DETACH PARTITION tweets_default')
+
+    bounds = _bounds(bind)
+    for month in sorted(months):
+        lower, upper = _min_id(month), _min_id(_add_months(month, 1))
+        covered = any((part_lower is None or part_lower < upper) and (part_upper is None or lower < part_upper)
+                      for part_lower, part_upper in bounds)
+        if not covered:
+            op.execute(f'CREATE TABLE tweets_p{month:%Y_%m} PARTITION OF tweets FOR VALUES FROM ({lower}) TO ({upper})')
+
+    op.execute(
+        'INSERT INTO tweets (id, body, timestamp, user_id) '
+        'SELECT id, body, timestamp, user_id FROM tweets_default'
+    )
+    op.execute('DROP TABLE tweets_default')
+    for table in ('tweet_tags', 'tweet_mentions'):
+        op.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_tweet_id_fkey '
+            f'FOREIGN KEY (tweet_id) REFERENCES tweets (id) ON DELETE CASCADE'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # 作成した月別パーティションはそのまま残す
+    op.execute('CREATE TABLE tweets_default PARTITION OF tweets DEFAULT')
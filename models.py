@@ -1,6 +1,9 @@
+from flask import current_app
 from db_instance import db
+from sqlalchemy import DDL, event
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+import snowflake
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -21,6 +24,14 @@ class User(db.Model):
     verification_status = db.Column(db.String(50), default='pending') # 本人確認のステータス (例: 'pending', 'approved', 'rejected')
     # ----------------------------------------
 
+    # プロフィールの表示内容を変更するたびに増やす (プロフィールページのフラグメントキャッシュのキーに使う)
+    profile_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # 管理画面の承認待ちキューを (status, id) のキーセットでページングするための複合インデックス
+    __table_args__ = (
+        db.Index('ix_users_verification_status_id', 'verification_status', 'id'),
+    )
+
     tweets = db.relationship('Tweet', backref='author', lazy='dynamic')
     following = db.relationship(
         'Follow',
@@ -48,13 +59,25 @@ class User(db.Model):
         return f'<User {self.username}>'
 
 
+# ツイートIDは Snowflake 形式の64ビット整数 (SQLite の INTEGER は64ビットで、rowid の別名のままにする)
+TweetId = db.BigInteger().with_variant(db.Integer(), 'sqlite')
+
+
 class Tweet(db.Model):
     __tablename__ = 'tweets'
-    id = db.Column(db.Integer, primary_key=True)
+    # 発行時刻順に増えるIDなので、新着順の並び替えとページングは主キーだけで行う
+    id = db.Column(TweetId, primary_key=True, autoincrement=False, default=snowflake.next_id)
     body = db.Column(db.String(280), nullable=False)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    # ユーザーごとのツイート一覧 (新着順のキーセットページング) と最新ツイートIDの取得用。
+    # PostgreSQL では主キーの範囲で月ごとにパーティション分割する (tweet_partitions.py を参照)
+    __table_args__ = (
+        db.Index('ix_tweets_user_id_id', 'user_id', 'id'),
+        {'postgresql_partition_by': 'RANGE (id)'},
+    )
+
     def __repr__(self):
         return f'<Tweet {self.id}: {self.body[:20]}...>'
 
@@ -66,4 +89,87 @@ class Follow(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Follower {self.follower_id} follows {self.followed_id}>'
\ No newline at end of file
+        return f'<Follower {self.follower_id} follows {self.followed_id}>'
+
+class StatCounter(db.Model):
+    """管理ダッシュボード用の集計カウンター (書き込み時にインクリメンタルに更新する)"""
+    __tablename__ = 'stat_counters'
+    key = db.Column(db.String(100), primary_key=True) # 例: 'users.status.approved', 'tweets.hour.2024-01-01T09'
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StatCounter {self.key}={self.value}>'
+
+
+class TweetTag(db.Model):
+    """ハッシュタグの転置インデックス (タグ -> ツイートID)。主キー順に読むだけでタグ別の新着順一覧になる"""
+    __tablename__ = 'tweet_tags'
+    tag = db.Column(db.String(100), primary_key=True) # 小文字化・'#' を除いたタグ
+    tweet_id = db.Column(TweetId, db.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True)
+
+    def __repr__(self):
+        return f'<TweetTag #{self.tag} {self.tweet_id}>'
+
+
+class TweetMention(db.Model):
+    """メンションの転置インデックス (メンションされたユーザーID -> ツイートID)"""
+    __tablename__ = 'tweet_mentions'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    tweet_id = db.Column(TweetId, db.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True)
+
+    def __repr__(self):
+        return f'<TweetMention {self.user_id} in {self.tweet_id}>'
+
+
+class TagTrendBucket(db.Model):
+    """トレンド集計用: 時間バケットごとのハッシュタグ出現数 (各ワーカーのリングバッファから定期的に合算される)"""
+    __tablename__ = 'tag_trend_buckets'
+    bucket = db.Column(db.BigInteger, primary_key=True) # UNIXエポック秒 // TRENDING_BUCKET_SECONDS
+    tag = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<TagTrendBucket {self.bucket} #{self.tag}={self.count}>'
+
+
+# --- 検索用のDB固有スキーマ ---
+# ツイートの全文検索インデックスはモデルのカラムにせず、DBごとのDDLで作成する
+# (PostgreSQL: 生成列 tsvector + GIN インデックス / SQLite: FTS5 仮想テーブル + トリガー)。
+# ユーザー名の前方一致検索用に、PostgreSQL ではC照合順序のインデックスも作成する。
+# db.create_all() 用の定義で、マイグレーションでは migrations/versions/0003 で同じものを作成する。
+event.listen(Tweet.__table__, 'after_create', DDL(
+    "ALTER TABLE tweets ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED"
+).execute_if(dialect='postgresql'))
+event.listen(Tweet.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_tweets_search_vector ON tweets USING GIN (search_vector)"
+).execute_if(dialect='postgresql'))
+# 空白で区切らない日本語などの部分一致検索用 (migrations/versions/0008)
+event.listen(Tweet.__table__, 'before_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+).execute_if(dialect='postgresql'))
+event.listen(Tweet.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_tweets_body_trgm ON tweets USING GIN (body gin_trgm_ops)"
+).execute_if(dialect='postgresql'))
+# パーティション: 今月より前の範囲と、今月から PARTITION_MONTHS_AHEAD か月先まで (migrations/versions/0007, 0009)
+@event.listens_for(Tweet.__table__, 'after_create')
+def _create_tweet_partitions(target, connection, **kw):
+    if connection.dialect.name != 'postgresql':
+        return
+    import tweet_partitions # tweet_partitions は models を読み込むので、ここで読み込む
+    tweet_partitions.create_initial_partitions(connection, current_app.config['PARTITION_MONTHS_AHEAD'])
+event.listen(User.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_users_username_prefix ON users (username COLLATE "C")'
+).execute_if(dialect='postgresql'))
+
+for _statement in (
+    "CREATE VIRTUAL TABLE tweets_fts USING fts5(body, content='tweets', content_rowid='id')",
+    "CREATE TRIGGER tweets_fts_ai AFTER INSERT ON tweets BEGIN "
+    "INSERT INTO tweets_fts (rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER tweets_fts_ad AFTER DELETE ON tweets BEGIN "
+    "INSERT INTO tweets_fts (tweets_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER tweets_fts_au AFTER UPDATE ON tweets BEGIN "
+    "INSERT INTO tweets_fts (tweets_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO tweets_fts (rowid, body) VALUES (new.id, new.body); END",
+):
+    event.listen(Tweet.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
@@ -0,0 +1,167 @@
+# era/ratelimit.py
+# エンドポイントごとのトークンバケット方式のレート制限 (ユーザー単位とIP単位)
+#
+# デコレータはビュー本体より前に実行されるので、DBアクセスや画像処理の前に判定される。
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, flash, jsonify, redirect, request, session, url_for
+
+
+def _refilled(tokens, updated, now, capacity, refill_per_second):
+    return min(capacity, tokens + (now - updated) * refill_per_second)
+
+
+class MemoryBucketStore:
+    """ワーカー1つの場合のプロセス内ストア (max_keys を超えたら最も長く使われていないバケットから削除する)"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> [残りトークン, 最終更新時刻]
+        self._lock = threading.Lock()
+
+    def take(self, keys, capacity, refill_per_second, cost=1):
+        """全てのバケットからトークンを消費できれば消費して 0 を、できなければ何も消費せず再試行までの秒数を返す"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = []
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = [capacity, now]
+                    self._buckets[key] = bucket
+                self._buckets.move_to_end(key)
+                tokens.append(_refilled(bucket[0], bucket[1], now, capacity, refill_per_second))
+            retry_after = max((cost - t) / refill_per_second for t in tokens)
+            for key, available in zip(keys, tokens):
+                self._buckets[key][:] = [available - cost if retry_after <= 0 else available, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return max(retry_after, 0)
+
+
+class SQLiteBucketStore:
+    """同一ホストの複数ワーカーで共有するローカルのSQLiteファイルのストア"""
+
+    def __init__(self, path, idle_seconds, purge_interval_seconds=60):
+        self.path = path
+        self.idle_seconds = idle_seconds # これだけ更新が無いバケットは満タンまで回復しているので削除できる
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = time.time()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_buckets_updated ON buckets (updated)')
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=OFF') # 再起動で消えても困らない一時データなので fsync しない
+            self._local.conn = conn
+        return conn
+
+    def take(self, keys, capacity, refill_per_second, cost=1):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE') # 読んでから書くまでを他のワーカーと排他にする
+        try:
+            tokens = []
+            for key in keys:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens.append(capacity if row is None else _refilled(row[0], row[1], now, capacity, refill_per_second))
+            retry_after = max((cost - t) / refill_per_second for t in tokens)
+            conn.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', [
+                (key, available - cost if retry_after <= 0 else available, now) for key, available in zip(keys, tokens)
+            ])
+            if now - self._last_purge >= self.purge_interval_seconds:
+                self._last_purge = now
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - self.idle_seconds,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return max(retry_after, 0)
+
+
+def init_app(app):
+    storage = app.config['RATELIMIT_STORAGE']
+    if storage == 'sqlite':
+        # 最も長い期間の制限でも、その期間だけ更新が無ければ満タンまで回復している
+        idle_seconds = max(limit['period_seconds'] for limit in app.config['RATE_LIMITS'].values())
+        store = SQLiteBucketStore(app.config['RATELIMIT_STORAGE_PATH'], idle_seconds)
+    elif storage == 'memory':
+        store = MemoryBucketStore()
+    else:
+        raise ValueError(f'Unknown RATELIMIT_STORAGE: {storage!r}')
+    app.extensions['ratelimit_store'] = store
+
+
+def client_identity():
+    """ログイン中のユーザーの識別子 (Webセッション or JWT)。未ログインなら None"""
+    if 'user_id' in session:
+        return f'user:{session["user_id"]}'
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        identity = get_jwt_identity()
+    except Exception: # JWT が検証されていないリクエスト
+        identity = None
+    return f'jwt:{identity}' if identity else None
+
+
+RATE_LIMITED_MESSAGE = 'リクエストが多すぎます。しばらくしてから再度お試しください。'
+
+
+def check_rate_limit(name, cost=1, redirect_to=None):
+    """name の制限を超えていれば 429 レスポンスを、超えていなければ None を返す
+
+    redirect_to (エンドポイント名) を指定すると、フォームからのリクエストにはメッセージを flash して
+    そのページへリダイレクトするレスポンスを返す (JSON のリクエストには 429 を返す)。
+    """
+    if not current_app.config['RATELIMIT_ENABLED']:
+        return None
+    limit = current_app.config['RATE_LIMITS'][name]
+    capacity = limit['capacity']
+    refill_per_second = capacity / limit['period_seconds']
+    store = current_app.extensions['ratelimit_store']
+
+    keys = [f'{name}:ip:{request.remote_addr}']
+    identity = client_identity()
+    if identity:
+        keys.append(f'{name}:{identity}')
+
+    # IP とユーザーの両方に余裕があるときだけ両方から消費する (片方で拒否されたらどちらも減らさない)
+    retry_after = store.take(keys, capacity, refill_per_second, cost)
+    if not retry_after:
+        return None
+    if redirect_to is not None and not request.is_json:
+        flash(RATE_LIMITED_MESSAGE, 'danger')
+        return redirect(url_for(redirect_to))
+    response = jsonify({'message': RATE_LIMITED_MESSAGE, 'status': 'rate_limited'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limit(name, methods=None, redirect_to=None):
+    """RATE_LIMITS[name] の制限をかけるデコレータ (methods を指定するとそのメソッドだけを対象にする)
+
+    HTMLのフォームを受けるビューでは redirect_to にリダイレクト先のエンドポイントを指定する。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods is None or request.method in methods:
+                limited = check_rate_limit(name, redirect_to=redirect_to)
+                if limited is not None:
+                    return limited
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
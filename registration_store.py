@@ -0,0 +1,190 @@
+# era/registration_store.py
+# 多段階登録の途中データをサーバー側に保存するストア
+#
+# Cookie のセッションには推測不能なID (registration_id) だけを入れ、
+# ユーザー名やパスワードハッシュ、アップロード画像のパスはサーバー側に置く。
+# 期限切れ・追い出しになった登録データのアップロード画像は削除する。
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, session
+from tasks import enqueue_file_deletion
+
+SESSION_KEY = 'registration_id'
+UPLOAD_FIELDS = ('profile_image', 'id_card_image')
+
+
+class MemoryStore:
+    """開発用: プロセス内のLRUストア (ワーカー間では共有されない)"""
+
+    def __init__(self, max_entries, on_discard):
+        self.max_entries = max_entries
+        self.on_discard = on_discard
+        self._entries = OrderedDict() # key -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                expired = data
+            else:
+                self._entries.move_to_end(key)
+                return data
+        self.on_discard(expired)
+        return None
+
+    def set(self, key, data, ttl):
+        evicted = []
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1][1])
+        for data in evicted:
+            self.on_discard(data)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired_keys = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+            expired = [self._entries.pop(key)[1] for key in expired_keys]
+        for data in expired:
+            self.on_discard(data)
+        return len(expired)
+
+
+class SQLiteStore:
+    """本番用: 同一ホストの全ワーカーで共有するローカルのSQLiteファイルをKVSとして使う"""
+
+    def __init__(self, path, on_discard):
+        self.path = path
+        self.on_discard = on_discard
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS registrations '
+                '(key TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_registrations_expires_at ON registrations (expires_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT data, expires_at FROM registrations WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        if row[1] <= time.time():
+            with conn:
+                deleted = conn.execute('DELETE FROM registrations WHERE key = ?', (key,)).rowcount
+            if deleted:
+                self.on_discard(data)
+            return None
+        return data
+
+    def set(self, key, data, ttl):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO registrations (key, data, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(data), time.time() + ttl)
+            )
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM registrations WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            rows = conn.execute('SELECT data FROM registrations WHERE expires_at <= ?', (now,)).fetchall()
+            conn.execute('DELETE FROM registrations WHERE expires_at <= ?', (now,))
+        for (data,) in rows:
+            self.on_discard(json.loads(data))
+        return len(rows)
+
+
+def _discard_uploads(data):
+    """登録が完了しなかったデータのアップロード画像を削除する"""
+    from app import upload_filepath
+    enqueue_file_deletion([upload_filepath(data.get(field), data.get('_upload_folder')) for field in UPLOAD_FIELDS])
+
+
+def init_app(app):
+    backend = app.config['REGISTRATION_STORE']
+    if backend == 'sqlite':
+        store = SQLiteStore(app.config['REGISTRATION_STORE_PATH'], _discard_uploads)
+    elif backend == 'memory':
+        store = MemoryStore(app.config['REGISTRATION_STORE_MAX_ENTRIES'], _discard_uploads)
+    else:
+        raise ValueError(f'Unknown REGISTRATION_STORE: {backend!r}')
+    app.extensions['registration_store'] = store
+    app.extensions['registration_store_last_purge'] = time.time()
+
+
+def _store():
+    return current_app.extensions['registration_store']
+
+
+def _maybe_purge_expired():
+    # 期限切れデータの掃除はリクエストのたびではなく、一定間隔ごとにまとめて行う
+    now = time.time()
+    if now - current_app.extensions['registration_store_last_purge'] >= current_app.config['REGISTRATION_PURGE_INTERVAL_SECONDS']:
+        current_app.extensions['registration_store_last_purge'] = now
+        _store().purge_expired()
+
+
+def load_registration():
+    """登録途中のデータを返す (無い・期限切れの場合は None)"""
+    key = session.get(SESSION_KEY)
+    if not key:
+        return None
+    return _store().get(key)
+
+
+def save_registration(data):
+    """登録途中のデータを保存する (TTLはその都度延長される)"""
+    _maybe_purge_expired()
+    key = session.get(SESSION_KEY)
+    if not key:
+        key = secrets.token_urlsafe(32)
+        session[SESSION_KEY] = key
+    # 期限切れ時にワーカー外 (CLI など) からでもファイルを特定できるよう、保存先を記録しておく
+    data = dict(data, _upload_folder=current_app.config['UPLOAD_FOLDER'])
+    _store().set(key, data, current_app.config['REGISTRATION_TTL_SECONDS'])
+
+
+def clear_registration(discard_uploads=False):
+    """登録途中のデータを削除する。登録を中断する場合は discard_uploads=True で画像も削除する"""
+    key = session.pop(SESSION_KEY, None)
+    if not key:
+        return
+    data = _store().get(key) if discard_uploads else None
+    _store().delete(key)
+    if data:
+        _discard_uploads(data)
+
+
+def purge_expired():
+    return _store().purge_expired()
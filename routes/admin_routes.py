@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, abort, current_app
+from sqlalchemy.orm import load_only
 from db_instance import db
 from models import User
+from tasks import enqueue_file_deletion
+from app import upload_filepath
+import stats
 import os
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -20,30 +24,49 @@ def before_request():
     if request.endpoint and 'admin' in request.endpoint:
         requires_admin_role()
 
+@bp.route('/dashboard')
+def dashboard():
+    # 集計済みカウンターを読むだけなので、テーブルの大きさに関係なく一定時間で表示できる
+    return render_template('admin/dashboard.html', **stats.read_dashboard())
+
+
 @bp.route('/verification')
 def verification_queue():
-    pending_users = User.query.filter_by(verification_status='uploaded_both').all()
-    return render_template('admin/verification.html', pending_users=pending_users)
+    # 承認待ちユーザーを id 昇順のキーセットページングで取得 (OFFSET は使わない)
+    page_size = current_app.config['ADMIN_QUEUE_PAGE_SIZE']
+    after_id = request.args.get('after', 0, type=int)
+
+    pending_users = User.query.options(
+        load_only(User.id, User.username, User.user_age, User.id_card_image, User.face_scan_image)
+    ).filter(
+        User.verification_status == 'uploaded_both',
+        User.id > after_id
+    ).order_by(User.id.asc()).limit(page_size + 1).all()
+
+    # 1件余分に取得して次ページの有無を判定する
+    next_after_id = None
+    if len(pending_users) > page_size:
+        pending_users = pending_users[:page_size]
+        next_after_id = pending_users[-1].id
+
+    return render_template(
+        'admin/verification.html',
+        pending_users=pending_users,
+        next_after_id=next_after_id,
+        is_first_page=(after_id == 0)
+    )
 
 
 def delete_images(user):
     """ユーザーの関連画像ファイルをサーバーから削除するヘルパー関数"""
-    if user.id_card_image:
-        try:
-            filepath = os.path.join('static', user.id_card_image.split('uploads/')[1])
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except Exception:
-            pass
-        user.id_card_image = None
-    if user.face_scan_image:
+    for filepath in (upload_filepath(user.id_card_image), upload_filepath(user.face_scan_image)):
         try:
-            filepath = os.path.join('static', user.face_scan_image.split('uploads/')[1])
-            if os.path.exists(filepath):
+            if filepath and os.path.exists(filepath):
                 os.remove(filepath)
         except Exception:
             pass
-        user.face_scan_image = None
+    user.id_card_image = None
+    user.face_scan_image = None
 
 @bp.route('/verification/approve/<int:user_id>', methods=['POST'])
 def approve_user(user_id):
@@ -54,6 +77,7 @@ def approve_user(user_id):
     user.is_verified = True
     user.verification_status = 'approved'
     delete_images(user) # 承認後に画像を削除
+    stats.record_status_change('uploaded_both', 'approved')
     db.session.commit()
 
     flash(f'{user.username}の本人確認を承認し、関連画像を削除しました。', 'success')
@@ -69,7 +93,63 @@ def reject_user(user_id):
     user.is_verified = False
     user.verification_status = 'rejected'
     delete_images(user) # 拒否後に画像を削除
+    stats.record_status_change('uploaded_both', 'rejected')
     db.session.commit()
 
     flash(f'{user.username}の本人確認を拒否し、関連画像を削除しました。', 'danger')
-    return jsonify({'message': '拒否完了'})
\ No newline at end of file
+    return jsonify({'message': '拒否完了'})
+
+
+@bp.route('/verification/bulk', methods=['POST'])
+def bulk_update_verification():
+    """複数ユーザーの本人確認を1トランザクションで一括承認/拒否するAPIエンドポイント"""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    user_ids = data.get('user_ids')
+
+    if action not in ('approve', 'reject'):
+        return jsonify({'message': 'action は approve または reject を指定してください。'}), 400
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'message': 'user_ids を指定してください。'}), 400
+    try:
+        user_ids = sorted({int(user_id) for user_id in user_ids})
+    except (TypeError, ValueError):
+        return jsonify({'message': 'user_ids は整数のリストで指定してください。'}), 400
+    if len(user_ids) > current_app.config['ADMIN_BULK_MAX_IDS']:
+        return jsonify({'message': f'一度に処理できるのは{current_app.config["ADMIN_BULK_MAX_IDS"]}件までです。'}), 400
+
+    try:
+        # 承認待ちの行だけをロックして取得し、画像パスを控えてから1回のUPDATEで更新する
+        rows = db.session.query(User.id, User.id_card_image, User.face_scan_image).filter(
+            User.id.in_(user_ids),
+            User.verification_status == 'uploaded_both'
+        ).with_for_update().all()
+        processed_ids = [row.id for row in rows]
+
+        if processed_ids:
+            new_status = 'approved' if action == 'approve' else 'rejected'
+            db.session.query(User).filter(User.id.in_(processed_ids)).update({
+                User.is_verified: action == 'approve',
+                User.verification_status: new_status,
+                User.id_card_image: None,
+                User.face_scan_image: None
+            }, synchronize_session=False)
+            stats.record_status_change('uploaded_both', new_status, count=len(processed_ids))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'一括処理に失敗しました: {str(e)}'}), 500
+
+    # 画像ファイルの削除はコミット後にバックグラウンドワーカーへ任せる
+    filepaths = []
+    for row in rows:
+        filepaths.append(upload_filepath(row.id_card_image))
+        filepaths.append(upload_filepath(row.face_scan_image))
+    enqueue_file_deletion(filepaths)
+
+    skipped_ids = sorted(set(user_ids) - set(processed_ids))
+    return jsonify({
+        'message': f'{len(processed_ids)}件を{"承認" if action == "approve" else "拒否"}しました。',
+        'processed_ids': processed_ids,
+        'skipped_ids': skipped_ids
+    })
\ No newline at end of file
@@ -1,7 +1,16 @@
 # era/routes/api_routes.py
-from flask import Blueprint, request, jsonify, g # g はリクエスト固有のデータを保存するオブジェクト
-from db_instance import db
+from flask import Blueprint, request, jsonify, g, current_app # g はリクエスト固有のデータを保存するオブジェクト
+from sqlalchemy import select
+from db_instance import db, replica_reads
 import models
+from serializers import iter_json_array, iter_ndjson, stream_response
+from ratelimit import rate_limit, check_rate_limit
+import search
+import hashtags
+import trending
+import user_data
+import fragment_cache
+from tweet_writes import publish_tweet, create_tweets, GroupCommitTimeout
 from flask_jwt_extended import jwt_required, get_jwt_identity, JWTManager # JWTManagerもインポート
 
 # API用のBlueprintを作成
@@ -31,6 +40,7 @@ def role_required(required_roles):
 # 投稿作成API (認証必須)
 @bp.route('/tweets', methods=['POST'])
 @jwt_required() # JWT認証必須
+@rate_limit('tweet_write')
 def create_tweet_api():
     # トークンから認証済みのユーザー名を取得
     username = get_jwt_identity()
@@ -47,38 +57,87 @@ def create_tweet_api():
     if len(body) > 280:
         return jsonify({"message": "Tweet body must be 280 characters or less"}), 400
 
-    tweet = models.Tweet(body=body, user_id=current_user.id)
-    db.session.add(tweet)
+    try:
+        tweet_id = publish_tweet(current_user.id, body)
+    except GroupCommitTimeout as e:
+        if e.started:
+            return jsonify({"message": "Server is busy, tweet may not have been created"}), 503
+        return jsonify({"message": "Server is busy, tweet was not created"}), 503
+
+    return jsonify({"message": "Tweet created successfully", "tweet_id": str(tweet_id)}), 201
+
+# 複数ツイートの一括投稿API (認証必須): 1回の INSERT・1回のコミットでまとめて書き込む
+@bp.route('/tweets/batch', methods=['POST'])
+@jwt_required()
+def create_tweets_batch_api():
+    data = request.get_json(silent=True) or {}
+    tweets = data.get('tweets')
+    max_size = current_app.config['TWEET_BATCH_MAX_SIZE']
+    if not isinstance(tweets, list) or not tweets:
+        return jsonify({"message": "'tweets' must be a non-empty list of {\"body\": ...}"}), 400
+    if len(tweets) > max_size:
+        return jsonify({"message": f"At most {max_size} tweets can be created per request"}), 400
+
+    bodies = []
+    for index, tweet in enumerate(tweets):
+        body = tweet.get('body') if isinstance(tweet, dict) else None
+        if not body or not isinstance(body, str):
+            return jsonify({"message": f"tweets[{index}]: Tweet body is required"}), 400
+        if len(body) > 280:
+            return jsonify({"message": f"tweets[{index}]: Tweet body must be 280 characters or less"}), 400
+        bodies.append(body)
+
+    # 投稿件数分のトークンを JWT の識別子で消費する (検証を通ったリクエストだけを数える)。
+    # 制限を超えたリクエストではユーザーの検索もしない
+    limited = check_rate_limit('tweet_write', cost=len(bodies))
+    if limited is not None:
+        return limited
+
+    current_user = models.User.query.filter_by(username=get_jwt_identity()).first()
+    if not current_user:
+        return jsonify({"message": "User not found (from token)"}), 404
+
+    tweet_ids = create_tweets(current_user.id, [(body, None) for body in bodies])
     db.session.commit()
 
-    return jsonify({"message": "Tweet created successfully", "tweet_id": tweet.id}), 201
+    return jsonify({"message": "Tweets created successfully", "tweet_ids": [str(tweet_id) for tweet_id in tweet_ids]}), 201
 
 # 自分のツイート取得API (認証必須)
 @bp.route('/my_tweets', methods=['GET'])
 @jwt_required() # JWT認証必須
+@replica_reads
 def get_my_tweets_api():
     username = get_jwt_identity()
-    current_user = models.User.query.filter_by(username=username).first()
+    current_user_id = db.session.query(models.User.id).filter_by(username=username).scalar()
 
-    if not current_user:
+    if not current_user_id:
         return jsonify({"message": "User not found (from token)"}), 404
 
-    # 自分のツイートを新しい順に取得
-    tweets = current_user.tweets.order_by(models.Tweet.timestamp.desc()).all()
+    # 自分のツイートを新しい順に、ORMオブジェクトではなく列のタプルとしてサーバーサイドカーソルで少しずつ読む
+    # (ツイートIDは発行時刻順なので主キーで並べる。before を指定するとそのIDより古いものだけを返す)
+    stmt = (
+        select(models.Tweet.id, models.Tweet.body, models.Tweet.timestamp)
+        .where(models.Tweet.user_id == current_user_id)
+        .order_by(models.Tweet.id.desc())
+        .execution_options(yield_per=current_app.config['STREAM_YIELD_PER'])
+    )
+    before_id = request.args.get('before', type=int)
+    if before_id is not None:
+        stmt = stmt.where(models.Tweet.id < before_id)
+    rows = db.session.execute(stmt)
 
-    # ツイートのリストをJSON形式で整形して返す
-    tweet_list = []
-    for tweet in tweets:
-        tweet_list.append({
-            "id": tweet.id,
-            "body": tweet.body,
-            "timestamp": tweet.timestamp.isoformat(), # 日時をISO形式の文字列に変換
-            "author_username": current_user.username
-        })
-    return jsonify(tweet_list), 200
+    # 1行ずつJSONにエンコードしてストリーミングで返す (日時はエンコーダーがISO形式に変換する)
+    tweets = ({
+        "id": str(tweet_id),
+        "body": body,
+        "timestamp": timestamp,
+        "author_username": username
+    } for tweet_id, body, timestamp in rows)
+    return stream_response(iter_json_array(tweets))
 
 # ユーザープロフィール取得API (誰でもアクセス可能)
 @bp.route('/users/<username>', methods=['GET'])
+@replica_reads
 def get_user_profile_api(username):
     user = models.User.query.filter_by(username=username).first()
     if not user:
@@ -96,6 +155,97 @@ def get_user_profile_api(username):
     }), 200
 
 
+def _page_limit(default_key):
+    """limit パラメータを 1..SEARCH_MAX_PAGE_SIZE に丸めて返す"""
+    limit = request.args.get('limit', current_app.config[default_key], type=int)
+    return max(1, min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE']))
+
+
+def _id_string(tweet_id):
+    # Snowflake ID は 2^53 を超えるので、JavaScript で丸められないよう文字列で返す (カーソルの before も同じ形式で受け取る)
+    return None if tweet_id is None else str(tweet_id)
+
+
+def _tweet_page(rows, limit):
+    return {
+        "results": [{
+            "id": _id_string(tweet_id),
+            "body": body,
+            "timestamp": timestamp.isoformat(),
+            "author_username": author_username
+        } for tweet_id, body, timestamp, author_username in rows],
+        "next_before": _id_string(rows[-1].id) if len(rows) == limit else None
+    }
+
+
+# ツイート全文検索API (誰でもアクセス可能)
+@bp.route('/search/tweets', methods=['GET'])
+@replica_reads
+def search_tweets_api():
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({"message": "Query parameter 'q' is required"}), 400
+    limit = _page_limit('SEARCH_PAGE_SIZE')
+    before_id = request.args.get('before', type=int) # 前ページの最後のツイートID
+
+    # 一定期間分を遡っても limit 件に届かなかった場合は、件数が少なくても次ページのカーソルを返す
+    rows, next_before = search.search_tweets(q, before_id=before_id, limit=limit)
+    return jsonify(dict(_tweet_page(rows, limit), next_before=_id_string(next_before))), 200
+
+
+# ユーザー名の前方一致検索API (入力補完用、誰でもアクセス可能)
+@bp.route('/search/users', methods=['GET'])
+@replica_reads
+def search_users_api():
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({"message": "Query parameter 'q' is required"}), 400
+    limit = _page_limit('USER_SEARCH_PAGE_SIZE')
+    after_username = request.args.get('after') # 前ページの最後のユーザー名
+
+    rows = search.search_users(q, after_username=after_username, limit=limit)
+    return jsonify({
+        "results": [{
+            "username": username,
+            "profile_image": profile_image
+        } for _, username, profile_image in rows],
+        "next_after": rows[-1].username if len(rows) == limit else None
+    }), 200
+
+
+# ハッシュタグ別のツイート一覧API (誰でもアクセス可能)
+@bp.route('/tags/<tag>', methods=['GET'])
+@replica_reads
+def get_tag_tweets_api(tag):
+    limit = _page_limit('SEARCH_PAGE_SIZE')
+    before_id = request.args.get('before', type=int) # 前ページの最後のツイートID
+    rows = hashtags.tweets_with_tag(tag, before_id=before_id, limit=limit)
+    return jsonify(dict(_tweet_page(rows, limit), tag=hashtags.normalize_tag(tag))), 200
+
+
+# ユーザーへのメンション一覧API (誰でもアクセス可能)
+@bp.route('/users/<username>/mentions', methods=['GET'])
+@replica_reads
+def get_user_mentions_api(username):
+    user_id = db.session.query(models.User.id).filter_by(username=username).scalar()
+    if not user_id:
+        return jsonify({"message": "User not found"}), 404
+    limit = _page_limit('SEARCH_PAGE_SIZE')
+    before_id = request.args.get('before', type=int)
+    rows = hashtags.tweets_mentioning(user_id, before_id=before_id, limit=limit)
+    return jsonify(_tweet_page(rows, limit)), 200
+
+
+# トレンドのハッシュタグAPI (誰でもアクセス可能)
+@bp.route('/trending', methods=['GET'])
+def get_trending_api():
+    limit = _page_limit('TRENDING_LIMIT')
+    return jsonify({
+        "window_seconds": trending.window_seconds(),
+        "results": [{"tag": tag, "count": count} for tag, count in trending.top_tags(limit)]
+    }), 200
+
+
 # プロフィール編集API (認証必須: 自分のプロフィールのみ)
 @bp.route('/profile/edit', methods=['PUT']) # PUTメソッドで更新
 @jwt_required() # JWT認証必須
@@ -113,6 +263,8 @@ def edit_profile_api():
         current_user.bio = data['bio']
     if 'profile_image' in data:
         current_user.profile_image = data['profile_image']
+    if 'bio' in data or 'profile_image' in data:
+        fragment_cache.bump_profile_version(current_user) # プロフィールページのキャッシュを使わないようにする
     
     # 必要に応じて、他のプロフィール項目（例: user_age, email）もここで更新可能
     # ただし、username の変更は通常別途ロジックが必要（ユニーク制約など）
@@ -125,6 +277,40 @@ def edit_profile_api():
         return jsonify({"message": f"Failed to update profile: {str(e)}"}), 500
 
 
+# 自分のデータのエクスポートAPI (認証必須): プロフィール・ツイート・フォロー先を NDJSON でストリーミングする
+@bp.route('/export', methods=['GET'])
+@jwt_required()
+@replica_reads
+def export_api():
+    username = get_jwt_identity()
+    current_user = models.User.query.filter_by(username=username).first()
+    if not current_user:
+        return jsonify({"message": "User not found (from token)"}), 404
+
+    records = user_data.export_records(current_user, yield_per=current_app.config['STREAM_YIELD_PER'])
+    response = stream_response(iter_ndjson(records), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="export.ndjson"'
+    return response
+
+
+# 自分のアカウントへのインポートAPI (認証必須): リクエスト本文の NDJSON を少しずつ読んで一括で書き込む
+@bp.route('/import', methods=['POST'])
+@jwt_required()
+@rate_limit('data_import')
+def import_api():
+    username = get_jwt_identity()
+    current_user = models.User.query.filter_by(username=username).first()
+    if not current_user:
+        return jsonify({"message": "User not found (from token)"}), 404
+
+    records = user_data.read_records(request.stream)
+    try:
+        counts = user_data.import_records(current_user, records, chunk_size=current_app.config['IMPORT_CHUNK_SIZE'])
+    except user_data.ImportFormatError as e:
+        return jsonify({"message": f"Invalid import data: {e}", "imported": e.imported}), 400
+    return jsonify({"message": "Import completed", "imported": counts}), 200
+
+
 # 例: 管理者のみがアクセスできるAPI (role_requiredデコレータの使用例)
 # @bp.route('/admin/users', methods=['GET'])
 # @role_required(['admin']) # 'admin'ロールを持つユーザーのみアクセス可能
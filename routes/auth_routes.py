@@ -3,11 +3,16 @@ from db_instance import db
 import models
 from werkzeug.security import generate_password_hash
 from flask_jwt_extended import create_access_token
+import stats
+import metrics
+from registration_store import load_registration, save_registration, clear_registration
+from tasks import enqueue_file_deletion
+from ratelimit import rate_limit
 from werkzeug.utils import secure_filename
 import uuid
 import os
 import base64
-from app import allowed_file
+from app import allowed_file, upload_filepath
 import face_recognition # face_recognitionをインポート
 import numpy as np
 import cv2 # cv2は画像処理ライブラリであり、face_recognitionと連携して使用することがあります。
@@ -47,6 +52,7 @@ def register():
         user.set_password(password)
         try:
             db.session.add(user)
+            stats.record_registration('pending')
             db.session.commit()
             return jsonify({'message': 'User registered successfully'}), 201
         except Exception as e:
@@ -99,15 +105,16 @@ def register():
                 flash(f'プロフィール画像の保存に失敗しました: {str(e)}', 'danger')
                 return redirect(url_for('auth.register'))
 
-        # フォームデータをセッションに保存して次のステップへ
-        session['registration_data'] = {
+        # 入力内容はサーバー側に保存し、Cookieには登録IDだけを持たせて次のステップへ
+        clear_registration(discard_uploads=True) # やり直しの場合は前回のデータと画像を破棄
+        save_registration({
             'username': username,
             'user_age': user_age,
             'email': email,
             'password_hash': generate_password_hash(password),
             'bio': bio,
             'profile_image': profile_image_path
-        }
+        })
         
         flash('基本情報の登録が完了しました。次に身分証明書をアップロードしてください。', 'success')
         return redirect(url_for('auth.register_id_card'))
@@ -119,8 +126,9 @@ def register():
 @bp.route('/register/id_card', methods=['GET', 'POST'])
 def register_id_card():
     """ステップ2: 身分証明書アップロード"""
-    # セッションに登録データがなければ最初の登録ページに戻す
-    if 'registration_data' not in session:
+    # 登録データがなければ (期限切れを含む) 最初の登録ページに戻す
+    registration_data = load_registration()
+    if registration_data is None:
         flash('アカウント登録を最初からやり直してください。', 'warning')
         return redirect(url_for('auth.register'))
 
@@ -140,8 +148,11 @@ def register_id_card():
             file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
             file.save(file_path)
             
-            # セッションに画像パスを保存
-            session['registration_data']['id_card_image'] = url_for('static', filename=f'uploads/{unique_filename}')
+            # 登録データに画像パスを保存 (再アップロードの場合は前の画像を削除)
+            if registration_data.get('id_card_image'):
+                enqueue_file_deletion([upload_filepath(registration_data['id_card_image'])])
+            registration_data['id_card_image'] = url_for('static', filename=f'uploads/{unique_filename}')
+            save_registration(registration_data)
             flash('身分証明書がアップロードされました。次に顔写真を撮影してください。', 'success')
 
             return redirect(url_for('auth.register_face_scan'))
@@ -155,7 +166,8 @@ def register_id_card():
 @bp.route('/register/face_scan', methods=['GET'])
 def register_face_scan():
     """ステップ3: 顔写真撮影と認証"""
-    if 'registration_data' not in session or 'id_card_image' not in session['registration_data']:
+    registration_data = load_registration()
+    if registration_data is None or 'id_card_image' not in registration_data:
         flash('アカウント登録を最初からやり直してください。', 'warning')
         return redirect(url_for('auth.register'))
     
@@ -163,9 +175,11 @@ def register_face_scan():
 
 
 @bp.route('/register/verify_face', methods=['POST'])
+@rate_limit('face_verify')
 def register_verify_face():
     """顔写真のアップロードと顔照合のAPIエンドポイント"""
-    if 'registration_data' not in session or 'id_card_image' not in session['registration_data']:
+    registration_data = load_registration()
+    if registration_data is None or 'id_card_image' not in registration_data:
         return jsonify({'message': 'セッション情報が無効です。アカウント登録を最初からやり直してください。', 'redirect_url': url_for('auth.register')}), 400
 
     data = request.get_json()
@@ -175,32 +189,36 @@ def register_verify_face():
 
     try:
         # 身分証明書の画像パスを取得
-        id_card_image_path = session['registration_data']['id_card_image']
+        id_card_image_path = registration_data['id_card_image']
         id_card_image_full_path = os.path.join(current_app.root_path, id_card_image_path.lstrip('/'))
         
         # 顔写真をファイルとして保存
-        header, encoded = face_scan_image_data.split(",", 1)
-        binary_data = base64.b64decode(encoded)
-        unique_filename = str(uuid.uuid4()) + '_face_scan.png'
-        face_scan_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        with open(face_scan_file_path, 'wb') as f:
-            f.write(binary_data)
+        with metrics.timed('save_image'):
+            header, encoded = face_scan_image_data.split(",", 1)
+            binary_data = base64.b64decode(encoded)
+            unique_filename = str(uuid.uuid4()) + '_face_scan.png'
+            face_scan_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+            with open(face_scan_file_path, 'wb') as f:
+                f.write(binary_data)
         face_scan_image_path = url_for('static', filename=f'uploads/{unique_filename}')
 
         # --- 顔照合ロジック ---
         is_match = False
         try:
             # 身分証明書の画像を読み込み、顔エンコーディングを生成
-            id_card_img_np = face_recognition.load_image_file(id_card_image_full_path)
-            id_card_face_encodings = face_recognition.face_encodings(id_card_img_np)
+            with metrics.timed('id_card_encoding'):
+                id_card_img_np = face_recognition.load_image_file(id_card_image_full_path)
+                id_card_face_encodings = face_recognition.face_encodings(id_card_img_np)
 
             # 撮影した顔写真を読み込み、顔エンコーディングを生成
-            face_scan_img_np = face_recognition.load_image_file(face_scan_file_path)
-            face_scan_face_encodings = face_recognition.face_encodings(face_scan_img_np)
+            with metrics.timed('face_scan_encoding'):
+                face_scan_img_np = face_recognition.load_image_file(face_scan_file_path)
+                face_scan_face_encodings = face_recognition.face_encodings(face_scan_img_np)
 
             if id_card_face_encodings and face_scan_face_encodings:
                 # 2つの顔を比較
-                matches = face_recognition.compare_faces([id_card_face_encodings[0]], face_scan_face_encodings[0])
+                with metrics.timed('compare'):
+                    matches = face_recognition.compare_faces([id_card_face_encodings[0]], face_scan_face_encodings[0])
                 is_match = matches[0]
             else:
                 return jsonify({'message': '顔を検出できませんでした。もう一度お試しください。', 'status': 'failed', 'redirect_url': url_for('auth.register_face_scan')}), 400
@@ -212,7 +230,6 @@ def register_verify_face():
 
         if is_match:
             # 照合成功、データベースにユーザーを登録（Adminの年齢確認待ち）
-            registration_data = session.pop('registration_data')
             new_user = models.User(
                 username=registration_data['username'],
                 user_age=registration_data['user_age'],
@@ -227,19 +244,21 @@ def register_verify_face():
                 role='user'
             )
             db.session.add(new_user)
+            stats.record_registration('uploaded_both')
             db.session.commit()
+            clear_registration() # 画像はユーザーに引き継ぐので削除しない
             
             return jsonify({'message': '顔認証が成功しました。次に、Adminが生年月日と年齢を照合します。', 'status': 'success', 'redirect_url': url_for('auth.login')}), 200
         else:
             # 認証失敗、最初からやり直させる
             if os.path.exists(face_scan_file_path):
                 os.remove(face_scan_file_path)
-            session.pop('registration_data', None)
+            clear_registration(discard_uploads=True)
             return jsonify({'message': '顔認証に失敗しました。もう一度登録し直してください。', 'status': 'failed', 'redirect_url': url_for('auth.register')}), 400
     
     except Exception as e:
         db.session.rollback()
-        session.pop('registration_data', None)
+        clear_registration(discard_uploads=True)
         return jsonify({'message': f'登録中にエラーが発生しました: {str(e)}', 'status': 'error', 'redirect_url': url_for('auth.register')}), 500
 
     return jsonify({'message': '無効なリクエストです。'}), 400
@@ -247,6 +266,7 @@ def register_verify_face():
 
 # 既存の login と logout ルートは変更なし
 @bp.route('/login', methods=['GET', 'POST'])
+@rate_limit('login', methods=('POST',), redirect_to='auth.login')
 def login():
     # ... 既存のロジック ...
     if request.is_json:
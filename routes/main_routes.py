@@ -1,15 +1,21 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
-from db_instance import db
+from db_instance import db, replica_reads
 from models import User, Tweet, Follow
-from sqlalchemy import or_
+from sqlalchemy import func, or_
 from werkzeug.utils import secure_filename
 import uuid
 from app import allowed_file # app.pyからヘルパー関数をインポート
 import os
+import stats
+import fragment_cache
+import tweet_archive
+from ratelimit import rate_limit
+from tweet_writes import publish_tweet, GroupCommitTimeout
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
+@replica_reads
 def index():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
@@ -28,13 +34,21 @@ def index():
     # 自分のIDもツイート表示対象に含める
     display_user_ids = followed_users_ids + [logged_in_user.id]
 
-    # 該当ユーザーのツイートをタイムスタンプ降順で取得
-    tweets = Tweet.query.filter(Tweet.user_id.in_(display_user_ids)).order_by(Tweet.timestamp.desc()).all()
+    # 該当ユーザーのツイートを新しい順に1ページ分取得 (ツイートIDは発行時刻順なので主キーでページングする)
+    page_size = current_app.config['TIMELINE_PAGE_SIZE']
+    before_id = request.args.get('before', type=int) # 前ページの最後のツイートID
+    query = Tweet.query.filter(Tweet.user_id.in_(display_user_ids))
+    if before_id is not None:
+        query = query.filter(Tweet.id < before_id)
+    tweets = query.order_by(Tweet.id.desc()).limit(page_size).all()
+    next_before_id = tweets[-1].id if len(tweets) == page_size else None
 
-    return render_template('index.html', user=logged_in_user, tweets=tweets)
+    return render_template('index.html', user=logged_in_user, tweets=tweets,
+                           next_before_id=next_before_id, is_first_page=before_id is None)
 
 
 @bp.route('/post_tweet', methods=['POST'])
+@rate_limit('tweet_write', redirect_to='main.index')
 def post_tweet():
     if 'user_id' not in session:
         flash('ログインしてください。', 'danger')
@@ -49,17 +63,22 @@ def post_tweet():
         flash('ツイートは280文字以内で入力してください。', 'danger')
         return redirect(url_for('main.index'))
 
-    tweet = Tweet(body=body, user_id=session['user_id'])
-    db.session.add(tweet)
-    db.session.commit()
+    try:
+        publish_tweet(session['user_id'], body)
+    except GroupCommitTimeout as e:
+        if e.started:
+            flash('混み合っているため投稿を確認できませんでした。タイムラインで投稿されたか確認してください。', 'warning')
+        else:
+            flash('混み合っているため投稿できませんでした。しばらくしてから再度お試しください。', 'danger')
+        return redirect(url_for('main.index'))
     flash('ツイートが投稿されました！', 'success')
     return redirect(url_for('main.index'))
 
 
 @bp.route('/profile/<username>', methods=['GET', 'POST'])
+@replica_reads # GETのみレプリカから読む
 def profile(username):
     target_user = User.query.filter_by(username=username).first_or_404()
-    tweets = target_user.tweets.order_by(Tweet.timestamp.desc()).all()
 
     # ログイン中のユーザーが自分のプロフィールを見ているか
     is_current_user_profile = ('user_id' in session and session['user_id'] == target_user.id)
@@ -109,6 +128,7 @@ def profile(username):
         
         target_user.bio = bio # データベースのbioを更新
         target_user.profile_image = profile_image_path # データベースのprofile_imageを更新
+        fragment_cache.bump_profile_version(target_user) # キャッシュ済みのヘッダー・ツイート一覧を使わないようにする
 
         try:
             db.session.commit()
@@ -120,15 +140,50 @@ def profile(username):
         return redirect(url_for('main.profile', username=username)) # 更新後、プロフィールページにリダイレクト
 
     # GETリクエストの場合、またはPOSTでエラーがあった場合は表示
+    # ヘッダーとツイート一覧は閲覧者によらないので、プロフィールのバージョンと最新ツイートIDをキーにキャッシュする。
+    # フォローボタンと編集フォームだけをリクエストごとに描画する
+    # ツイート一覧は主キーでページングする。2ページ目以降は before より古いツイートだけで決まる
+    before_id = request.args.get('before', type=int)
+    if before_id is None:
+        page_key = db.session.query(func.max(Tweet.id)).filter(Tweet.user_id == target_user.id).scalar()
+    else:
+        page_key = ('before', before_id)
+    header_html = fragment_cache.cached(
+        ('profile_header', target_user.id, target_user.profile_version),
+        lambda: render_template('profile/header.html', target_user=target_user)
+    )
+    tweets_html = fragment_cache.cached(
+        ('profile_tweets', target_user.id, target_user.profile_version, page_key),
+        lambda: _render_profile_tweets(target_user, before_id)
+    )
     return render_template(
         'profile.html',
         target_user=target_user,
-        tweets=tweets,
+        header_html=header_html,
+        tweets_html=tweets_html,
         is_following=is_following,
         is_current_user_profile=is_current_user_profile # テンプレートにフラグを渡す
     )
 
-    return render_template('profile.html', target_user=target_user, tweets=tweets, is_following=is_following)
+def _render_profile_tweets(target_user, before_id):
+    page_size = current_app.config['TIMELINE_PAGE_SIZE']
+    query = target_user.tweets
+    if before_id is not None:
+        query = query.filter(Tweet.id < before_id)
+    tweets = query.order_by(Tweet.id.desc()).limit(page_size).all()
+    if len(tweets) < page_size:
+        # テーブルに残っているツイートを読み切ったら、アーカイブ済みの古いツイートを続けて読む
+        tweets += tweet_archive.user_tweets(
+            current_app.config['ARCHIVE_DIR'], target_user,
+            before_id=tweets[-1].id if tweets else before_id, limit=page_size - len(tweets)
+        )
+    return render_template(
+        'profile/tweets.html',
+        target_user=target_user,
+        tweets=tweets,
+        next_before_id=tweets[-1].id if len(tweets) == page_size else None,
+        is_first_page=before_id is None
+    )
 
 @bp.route('/follow/<username>')
 def follow(username):
@@ -153,6 +208,7 @@ def follow(username):
     else:
         follow_record = Follow(follower_id=logged_in_user.id, followed_id=target_user.id)
         db.session.add(follow_record)
+        stats.record_follow(1)
         db.session.commit()
         flash(f'{username}さんをフォローしました！', 'success')
 
@@ -179,6 +235,7 @@ def unfollow(username):
 
     if follow_record:
         db.session.delete(follow_record)
+        stats.record_follow(-1)
         db.session.commit()
         flash(f'{username}さんのフォローを解除しました。', 'info')
     else:
@@ -8,6 +8,9 @@ import uuid
 import os
 import base64
 from app import allowed_file
+import stats
+import metrics
+from ratelimit import rate_limit
 import face_recognition # face_recognitionをインポート
 import numpy as np
 import cv2 # cv2をインポート
@@ -62,6 +65,7 @@ def upload_id_card():
                 id_card_image_path = url_for('static', filename=f'uploads/{unique_filename}')
                 
                 user.id_card_image = id_card_image_path
+                stats.record_status_change(user.verification_status, 'uploaded_id')
                 user.verification_status = 'uploaded_id' # ステータス更新
                 db.session.commit()
                 flash('身分証明書がアップロードされました。次に顔写真を撮影してください。', 'success')
@@ -98,6 +102,7 @@ def capture_face():
 # 4. 顔写真アップロードと認証処理 (APIエンドポイントとして実装)
 # フロントエンド（JavaScript）からカメラで撮影した画像データをPOSTする
 @bp.route('/verify_face', methods=['POST'])
+@rate_limit('face_verify')
 def verify_face():
     """顔写真アップロードと顔照合のAPIエンドポイント"""
     if 'user_id' not in session:
@@ -123,24 +128,28 @@ def verify_face():
         id_card_image_full_path = os.path.join(current_app.root_path, user.id_card_image.lstrip('/'))
 
         # 顔写真をファイルとして保存
-        header, encoded = image_data.split(",", 1)
-        binary_data = base64.b64decode(encoded)
-        unique_filename = str(uuid.uuid4()) + '_face_scan.png'
-        face_scan_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        with open(face_scan_file_path, 'wb') as f:
-            f.write(binary_data)
+        with metrics.timed('save_image'):
+            header, encoded = image_data.split(",", 1)
+            binary_data = base64.b64decode(encoded)
+            unique_filename = str(uuid.uuid4()) + '_face_scan.png'
+            face_scan_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+            with open(face_scan_file_path, 'wb') as f:
+                f.write(binary_data)
         face_scan_image_path = url_for('static', filename=f'uploads/{unique_filename}')
 
         # --- 顔照合ロジック ---
         is_match = False
         try:
-            id_card_img_np = face_recognition.load_image_file(id_card_image_full_path)
-            id_card_face_encodings = face_recognition.face_encodings(id_card_img_np)
-            face_scan_img_np = face_recognition.load_image_file(face_scan_file_path)
-            face_scan_face_encodings = face_recognition.face_encodings(face_scan_img_np)
+            with metrics.timed('id_card_encoding'):
+                id_card_img_np = face_recognition.load_image_file(id_card_image_full_path)
+                id_card_face_encodings = face_recognition.face_encodings(id_card_img_np)
+            with metrics.timed('face_scan_encoding'):
+                face_scan_img_np = face_recognition.load_image_file(face_scan_file_path)
+                face_scan_face_encodings = face_recognition.face_encodings(face_scan_img_np)
 
             if id_card_face_encodings and face_scan_face_encodings:
-                matches = face_recognition.compare_faces([id_card_face_encodings[0]], face_scan_face_encodings[0])
+                with metrics.timed('compare'):
+                    matches = face_recognition.compare_faces([id_card_face_encodings[0]], face_scan_face_encodings[0])
                 is_match = matches[0]
             else:
                 return jsonify({'message': '顔を検出できませんでした。もう一度お試しください。', 'status': 'failed'}), 400
@@ -152,6 +161,7 @@ def verify_face():
         if is_match:
             # 照合成功、ステータスを更新（Adminの年齢確認待ち）
             user.face_scan_image = face_scan_image_path
+            stats.record_status_change(user.verification_status, 'uploaded_both')
             user.verification_status = 'uploaded_both'
             db.session.commit()
             
@@ -0,0 +1,112 @@
+# era/search.py
+# ツイートの全文検索とユーザー名の前方一致検索 (どちらもキーセットページング)
+import re
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import select, text
+from db_instance import db
+from models import Tweet, User
+import snowflake
+
+
+def _dialect():
+    return db.session.get_bind(Tweet).dialect.name
+
+
+# 空白で単語に区切らない文字 (かな・漢字・ハングル)。tsvector の 'simple' 設定や FTS5 の unicode61 では
+# 文全体が1語になってしまうので、この文字を含む語は本文の部分一致で探す (PostgreSQL ではトライグラムの GIN インデックス)
+_UNSEGMENTED_RE = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff66-\uff9f]')
+
+
+def _split_terms(q):
+    """検索語を (単語検索する語, 部分一致で探す語) に分ける"""
+    words, substrings = [], []
+    for term in q.split():
+        (substrings if _UNSEGMENTED_RE.search(term) else words).append(term)
+    return words, substrings
+
+
+def _fts5_query(words):
+    # 入力をそのまま MATCH に渡すと FTS5 の構文として解釈されるので、単語ごとにフレーズとして引用する
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _match_condition(dialect, q, lower, upper):
+    words, substrings = _split_terms(q)
+    conditions = [Tweet.body.contains(term, autoescape=True) for term in substrings]
+    if not words:
+        return conditions
+    if dialect == 'postgresql':
+        conditions.append(text("tweets.search_vector @@ plainto_tsquery('simple', :q)").bindparams(q=' '.join(words)))
+    elif dialect == 'sqlite':
+        # FTS5 の rowid (= tweets.id) で絞り込んでから本体と結合する。rowid の範囲も索引側で絞る
+        fts = (
+            select(text('rowid')).select_from(text('tweets_fts'))
+            .where(text('tweets_fts MATCH :q').bindparams(q=_fts5_query(words)))
+            .where(text('rowid < :upper').bindparams(upper=upper))
+        )
+        if lower is not None:
+            fts = fts.where(text('rowid >= :lower').bindparams(lower=lower))
+        conditions.append(Tweet.id.in_(fts))
+    else:
+        conditions.extend(Tweet.body.contains(word, autoescape=True) for word in words)
+    return conditions
+
+
+def search_tweets(q, before_id=None, limit=20):
+    """本文に q の語を全て含むツイートを id の降順で返す: ([(id, body, timestamp, username), ...], 次ページのカーソル)
+
+    ありふれた語で一致する行を全件取り出して並べ替えないよう、IDの範囲 (投稿日時の窓) を区切って新しい方から探す。
+    窓は SEARCH_WINDOW_HOURS から始めて広げていき、1回の検索で SEARCH_MAX_SCAN_DAYS 分まで遡っても
+    limit 件に届かなければ、そこまでの結果と遡った位置をカーソルとして返す (続きは次のページで探す)。
+    カーソルが None なら、それより古い一致は無い。
+    """
+    dialect = _dialect()
+    upper = before_id if before_id is not None else snowflake.next_id()
+    upper_time = snowflake.datetime_of(upper)
+    scan_limit = upper_time - timedelta(days=current_app.config['SEARCH_MAX_SCAN_DAYS'])
+    window = timedelta(hours=current_app.config['SEARCH_WINDOW_HOURS'])
+    rows = []
+    while True:
+        window_start = max(upper_time - window, scan_limit)
+        # エポック以前まで遡ったら、連番IDの時代のツイートも含めて最後まで探す
+        lower = snowflake.min_id_for_datetime(window_start) or None
+        stmt = (
+            select(Tweet.id, Tweet.body, Tweet.timestamp, User.username)
+            .join(User, User.id == Tweet.user_id)
+            .where(Tweet.id < upper, *_match_condition(dialect, q, lower, upper))
+            .order_by(Tweet.id.desc())
+            .limit(limit - len(rows))
+        )
+        if lower is not None:
+            stmt = stmt.where(Tweet.id >= lower)
+        rows += db.session.execute(stmt).all()
+        if len(rows) == limit:
+            return rows, rows[-1].id
+        if lower is None:
+            return rows, None
+        if window_start <= scan_limit:
+            return rows, lower
+        upper, upper_time = lower, window_start
+        window *= 4
+
+
+def search_users(q, after_username=None, limit=10):
+    """ユーザー名が q で始まるユーザーをユーザー名順に返す (入力補完用)
+
+    PostgreSQL では C照合順序の B-tree インデックス、SQLite ではユーザー名の一意インデックスを範囲検索で使う。
+    """
+    dialect = _dialect()
+    username = User.username
+    if dialect == 'postgresql':
+        # C照合順序のインデックスは前方一致の LIKE とバイト順の並び替えの両方に使えるので、式を揃える
+        username = User.username.collate('C')
+    stmt = select(User.id, User.username, User.profile_image).order_by(username).limit(limit)
+    if dialect == 'sqlite':
+        # SQLite の LIKE は大文字小文字を区別しないためインデックスが使われない。同じ前方一致を範囲条件で表す
+        stmt = stmt.where(User.username >= q, User.username < q + '\U0010ffff')
+    else:
+        stmt = stmt.where(username.startswith(q, autoescape=True))
+    if after_username is not None:
+        stmt = stmt.where(username > after_username)
+    return db.session.execute(stmt).all()
@@ -0,0 +1,137 @@
+# era/seed.py
+# ベンチマーク用の合成データ (ユーザー・ツイート・べき乗則に従うフォローグラフ) を一括投入する
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, text
+from werkzeug.security import generate_password_hash
+from db_instance import db
+from models import User, Tweet, Follow
+import snowflake
+
+USER_COLUMNS = ('id', 'username', 'user_age', 'email', 'password_hash', 'role', 'created_at', 'is_verified', 'verification_status')
+TWEET_COLUMNS = ('id', 'body', 'timestamp', 'user_id')
+FOLLOW_COLUMNS = ('follower_id', 'followed_id', 'timestamp')
+
+WORDS = ('今日', '天気', 'ランチ', '仕事', '旅行', '映画', '音楽', 'カフェ', '週末', '読書', 'ゲーム', '散歩')
+
+
+def _power_law_index(rng, n):
+    """0..n-1 の添字を、小さい添字ほど選ばれやすい (およそ 1/x に比例する) 分布で返す"""
+    return min(int(n ** rng.random()) - 1, n - 1)
+
+
+def _copy_rows(table_name, columns, rows):
+    """PostgreSQL の COPY でCSVをまとめて流し込む"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    buffer.seek(0)
+    raw_connection = db.engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        cursor.copy_expert(f'COPY {table_name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+
+def _insert_rows(table, columns, rows):
+    """COPY が使えないDBでは executemany でバッチ単位に挿入する"""
+    db.session.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+    db.session.commit()
+
+
+class _BatchWriter:
+    def __init__(self, table, columns, batch_size):
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+        self.use_copy = db.engine.dialect.name == 'postgresql'
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.use_copy:
+            _copy_rows(self.table.name, self.columns, self.rows)
+        else:
+            _insert_rows(self.table, self.columns, self.rows)
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def _reset_sequence(table):
+    """id を明示して投入したテーブルのシーケンスを最大値に合わせる (PostgreSQL のみ。ツイートIDは Snowflake なので不要)"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT MAX(id) FROM {table.name}))"
+        ))
+        db.session.commit()
+
+
+def seed_database(n_users, n_tweets, follows_per_user, batch_size=10000, password='password',
+                  random_seed=42, prefix='seed', echo=print):
+    """合成データを投入する
+
+    ユーザー名は '<prefix><連番>'、パスワードは全員共通 (ハッシュは1回だけ計算する)。
+    ツイートの投稿者とフォロー先はべき乗則に従って一部のユーザーに偏らせる。
+    """
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(password)
+
+    first_user_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    user_ids = range(first_user_id, first_user_id + n_users)
+
+    # --- ユーザー ---
+    writer = _BatchWriter(User.__table__, USER_COLUMNS, batch_size)
+    for user_id in user_ids:
+        writer.add((
+            user_id, f'{prefix}{user_id}', rng.randint(18, 80), f'{prefix}{user_id}@example.com', password_hash,
+            'user', now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)), True, 'approved'
+        ))
+    writer.flush()
+    _reset_sequence(User.__table__)
+    echo(f'Inserted {writer.written} users.')
+
+    # --- ツイート (一部のユーザーが大半を投稿する) ---
+    # 直近30日を件数で等分し、i 件目はその区間内のランダムな時刻にする。投稿日時が i の順に増えるので、
+    # 日時から組み立てた Snowflake ID も i の順に増え、同じミリ秒に入った場合もシーケンス番号 (i の下位ビット) で区別される
+    writer = _BatchWriter(Tweet.__table__, TWEET_COLUMNS, batch_size)
+    span_seconds = 30 * 24 * 3600
+    start = now - timedelta(seconds=span_seconds)
+    for i in range(n_tweets):
+        timestamp = start + timedelta(seconds=(i + rng.random()) * span_seconds / n_tweets)
+        body = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        writer.add((
+            snowflake.id_for_datetime(timestamp, sequence=i), body, timestamp,
+            user_ids[_power_law_index(rng, n_users)]
+        ))
+    writer.flush()
+    echo(f'Inserted {writer.written} tweets.')
+
+    # --- フォローグラフ (フォロワー数がべき乗則に従う) ---
+    writer = _BatchWriter(Follow.__table__, FOLLOW_COLUMNS, batch_size)
+    if n_users > 1:
+        for follower_id in user_ids:
+            out_degree = min(int(rng.expovariate(1 / follows_per_user)) if follows_per_user else 0, n_users - 1)
+            followed = set()
+            # 偏った分布なので重複が多い。試行回数に上限を設けて、届かなければその人数で打ち切る
+            for _ in range(out_degree * 10):
+                if len(followed) >= out_degree:
+                    break
+                followed_id = user_ids[_power_law_index(rng, n_users)]
+                if followed_id != follower_id:
+                    followed.add(followed_id)
+            for followed_id in followed:
+                writer.add((follower_id, followed_id, now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))))
+    writer.flush()
+    echo(f'Inserted {writer.written} follow edges.')
@@ -0,0 +1,141 @@
+# era/serializers.py
+# 一覧系APIのJSONを、結果全体をメモリに載せずに逐次エンコードして返すためのヘルパー
+import itertools
+import json
+import zlib
+from datetime import date, datetime
+from flask import current_app, request, stream_with_context
+
+try:
+    import brotli
+except ImportError: # brotli が無い環境では gzip のみ対応
+    brotli = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def _load_encoders():
+    """利用可能なエンコーダーを速い順に返す (orjson -> ujson -> 標準ライブラリ json)"""
+    encoders = {}
+    try:
+        import orjson
+        encoders['orjson'] = orjson.dumps # datetime をネイティブにISO 8601へ変換する
+    except ImportError:
+        pass
+    try:
+        import ujson
+        encoders['ujson'] = lambda obj: ujson.dumps(obj, ensure_ascii=False, default=_default).encode('utf-8')
+    except ImportError:
+        pass
+    encoders['json'] = _stdlib_dumps
+    return encoders
+
+
+ENCODERS = _load_encoders()
+
+
+def register_encoder(name, dumps):
+    """エンコーダーを追加する (dumps はオブジェクトを受け取り bytes を返す関数)"""
+    ENCODERS[name] = dumps
+
+
+def get_encoder():
+    """JSON_ENCODER の設定値のエンコーダーを返す。'auto' や未インストールの場合は利用可能な最速のもの"""
+    preferred = current_app.config.get('JSON_ENCODER', 'auto')
+    if preferred in ENCODERS:
+        return ENCODERS[preferred]
+    return next(iter(ENCODERS.values()))
+
+
+def iter_json_array(items, dumps=None, chunk_size=64 * 1024):
+    """items を1件ずつエンコードし、JSON配列を chunk_size 程度のバイト列に分けて yield する"""
+    dumps = dumps or get_encoder()
+    buffer = bytearray(b'[')
+    first = True
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += dumps(item)
+        first = False
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+def iter_ndjson(items, dumps=None, chunk_size=64 * 1024):
+    """items を1行1件のJSON (NDJSON) にエンコードし、chunk_size 程度のバイト列に分けて yield する"""
+    dumps = dumps or get_encoder()
+    buffer = bytearray()
+    for item in items:
+        buffer += dumps(item)
+        buffer += b'\n'
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 で gzip 形式
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def stream_response(chunks, mimetype='application/json', status=200):
+    """バイト列のイテレーターをストリーミングレスポンスにする
+
+    クライアントが対応していれば、本文が STREAM_COMPRESS_MIN_BYTES 以上になる場合だけ br/gzip で圧縮する。
+    判定のために先頭から最大でしきい値分だけを先読みするので、メモリ使用量は結果件数に依存しない。
+    """
+    chunks = iter(chunks)
+    encoding = _negotiate_encoding()
+    if encoding:
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= current_app.config['STREAM_COMPRESS_MIN_BYTES']:
+                break
+        else:
+            encoding = None # 全体がしきい値未満なので圧縮しない
+        chunks = itertools.chain(head, chunks)
+        if encoding:
+            chunks = _compress(chunks, encoding)
+
+    response = current_app.response_class(stream_with_context(chunks), status=status, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,133 @@
+# era/snowflake.py
+# ツイートID用の Snowflake 形式 64ビットID
+#
+#   | 41ビット: エポックからのミリ秒 | 10ビット: ワーカーID | 12ビット: シーケンス番号 |
+#
+# 上位ビットが時刻なので、IDの大小がそのまま投稿順になる (主キーだけで新着順に並べ・ページングできる)。
+# ワーカーID (SNOWFLAKE_WORKER_ID) をプロセスごとに変えることで、複数ワーカー間でも重複しない。
+#
+# プロセス内ではロックを取らない。ミリ秒ごとの itertools.count を dict.setdefault で共有し、
+# (どちらも GIL の下でアトミックに実行される) 同じミリ秒内のシーケンス番号が重複しないようにする。
+#
+# IDは 2^53 を超えるので、JSON では文字列で返す (JavaScript の Number では下位の桁が丸められる)。
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+EPOCH_MS = 1704067200000 # 2024-01-01T00:00:00Z
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_ID_BITS + SEQUENCE_BITS
+
+# ミリ秒ごとのシーケンス番号のカウンターを保持する期間。これより大きく時計が戻った場合はIDを発行しない
+_RETENTION_MS = 10 * 1000
+
+_sequences = {} # ミリ秒 -> itertools.count
+_high_water_ms = 0
+_worker_id = None
+# id_for_past() の下位22ビット (ワーカーID + シーケンス番号の位置) に使う連番。プロセスごとに開始位置をずらす
+_past_sequence = itertools.count(random.getrandbits(TIMESTAMP_SHIFT))
+
+
+class ClockMovedBackwards(RuntimeError):
+    pass
+
+
+def init_app(app):
+    worker = app.config['SNOWFLAKE_WORKER_ID']
+    if worker is None and not app.testing:
+        # プロセスIDから決めると別のホストのワーカーと重複しうるので、明示的な設定を必須にする
+        raise RuntimeError(
+            f'SNOWFLAKE_WORKER_ID must be set to a worker id (0-{MAX_WORKER_ID}) that is unique per process, '
+            f"or to 'pid' to derive it from the process id (development only)"
+        )
+    configure(None if worker == 'pid' else worker)
+
+
+def configure(worker_id):
+    """ワーカーIDを設定する。None の場合はプロセスIDから決める (開発用、ワーカー間の一意性は保証されない)"""
+    global _worker_id
+    if worker_id is not None and not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f'SNOWFLAKE_WORKER_ID must be between 0 and {MAX_WORKER_ID}')
+    _worker_id = worker_id
+
+
+def worker_id():
+    return _worker_id if _worker_id is not None else os.getpid() & MAX_WORKER_ID
+
+
+def _now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def compose(ms, worker, sequence):
+    return ((ms - EPOCH_MS) << TIMESTAMP_SHIFT) | (worker << SEQUENCE_BITS) | sequence
+
+
+def next_id():
+    """新しいIDを返す"""
+    global _high_water_ms
+    while True:
+        ms = _now_ms()
+        if ms < _high_water_ms - _RETENTION_MS:
+            raise ClockMovedBackwards(f'Clock moved backwards by {_high_water_ms - ms} ms')
+        counter = _sequences.get(ms)
+        if counter is None:
+            counter = _sequences.setdefault(ms, itertools.count())
+            if ms > _high_water_ms:
+                _high_water_ms = ms
+                _prune(ms)
+        sequence = next(counter)
+        if sequence <= MAX_SEQUENCE:
+            return compose(ms, worker_id(), sequence)
+        # このミリ秒のシーケンス番号を使い切った。次のミリ秒まで待つ
+        time.sleep(0)
+
+
+def _prune(now_ms):
+    # 新しいミリ秒に入ったときだけ、保持期間を過ぎたカウンターを削除する
+    if len(_sequences) > 64:
+        for ms in [ms for ms in list(_sequences) if ms < now_ms - _RETENTION_MS]:
+            _sequences.pop(ms, None)
+
+
+def _to_ms(dt):
+    if dt.tzinfo is None: # アプリの日時は naive な UTC
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def id_for_datetime(dt, worker=None, sequence=0):
+    """dt の時刻のIDを組み立てる (過去の日時でデータを投入する場合用。一意性は呼び出し側で保証する)"""
+    if _to_ms(dt) < EPOCH_MS:
+        raise ValueError(f'{dt} is before the Snowflake epoch')
+    return compose(_to_ms(dt), worker_id() if worker is None else worker, sequence & MAX_SEQUENCE)
+
+
+def id_for_past(dt):
+    """過去の日時 dt の投稿に付けるIDを返す (インポート用)
+
+    IDの大小が投稿日時の順になるよう dt の時刻から組み立て、下位22ビットにはプロセス内の連番を使う。
+    同じプロセス内では重複しないが、既存のIDとの重複は呼び出し側で確認する。
+    エポック以前の日時はエポックの時刻で、現在以降の日時は next_id() で発行する。
+    """
+    ms = _to_ms(dt)
+    if ms >= _now_ms():
+        return next_id()
+    low_bits = next(_past_sequence) & ((1 << TIMESTAMP_SHIFT) - 1)
+    return ((max(ms, EPOCH_MS) - EPOCH_MS) << TIMESTAMP_SHIFT) | low_bits
+
+
+def min_id_for_datetime(dt):
+    """dt 以降に発行されたIDはすべてこの値以上になる (時刻による範囲検索用)"""
+    return compose(max(_to_ms(dt), EPOCH_MS), 0, 0)
+
+
+def datetime_of(snowflake_id):
+    """IDに含まれる発行時刻 (naive な UTC)"""
+    ms = (snowflake_id >> TIMESTAMP_SHIFT) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,175 @@
+# era/stats.py
+# 管理ダッシュボード用カウンターの更新・読み出し・再集計
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from db_instance import db
+from models import StatCounter, User, Tweet, Follow
+import snowflake
+
+VERIFICATION_STATUSES = ('pending', 'uploaded_id', 'uploaded_both', 'approved', 'rejected')
+
+# ダッシュボードに表示する期間
+DASHBOARD_DAYS = 14
+DASHBOARD_HOURS = 24
+# 時間別ツイート数カウンターの保持期間 (再集計時にこれより古いキーを削除する)
+TWEET_HOUR_RETENTION_HOURS = 7 * 24
+
+
+def status_key(status):
+    return f'users.status.{status or "pending"}'
+
+def registration_day_key(dt):
+    return f'users.registered.{dt.strftime("%Y-%m-%d")}'
+
+def tweet_hour_key(dt):
+    return f'tweets.hour.{dt.strftime("%Y-%m-%dT%H")}'
+
+TWEETS_TOTAL_KEY = 'tweets.total'
+FOLLOWS_TOTAL_KEY = 'follows.total'
+# 古いパーティションをアーカイブファイルに移したツイートの件数 (tweet_partitions.py)
+TWEETS_ARCHIVED_KEY = 'tweets.archived'
+
+
+def increment_upsert(table, rows, key_columns, value_column, dialect):
+    """キーごとに value_column を加算する INSERT ... ON CONFLICT 文を方言に応じて組み立てる (非対応なら None)"""
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[column] for column in key_columns],
+        set_={value_column: table.c[value_column] + stmt.excluded[value_column]}
+    )
+
+
+def incr(deltas):
+    """{key: delta} をカウンターに加算する
+
+    呼び出し元のトランザクション内で実行されるので、元の書き込みと同時にコミットされる。
+    """
+    rows = [{'key': key, 'value': delta} for key, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    dialect = db.session.get_bind(StatCounter).dialect.name
+    stmt = increment_upsert(StatCounter.__table__, rows, ['key'], 'value', dialect)
+    if stmt is not None:
+        db.session.execute(stmt)
+        return
+    # ON CONFLICT が使えないDBでは UPDATE して、行が無ければ INSERT する
+    for row in rows:
+        updated = db.session.query(StatCounter).filter_by(key=row['key']).update(
+            {StatCounter.value: StatCounter.value + row['value']}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(StatCounter(key=row['key'], value=row['value']))
+
+
+# --- 書き込み経路から呼び出すヘルパー ---
+
+def record_registration(status, count=1, when=None):
+    when = when or datetime.utcnow()
+    incr({status_key(status): count, registration_day_key(when): count})
+
+def record_status_change(old_status, new_status, count=1):
+    if (old_status or 'pending') == (new_status or 'pending'):
+        return
+    incr({status_key(old_status): -count, status_key(new_status): count})
+
+def record_tweets(count=1, when=None):
+    when = when or datetime.utcnow()
+    incr({TWEETS_TOTAL_KEY: count, tweet_hour_key(when): count})
+
+def record_tweet_timestamps(timestamps):
+    """投稿日時がまちまちなツイートをまとめて加算する (一括インポート用)"""
+    deltas = Counter(tweet_hour_key(ts) for ts in timestamps)
+    deltas[TWEETS_TOTAL_KEY] = len(timestamps)
+    incr(deltas)
+
+def record_follow(delta):
+    incr({FOLLOWS_TOTAL_KEY: delta})
+
+
+# --- 読み出し ---
+
+def read_dashboard(now=None):
+    """ダッシュボードの表示値を返す (テーブルの行数に関係なく、固定個のキーを主キーで読むだけ)"""
+    now = now or datetime.utcnow()
+    days = [(now - timedelta(days=i)) for i in range(DASHBOARD_DAYS - 1, -1, -1)]
+    hours = [(now - timedelta(hours=i)) for i in range(DASHBOARD_HOURS - 1, -1, -1)]
+
+    keys = [status_key(s) for s in VERIFICATION_STATUSES]
+    keys += [registration_day_key(d) for d in days]
+    keys += [tweet_hour_key(h) for h in hours]
+    keys += [TWEETS_TOTAL_KEY, FOLLOWS_TOTAL_KEY]
+
+    values = dict(db.session.query(StatCounter.key, StatCounter.value).filter(StatCounter.key.in_(keys)).all())
+
+    status_counts = {s: values.get(status_key(s), 0) for s in VERIFICATION_STATUSES}
+    return {
+        'status_counts': status_counts,
+        'users_total': sum(status_counts.values()),
+        'registrations_per_day': [(d.strftime('%Y/%m/%d'), values.get(registration_day_key(d), 0)) for d in days],
+        'tweets_per_hour': [(h.strftime('%m/%d %H:00'), values.get(tweet_hour_key(h), 0)) for h in hours],
+        'tweets_total': values.get(TWEETS_TOTAL_KEY, 0),
+        'follows_total': values.get(FOLLOWS_TOTAL_KEY, 0),
+    }
+
+
+# --- 再集計 ---
+
+def _bucket_expressions(dialect):
+    if dialect == 'postgresql':
+        return (func.to_char(User.created_at, 'YYYY-MM-DD'),
+                func.to_char(Tweet.timestamp, 'YYYY-MM-DD"T"HH24'))
+    return (func.strftime('%Y-%m-%d', User.created_at),
+            func.strftime('%Y-%m-%dT%H', Tweet.timestamp))
+
+
+def reconcile(now=None):
+    """元テーブルから集計し直してカウンターのずれを補正する (定期実行用)
+
+    時間帯別カウンターはダッシュボードの表示期間だけを再集計し、保持期間を過ぎたキーは削除する。
+    """
+    now = now or datetime.utcnow()
+    dialect = db.session.get_bind(StatCounter).dialect.name
+    day_bucket, hour_bucket = _bucket_expressions(dialect)
+    day_since = (now - timedelta(days=DASHBOARD_DAYS - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    hour_since = (now - timedelta(hours=DASHBOARD_HOURS - 1)).replace(minute=0, second=0, microsecond=0)
+
+    expected = {status_key(s): 0 for s in VERIFICATION_STATUSES}
+    for status, count in db.session.query(User.verification_status, func.count()).group_by(User.verification_status):
+        expected[status_key(status)] = expected.get(status_key(status), 0) + count
+    for day, count in db.session.query(day_bucket, func.count()).filter(User.created_at >= day_since).group_by(day_bucket):
+        expected[f'users.registered.{day}'] = count
+    # ツイートIDは発行時刻順なので、主キーの範囲で対象期間に絞ってから投稿日時で集計する
+    recent_tweets = (Tweet.id >= snowflake.min_id_for_datetime(hour_since), Tweet.timestamp >= hour_since)
+    for hour, count in db.session.query(hour_bucket, func.count()).filter(*recent_tweets).group_by(hour_bucket):
+        expected[f'tweets.hour.{hour}'] = count
+    # アーカイブ済みのツイートはテーブルに無いので、その件数を足す
+    archived = db.session.query(StatCounter.value).filter_by(key=TWEETS_ARCHIVED_KEY).scalar() or 0
+    expected[TWEETS_TOTAL_KEY] = db.session.query(func.count(Tweet.id)).scalar() + archived
+    expected[FOLLOWS_TOTAL_KEY] = db.session.query(func.count()).select_from(Follow).scalar()
+
+    # 再集計対象期間内でイベントが無かったバケットは0に戻す
+    for i in range(DASHBOARD_DAYS):
+        expected.setdefault(registration_day_key(day_since + timedelta(days=i)), 0)
+    for i in range(DASHBOARD_HOURS):
+        expected.setdefault(tweet_hour_key(hour_since + timedelta(hours=i)), 0)
+
+    current = dict(db.session.query(StatCounter.key, StatCounter.value).filter(StatCounter.key.in_(list(expected))).all())
+    corrections = {key: value - current.get(key, 0) for key, value in expected.items() if value != current.get(key, 0)}
+    incr(corrections)
+
+    # 保持期間を過ぎた時間別カウンターを削除
+    cutoff_key = tweet_hour_key(now - timedelta(hours=TWEET_HOUR_RETENTION_HOURS))
+    db.session.query(StatCounter).filter(
+        StatCounter.key.like('tweets.hour.%'),
+        StatCounter.key < cutoff_key
+    ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return corrections
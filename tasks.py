@@ -0,0 +1,46 @@
+# era/tasks.py
+# リクエスト処理から切り離して実行するバックグラウンド処理
+import os
+import queue
+import threading
+
+_file_deletion_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _file_deletion_loop():
+    while True:
+        filepath = _file_deletion_queue.get()
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except Exception:
+            pass # 削除に失敗しても他のファイルの処理は続ける
+        finally:
+            _file_deletion_queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_file_deletion_loop, name='file-deletion-worker', daemon=True)
+            _worker.start()
+
+
+def enqueue_file_deletion(filepaths):
+    """ファイルの削除をバックグラウンドワーカーに依頼する (呼び出し元は削除完了を待たない)"""
+    filepaths = [p for p in filepaths if p]
+    if not filepaths:
+        return
+    _ensure_worker()
+    for filepath in filepaths:
+        _file_deletion_queue.put(filepath)
+
+
+def wait_for_file_deletions():
+    """キューに積まれたファイル削除が全て終わるまで待つ (CLIやテスト用)"""
+    _file_deletion_queue.join()
@@ -0,0 +1,118 @@
+# era/tests/conftest.py
+# アプリをテストごとに一時ディレクトリの SQLite で作り直すフィクスチャ
+#
+#   python -m pytest -q
+#
+# PostgreSQL 固有の処理 (パーティション・全文検索) のテストは TEST_POSTGRES_URL に
+# 空のDBの接続URIを指定したときだけ実行する。
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 顔照合のネイティブ依存 (dlib / OpenCV / numpy) はテストから呼び出さないので、
+# インストールされていない環境では空のモジュールで import だけ通す
+for _name in ('face_recognition', 'cv2', 'numpy'):
+    try:
+        __import__(_name)
+    except ImportError:
+        sys.modules[_name] = types.ModuleType(_name)
+
+from werkzeug.security import generate_password_hash # noqa: E402
+from config import Config, engine_options # noqa: E402
+from db_instance import db # noqa: E402
+import app as app_module # noqa: E402
+
+PASSWORD = 'password'
+# ハッシュの計算を軽くしてテストを速くする
+_PASSWORD_HASH = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """設定を上書きしてアプリを作る。テーブルは create_all で作成する"""
+    monkeypatch.setenv('UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    created = []
+
+    def factory(**config):
+        database_url = config.pop('SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/primary.db')
+        overrides = {
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'SQLALCHEMY_ENGINE_OPTIONS': engine_options(database_url),
+            'SQLALCHEMY_BINDS': {},
+            'AUTO_BOOTSTRAP_DB': False,
+            'ARCHIVE_DIR': str(tmp_path / 'archive'),
+            'RATELIMIT_STORAGE': 'memory',
+            'REGISTRATION_STORE': 'memory',
+            'TESTING': True,
+            **config,
+        }
+        for key, value in overrides.items():
+            monkeypatch.setattr(Config, key, value, raising=False)
+        application = app_module.create_app()
+        with application.app_context():
+            # レプリカのバインドにはテーブルが無い (他のテストで作ったメタデータも残る) ので、プライマリだけ作る
+            db.create_all(bind_key=None)
+        created.append(application)
+        return application
+
+    yield factory
+
+    for application in created:
+        with application.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def postgres_url():
+    """空のテスト用 PostgreSQL の接続URI (public スキーマを作り直す)。TEST_POSTGRES_URL が無ければスキップする"""
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    from sqlalchemy import create_engine, text
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text('DROP SCHEMA public CASCADE'))
+        conn.execute(text('CREATE SCHEMA public'))
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def create_user(username, role='user', **fields):
+    """ユーザーを作成してIDを返す (アプリコンテキスト内で呼ぶ)"""
+    from models import User
+    import stats
+    user = User(username=username, email=f'{username}@example.com', user_age=20,
+                password_hash=_PASSWORD_HASH, role=role, **fields)
+    db.session.add(user)
+    stats.record_registration(user.verification_status)
+    db.session.commit()
+    return user.id
+
+
+def login(client, username):
+    """Webセッションでログインする"""
+    response = client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302, response.get_data(as_text=True)
+
+
+def auth_headers(app, username):
+    """JWT の Authorization ヘッダーを返す"""
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        return {'Authorization': f'Bearer {create_access_token(identity=username)}'}
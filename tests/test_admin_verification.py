@@ -0,0 +1,77 @@
+# era/tests/test_admin_verification.py
+import re
+
+from conftest import create_user, login
+from db_instance import db
+from models import User
+import stats
+import tasks
+
+
+def _pending_users(app, count, tmp_path):
+    ids = []
+    with app.app_context():
+        for i in range(count):
+            image = tmp_path / 'uploads' / f'id_{i}.png'
+            image.write_bytes(b'png')
+            ids.append(create_user(f'pending{i}', verification_status='uploaded_both',
+                                   id_card_image=f'/static/uploads/{image.name}'))
+    return ids
+
+
+def test_queue_page_renders_and_pages_by_id(make_app, tmp_path):
+    app = make_app(ADMIN_QUEUE_PAGE_SIZE=2)
+    ids = _pending_users(app, 3, tmp_path)
+    with app.app_context():
+        create_user('admin', role='admin')
+    client = app.test_client()
+    login(client, 'admin')
+
+    first = client.get('/admin/verification')
+    assert first.status_code == 200
+    html = first.get_data(as_text=True)
+    assert 'pending0' in html and 'pending1' in html and 'pending2' not in html
+    next_after = re.search(r'after=(\d+)', html).group(1)
+    assert int(next_after) == ids[1]
+
+    second = client.get(f'/admin/verification?after={next_after}').get_data(as_text=True)
+    assert 'pending2' in second and 'pending0' not in second
+    assert 'after=' not in second
+
+
+def test_queue_requires_admin(app, client):
+    with app.app_context():
+        create_user('alice')
+    login(client, 'alice')
+    assert client.get('/admin/verification').status_code == 403
+
+
+def test_bulk_approve_updates_only_pending_users(app, client, tmp_path):
+    ids = _pending_users(app, 2, tmp_path)
+    with app.app_context():
+        create_user('admin', role='admin')
+        other_id = create_user('approved_already', verification_status='approved')
+    login(client, 'admin')
+
+    response = client.post('/admin/verification/bulk', json={'action': 'approve', 'user_ids': ids + [other_id]})
+    assert response.status_code == 200
+    assert response.json['processed_ids'] == ids
+    assert response.json['skipped_ids'] == [other_id]
+
+    tasks.wait_for_file_deletions()
+    assert not list((tmp_path / 'uploads').glob('id_*.png'))
+    with app.app_context():
+        users = User.query.filter(User.id.in_(ids)).all()
+        assert {u.verification_status for u in users} == {'approved'}
+        assert all(u.is_verified and u.id_card_image is None for u in users)
+        counts = stats.read_dashboard()['status_counts']
+        assert counts['uploaded_both'] == 0 and counts['approved'] == 3
+
+
+def test_bulk_rejects_invalid_requests(app, client):
+    with app.app_context():
+        create_user('admin', role='admin')
+    login(client, 'admin')
+    assert client.post('/admin/verification/bulk', json={'action': 'delete', 'user_ids': [1]}).status_code == 400
+    assert client.post('/admin/verification/bulk', json={'action': 'approve', 'user_ids': []}).status_code == 400
+    assert client.post('/admin/verification/bulk', json={'action': 'approve', 'user_ids': ['x']}).status_code == 400
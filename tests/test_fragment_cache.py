@@ -0,0 +1,96 @@
+# era/tests/test_fragment_cache.py
+from conftest import auth_headers, create_user, login
+from fragment_cache import LRUCache
+import routes.main_routes as main_routes
+
+
+def test_lru_cache_evicts_by_total_bytes():
+    cache = LRUCache(max_bytes=80)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, 'x' * 10)
+    cache.get('a') # a を最近使ったことにする
+    for key in ('d', 'e', 'f', 'g', 'h', 'i'):
+        cache.set(key, 'x' * 10)
+    assert cache.size <= 80
+    assert cache.get('b') is None
+    assert cache.get('i') == 'x' * 10
+    # 日本語はUTF-8のバイト数で数える
+    cache.set('ja', 'あ' * 3)
+    assert cache._entries['ja'][1] == 9
+
+
+def test_large_fragment_is_not_cached():
+    cache = LRUCache(max_bytes=80)
+    cache.set('big', 'x' * 11)
+    assert cache.get('big') is None and cache.size == 0
+
+
+def _profile(client, username='alice'):
+    response = client.get(f'/profile/{username}')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def _count_renders(monkeypatch):
+    calls = []
+    render = main_routes._render_profile_tweets
+
+    def counting(target_user, before_id):
+        calls.append(before_id)
+        return render(target_user, before_id)
+
+    monkeypatch.setattr(main_routes, '_render_profile_tweets', counting)
+    return calls
+
+
+def test_profile_fragments_are_reused(app, monkeypatch):
+    with app.app_context():
+        create_user('alice', bio='first bio')
+    calls = _count_renders(monkeypatch)
+    client = app.test_client()
+    assert 'first bio' in _profile(client)
+    assert 'first bio' in _profile(client)
+    assert calls == [None]
+
+
+def test_new_tweet_invalidates_tweet_list(app, monkeypatch):
+    with app.app_context():
+        create_user('alice')
+    calls = _count_renders(monkeypatch)
+    client = app.test_client()
+    login(client, 'alice')
+    client.post('/post_tweet', data={'body': 'first tweet'})
+    assert 'first tweet' in _profile(client)
+    client.post('/post_tweet', data={'body': 'second tweet'})
+    html = _profile(client)
+    assert 'first tweet' in html and 'second tweet' in html
+    assert calls == [None, None]
+
+
+def test_profile_edit_invalidates_header(app):
+    with app.app_context():
+        create_user('alice', bio='old bio')
+    client = app.test_client()
+    login(client, 'alice')
+    assert 'old bio' in _profile(client)
+    response = client.post('/profile/alice', data={'bio': 'web bio'})
+    assert response.status_code == 302
+    html = _profile(client)
+    assert 'web bio' in html and 'old bio' not in html
+
+    response = client.put('/api/profile/edit', json={'bio': 'api bio'}, headers=auth_headers(app, 'alice'))
+    assert response.status_code == 200
+    html = _profile(client)
+    assert 'api bio' in html and 'web bio' not in html
+
+
+def test_disabled_cache_renders_every_time(make_app, monkeypatch):
+    app = make_app(FRAGMENT_CACHE_MAX_BYTES=0)
+    with app.app_context():
+        create_user('alice')
+    calls = _count_renders(monkeypatch)
+    client = app.test_client()
+    _profile(client)
+    _profile(client)
+    assert calls == [None, None]
+    assert app.extensions['fragment_cache'].size == 0
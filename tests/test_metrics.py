@@ -0,0 +1,41 @@
+# era/tests/test_metrics.py
+import gc
+import threading
+
+import metrics
+
+
+def _count(label):
+    key = ('tweet_group_commit_batch_size', (('source', label),))
+    hist = metrics._merged_histograms().get(key)
+    return hist[-1] if hist else 0
+
+
+def test_exited_threads_are_folded_into_the_total():
+    live_before = len(metrics._live_histograms)
+
+    def worker():
+        metrics.observe('tweet_group_commit_batch_size', 3, source='threads')
+
+    for _ in range(50):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert len(metrics._live_histograms) <= live_before
+    assert _count('threads') == 50
+
+
+def test_live_thread_observations_are_merged():
+    metrics.observe('tweet_group_commit_batch_size', 2, source='main')
+    metrics.observe('tweet_group_commit_batch_size', 500, source='main')
+    hist = metrics._merged_histograms()[('tweet_group_commit_batch_size', (('source', 'main'),))]
+    assert hist[-1] == 2 and hist[-2] == 502
+    assert hist[metrics.BATCH_SIZE_BUCKETS.index(2)] == 1 # 500 はどのバケットにも入らず +Inf だけに数える
+
+
+def test_metrics_endpoint_reports_requests(client):
+    client.get('/api/trending')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="api.get_trending_api",method="GET",status="200"}' in body
@@ -0,0 +1,145 @@
+# era/tests/test_partitions.py
+import json
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from conftest import create_user
+from db_instance import db
+from models import StatCounter, Tweet, TweetMention, TweetTag, User
+import snowflake
+import stats
+import tweet_archive
+import tweet_partitions
+from tweet_partitions import add_months, month_start, partition_name
+from tweet_writes import create_tweets
+import user_data
+
+
+class _User:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+def test_archive_file_round_trip(tmp_path):
+    base = datetime(2024, 3, 1, 9, 0, 0)
+    older = [(1, 10, base, 'alice 1'), (1, 8, None, 'alice 0'), (2, 9, base, '日本語の投稿')]
+    newer = [(1, 30, base, 'alice 3'), (1, 20, base, 'alice 2')]
+    assert tweet_archive.write_archive(str(tmp_path / 'a.twa'), older, meta={'partition': 'a'}) == 3
+    assert tweet_archive.write_archive(str(tmp_path / 'b.twa'), newer) == 2
+
+    archive = tweet_archive.ArchiveFile(str(tmp_path / 'a.twa'))
+    assert (archive.min_id, archive.max_id, archive.meta['partition']) == (8, 10, 'a')
+    assert archive.user_rows(2) == [(9, base, '日本語の投稿')]
+    assert archive.user_rows(3) == []
+    # 新しいファイルから順に、before_id より古いツイートを読む
+    alice = _User(1)
+    assert [t.body for t in tweet_archive.user_tweets(str(tmp_path), alice, limit=3)] == ['alice 3', 'alice 2', 'alice 1']
+    tweets = tweet_archive.user_tweets(str(tmp_path), alice, before_id=20)
+    assert [(t.id, t.timestamp) for t in tweets] == [(10, base), (8, None)]
+
+
+def test_live_floor_is_the_contiguous_range_below_the_newest_partition():
+    assert tweet_partitions.live_floor_id([('legacy', None, 10), ('p1', 10, 20), ('p2', 20, 30)]) is None
+    assert tweet_partitions.live_floor_id([('p1', 10, 20), ('p2', 20, 30)]) == 10
+    # 戻したアーカイブとの間に切れ目があれば、切れ目より上だけが挿入できる範囲
+    assert tweet_partitions.live_floor_id([('legacy', None, 10), ('p3', 30, 40), ('p4', 40, 50)]) == 30
+
+
+@pytest.fixture
+def pg_app(make_app, postgres_url):
+    return make_app(SQLALCHEMY_DATABASE_URI=postgres_url, PARTITION_MONTHS_AHEAD=2)
+
+
+def _partition_names():
+    with db.engine.connect() as connection:
+        return sorted(name for name, _, _ in tweet_partitions.list_partitions(connection))
+
+
+def test_create_all_makes_partitions_without_default(pg_app):
+    current = month_start(datetime.utcnow())
+    with pg_app.app_context():
+        assert _partition_names() == ['tweets_legacy'] + [partition_name(add_months(current, i)) for i in range(3)]
+        assert tweet_partitions.create_partitions(2, echo=lambda message: None) == []
+        assert tweet_partitions.create_partitions(3, echo=lambda message: None) == [partition_name(add_months(current, 3))]
+
+
+def test_timeline_query_reads_partitions_newest_first(pg_app):
+    with pg_app.app_context():
+        user_ids = [create_user(f'user{i}') for i in range(3)]
+        for user_id in user_ids:
+            create_tweets(user_id, [('old', datetime(2024, 3, 1)), ('new', None)])
+        db.session.commit()
+        query = Tweet.query.filter(Tweet.user_id.in_(user_ids)).order_by(Tweet.id.desc()).limit(50)
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        with db.engine.connect() as connection:
+            # 行数が少ないと全件を並べ替えるので、インデックスを使う計画を比べる
+            connection.execute(text('SET enable_seqscan = off'))
+            connection.execute(text('SET enable_bitmapscan = off'))
+            connection.execute(text('SET enable_sort = off'))
+            plan = '\n'.join(connection.execute(text(f'EXPLAIN (COSTS OFF) {sql}')).scalars())
+    # デフォルトパーティションがあると、全パーティションを Merge Append で並べ直す計画になる
+    assert 'Merge Append' not in plan and 'tweets_default' not in plan
+    assert plan.splitlines()[1].strip() == '->  Append'
+    assert plan.index(partition_name(month_start(datetime.utcnow()))) < plan.index('tweets_legacy')
+
+
+def _archived_count():
+    counter = db.session.get(StatCounter, stats.TWEETS_ARCHIVED_KEY)
+    return counter.value if counter else 0
+
+
+def test_archive_and_restore_partition(pg_app):
+    client = pg_app.test_client()
+    with pg_app.app_context():
+        alice = create_user('alice')
+        create_user('bob')
+        create_tweets(alice, [('first post', datetime(2024, 2, 1)), ('second #tag @bob', datetime(2024, 3, 1)), ('latest #tag', None)])
+        db.session.commit()
+        legacy, = tweet_partitions.archive_candidates(0)
+        assert legacy[0] == 'tweets_legacy'
+
+        assert tweet_partitions.archive_partition(legacy, pg_app.config['ARCHIVE_DIR']) == 2
+        path = tweet_partitions.archive_path(pg_app.config['ARCHIVE_DIR'], 'tweets_legacy')
+        assert os.path.exists(path)
+        assert 'tweets_legacy' not in _partition_names()
+        assert [t.body for t in Tweet.query] == ['latest #tag']
+        assert db.session.query(TweetTag).count() == 1 and db.session.query(TweetMention).count() == 0
+        assert _archived_count() == 2
+    # アーカイブ済みのツイートもプロフィールには続けて表示される
+    html = client.get('/profile/alice').get_data(as_text=True)
+    assert html.index('latest #tag') < html.index('second #tag @bob') < html.index('first post')
+
+    with pg_app.app_context():
+        # アーカイブ済みの期間の投稿日時でインポートしても、残っているパーティションに入る
+        floor = snowflake.min_id_for_datetime(month_start(datetime.utcnow()))
+        bob = User.query.filter_by(username='bob').one()
+        lines = [json.dumps({'type': 'tweet', 'body': 'imported', 'timestamp': '2024-01-01T00:00:00'})]
+        assert user_data.import_records(bob, user_data.read_records(lines))['tweets'] == 1
+        imported = Tweet.query.filter_by(user_id=bob.id).one()
+        assert imported.id >= floor and imported.timestamp == datetime(2024, 1, 1)
+
+        assert tweet_partitions.restore_partition(path) == 2
+        assert not os.path.exists(path)
+        assert 'tweets_legacy' in _partition_names()
+        assert sorted(t.body for t in Tweet.query.filter_by(user_id=alice)) == ['latest #tag', 'second #tag @bob', 'first post']
+        assert db.session.query(TweetTag).count() == 2 and db.session.query(TweetMention).count() == 1
+        assert _archived_count() == 0
+
+
+def test_archive_does_not_overwrite_a_different_archive(pg_app):
+    with pg_app.app_context():
+        alice = create_user('alice')
+        create_tweets(alice, [('old', datetime(2024, 3, 1))])
+        db.session.commit()
+        legacy, = tweet_partitions.archive_candidates(0)
+        os.makedirs(pg_app.config['ARCHIVE_DIR'])
+        path = tweet_partitions.archive_path(pg_app.config['ARCHIVE_DIR'], 'tweets_legacy')
+        tweet_archive.write_archive(path, [(alice, 1, None, 'restore me first')])
+        with pytest.raises(FileExistsError):
+            tweet_partitions.archive_partition(legacy, pg_app.config['ARCHIVE_DIR'])
+        assert 'tweets_legacy' in _partition_names()
+        assert [t.body for t in Tweet.query] == ['old']
+        assert tweet_archive.ArchiveFile(path).user_rows(alice) == [(1, None, 'restore me first')]
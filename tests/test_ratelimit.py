@@ -0,0 +1,84 @@
+# era/tests/test_ratelimit.py
+import pytest
+
+from conftest import create_user, login
+from models import Tweet
+from ratelimit import MemoryBucketStore, SQLiteBucketStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / 'ratelimit.sqlite3'), idle_seconds=60)
+
+
+def test_bucket_allows_capacity_then_rejects(store):
+    assert [store.take(['k'], 3, 1.0) for _ in range(3)] == [0, 0, 0]
+    retry_after = store.take(['k'], 3, 1.0)
+    assert 0 < retry_after <= 1.0
+
+
+def test_rejected_request_does_not_debit_other_buckets(store):
+    # IP のバケットを使い切ってから、IP とユーザーの両方で判定する
+    for _ in range(2):
+        assert store.take(['ip'], 2, 0.001) == 0
+    assert store.take(['ip', 'user'], 2, 0.001) > 0
+    # ユーザーのバケットは減っていない
+    assert store.take(['user'], 2, 0.001) == 0
+    assert store.take(['user'], 2, 0.001) == 0
+    assert store.take(['user'], 2, 0.001) > 0
+
+
+def test_cost_is_taken_from_every_bucket(store):
+    assert store.take(['a', 'b'], 5, 0.001, cost=4) == 0
+    assert store.take(['a'], 5, 0.001, cost=2) > 0
+    assert store.take(['b'], 5, 0.001, cost=1) == 0
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryBucketStore(max_keys=3)
+    for key in ('a', 'b', 'c'):
+        store.take([key], 1, 0.001)
+    store.take(['a'], 1, 0.001) # a を最近使ったことにする
+    store.take(['d'], 1, 0.001)
+    assert list(store._buckets) == ['c', 'a', 'd']
+    for i in range(100):
+        store.take([f'key{i}'], 1, 0.001)
+    assert len(store._buckets) == 3
+
+
+def test_sqlite_store_purges_idle_buckets(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / 'ratelimit.sqlite3'), idle_seconds=0, purge_interval_seconds=0)
+    store.take(['old'], 1, 1.0)
+    store.take(['new'], 1, 1.0)
+    keys = [row[0] for row in store._connect().execute('SELECT key FROM buckets')]
+    assert keys == ['new']
+
+
+def test_web_form_is_redirected_with_a_message(make_app):
+    app = make_app(RATE_LIMITS={'login': {'capacity': 10, 'period_seconds': 60},
+                                'tweet_write': {'capacity': 1, 'period_seconds': 60}})
+    with app.app_context():
+        create_user('alice')
+    client = app.test_client()
+    login(client, 'alice')
+
+    client.post('/post_tweet', data={'body': 'first'})
+    response = client.post('/post_tweet', data={'body': 'second'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/')
+    assert 'リクエストが多すぎます' in client.get('/').get_data(as_text=True)
+    with app.app_context():
+        assert [t.body for t in Tweet.query.all()] == ['first']
+
+
+def test_json_login_gets_429(make_app):
+    app = make_app(RATE_LIMITS={'login': {'capacity': 1, 'period_seconds': 60}})
+    client = app.test_client()
+    client.post('/auth/login', json={'username': 'x', 'password': 'y'})
+    response = client.post('/auth/login', json={'username': 'x', 'password': 'y'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    form = client.post('/auth/login', data={'username': 'x', 'password': 'y'})
+    assert form.status_code == 302 and form.headers['Location'].endswith('/auth/login')
@@ -0,0 +1,84 @@
+# era/tests/test_replica_routing.py
+# プライマリのSQLiteファイルを複製したものをレプリカにして、複製後の書き込みが見えるかでどちらから読んだかを判定する
+import sqlite3
+import time
+
+import pytest
+
+from conftest import auth_headers, create_user, login
+from config import engine_options
+from db_instance import db
+from models import User
+from tweet_writes import create_tweet
+
+
+@pytest.fixture
+def replicated(make_app, tmp_path):
+    replica_url = f'sqlite:///{tmp_path}/replica.db'
+    app = make_app(SQLALCHEMY_BINDS={'replica': {'url': replica_url, **engine_options(replica_url)}})
+    with app.app_context():
+        create_user('alice')
+        create_user('bob')
+
+    def snapshot():
+        with sqlite3.connect(tmp_path / 'primary.db') as source, sqlite3.connect(tmp_path / 'replica.db') as target:
+            source.backup(target)
+    snapshot()
+    return app
+
+
+def _my_tweet_bodies(client, headers):
+    response = client.get('/api/my_tweets', headers=headers)
+    assert response.status_code == 200
+    return [tweet['body'] for tweet in response.get_json()]
+
+
+def test_reads_go_to_replica_without_recent_writes(replicated):
+    with replicated.app_context():
+        create_tweet(User.query.filter_by(username='bob').one().id, 'written after the snapshot')
+        db.session.commit()
+
+    client = replicated.test_client()
+    # レプリカには複製後のツイートが無い
+    assert _my_tweet_bodies(client, auth_headers(replicated, 'bob')) == []
+
+
+def test_jwt_client_reads_its_own_write(replicated):
+    client = replicated.test_client()
+    headers = auth_headers(replicated, 'alice')
+    response = client.post('/api/tweets', json={'body': 'hello'}, headers=headers)
+    assert response.status_code == 201
+
+    # Cookie を送らない別のクライアントでも、同じユーザーならプライマリから読む
+    fresh_client = replicated.test_client(use_cookies=False)
+    assert _my_tweet_bodies(fresh_client, headers) == ['hello']
+    # 書いていない他のユーザーは引き続きレプリカから読む
+    assert _my_tweet_bodies(fresh_client, auth_headers(replicated, 'bob')) == []
+
+
+def test_sticky_window_expires(replicated):
+    replicated.config['REPLICA_STICKY_SECONDS'] = 0
+    client = replicated.test_client()
+    headers = auth_headers(replicated, 'alice')
+    assert client.post('/api/tweets', json={'body': 'hello'}, headers=headers).status_code == 201
+    assert _my_tweet_bodies(client, headers) == []
+
+
+def test_web_session_reads_its_own_write(replicated):
+    client = replicated.test_client()
+    login(client, 'alice')
+    client.post('/post_tweet', data={'body': 'from the web'})
+    assert 'from the web' in client.get('/').get_data(as_text=True)
+
+
+def test_sqlite_write_times_are_shared_and_purged(tmp_path):
+    from db_instance import SQLiteWriteTimes
+    path = str(tmp_path / 'sticky.sqlite3')
+    worker_a = SQLiteWriteTimes(path, retention_seconds=5, purge_interval_seconds=0)
+    worker_b = SQLiteWriteTimes(path, retention_seconds=5, purge_interval_seconds=0)
+    now = time.time()
+    worker_a.set('jwt:alice', now)
+    assert worker_b.get('jwt:alice') == now
+    worker_b.set('jwt:bob', now + 10) # alice の記録は保持期間を過ぎたので削除される
+    assert worker_a.get('jwt:alice') is None
+    assert worker_a.get('jwt:bob') == now + 10
@@ -0,0 +1,93 @@
+# era/tests/test_search.py
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_user
+from db_instance import db
+from models import Tweet
+import search
+import snowflake
+
+
+def _add_tweets(user_id, tweets):
+    """[(本文, 何日前), ...] を投稿日時に合わせたIDで追加する"""
+    now = datetime.utcnow()
+    for i, (body, days_ago) in enumerate(tweets):
+        ts = now - timedelta(days=days_ago)
+        db.session.add(Tweet(id=snowflake.id_for_datetime(ts, sequence=i), body=body, timestamp=ts, user_id=user_id))
+    db.session.commit()
+
+
+def _search_all(q, limit):
+    """カーソルをたどって全ページの本文を返す"""
+    bodies, pages, before = [], 0, None
+    while True:
+        rows, before = search.search_tweets(q, before_id=before, limit=limit)
+        bodies += [row.body for row in rows]
+        pages += 1
+        if before is None:
+            return bodies, pages
+
+
+@pytest.fixture
+def searchable(make_app):
+    app = make_app(SEARCH_WINDOW_HOURS=24, SEARCH_MAX_SCAN_DAYS=30)
+    with app.app_context():
+        alice = create_user('alice')
+        _add_tweets(alice, [
+            ('hello world', 0.1),
+            ('hello again', 2),
+            ('goodbye world', 3),
+            ('hello from last quarter', 90),
+            ('hello from last year', 400),
+            ('今日は良い天気です', 1),
+            ('明日の天気は雨', 45),
+        ])
+        yield app
+
+
+def test_words_match_all_terms_newest_first(searchable):
+    rows, _ = search.search_tweets('hello world', limit=10)
+    assert [row.body for row in rows] == ['hello world']
+    assert rows[0].username == 'alice'
+
+
+def test_paging_reaches_old_tweets_across_windows(searchable):
+    bodies, pages = _search_all('hello', limit=2)
+    assert bodies == ['hello world', 'hello again', 'hello from last quarter', 'hello from last year']
+    # 1回のリクエストで遡るのは SEARCH_MAX_SCAN_DAYS 分までなので、古いツイートは後のページで見つかる
+    assert pages > 2
+
+
+def test_scan_is_bounded_per_request(searchable):
+    rows, cursor = search.search_tweets('quarter', limit=10)
+    assert rows == []
+    assert snowflake.datetime_of(cursor) < datetime.utcnow() - timedelta(days=29)
+
+
+def test_japanese_terms_match_substrings(searchable):
+    bodies, _ = _search_all('天気', limit=10)
+    assert bodies == ['今日は良い天気です', '明日の天気は雨']
+    assert _search_all('天気 雨', limit=10)[0] == ['明日の天気は雨']
+
+
+def test_like_wildcards_are_escaped(searchable):
+    assert _search_all('天%', limit=10)[0] == []
+
+
+def test_search_api_returns_cursor_for_partial_pages(searchable):
+    client = searchable.test_client()
+    page = client.get('/api/search/tweets?q=hello&limit=5').get_json()
+    assert [t['body'] for t in page['results']] == ['hello world', 'hello again']
+    assert page['next_before'] is not None
+
+
+def test_postgres_search_uses_tsvector_and_trigram(make_app, postgres_url):
+    app = make_app(SQLALCHEMY_DATABASE_URI=postgres_url)
+    with app.app_context():
+        alice = create_user('alice')
+        _add_tweets(alice, [('hello world', 0.1), ('今日は良い天気です', 1), ('hello 天気', 2)])
+        assert [r.body for r in search.search_tweets('hello', limit=10)[0]] == ['hello world', 'hello 天気']
+        assert [r.body for r in search.search_tweets('天気', limit=10)[0]] == ['今日は良い天気です', 'hello 天気']
+        assert [r.body for r in search.search_tweets('hello 天気', limit=10)[0]] == ['hello 天気']
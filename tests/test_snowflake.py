@@ -0,0 +1,104 @@
+# era/tests/test_snowflake.py
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import auth_headers, create_user
+import snowflake
+
+
+@pytest.fixture
+def worker():
+    """テスト中に変えたワーカーIDを元に戻す"""
+    saved = snowflake._worker_id
+    yield
+    snowflake.configure(saved)
+
+
+def test_ids_are_monotonic_within_a_thread():
+    ids = [snowflake.next_id() for _ in range(20000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_ids_are_unique_across_threads():
+    results = [[] for _ in range(8)]
+
+    def issue(out):
+        for _ in range(5000):
+            out.append(snowflake.next_id())
+
+    threads = [threading.Thread(target=issue, args=(out,)) for out in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [tweet_id for out in results for tweet_id in out]
+    assert len(set(ids)) == len(ids)
+    for out in results:
+        assert out == sorted(out)
+
+
+def test_id_contains_time_and_worker(worker):
+    snowflake.configure(42)
+    before = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=1)
+    tweet_id = snowflake.next_id()
+    assert (tweet_id >> snowflake.SEQUENCE_BITS) & snowflake.MAX_WORKER_ID == 42
+    assert before <= snowflake.datetime_of(tweet_id) <= datetime.utcnow()
+    assert tweet_id >= snowflake.min_id_for_datetime(before)
+    assert tweet_id > 2 ** 53 # JSON では文字列で返す必要がある
+
+
+def test_clock_moved_backwards_is_rejected(monkeypatch):
+    snowflake.next_id()
+    monkeypatch.setattr(snowflake, '_now_ms', lambda: snowflake._high_water_ms - snowflake._RETENTION_MS - 1)
+    with pytest.raises(snowflake.ClockMovedBackwards):
+        snowflake.next_id()
+
+
+def test_ids_for_past_datetimes_sort_by_time():
+    base = datetime(2024, 6, 1, 12, 0, 0)
+    ids = [snowflake.id_for_past(base) for _ in range(1000)]
+    assert len(set(ids)) == 1000
+    assert all(snowflake.datetime_of(tweet_id) == base for tweet_id in ids)
+    assert max(ids) < snowflake.id_for_past(base + timedelta(milliseconds=1))
+    assert max(ids) < snowflake.next_id()
+    # エポック以前はエポックの時刻、未来の日時は現在時刻のIDになる
+    assert snowflake.datetime_of(snowflake.id_for_past(datetime(2000, 1, 1))) == datetime(2024, 1, 1)
+    assert snowflake.datetime_of(snowflake.id_for_past(datetime(2999, 1, 1))) <= datetime.utcnow()
+
+
+def test_worker_id_is_required_outside_tests(make_app, worker):
+    with pytest.raises(RuntimeError, match='SNOWFLAKE_WORKER_ID'):
+        make_app(TESTING=False, SNOWFLAKE_WORKER_ID=None)
+    make_app(TESTING=False, SNOWFLAKE_WORKER_ID=7)
+    assert snowflake.worker_id() == 7
+    make_app(TESTING=False, SNOWFLAKE_WORKER_ID='pid')
+    assert snowflake._worker_id is None
+    with pytest.raises(ValueError):
+        make_app(SNOWFLAKE_WORKER_ID=1024)
+
+
+def test_api_returns_ids_as_strings(app):
+    with app.app_context():
+        create_user('alice')
+    client = app.test_client()
+    headers = auth_headers(app, 'alice')
+    created = client.post('/api/tweets', json={'body': 'one #tag'}, headers=headers).get_json()
+    batch = client.post('/api/tweets/batch', json={'tweets': [{'body': 'two #tag'}, {'body': 'three #tag'}]},
+                        headers=headers).get_json()
+    assert isinstance(created['tweet_id'], str)
+    assert all(isinstance(tweet_id, str) for tweet_id in batch['tweet_ids'])
+    newest_first = batch['tweet_ids'][::-1] + [created['tweet_id']]
+
+    mine = client.get('/api/my_tweets', headers=headers).get_json()
+    assert [tweet['id'] for tweet in mine] == newest_first
+
+    # 文字列のカーソルでそのまま次のページを読める
+    page = client.get('/api/tags/tag?limit=2').get_json()
+    assert [tweet['id'] for tweet in page['results']] == newest_first[:2]
+    assert page['next_before'] == newest_first[1]
+    page = client.get(f'/api/tags/tag?limit=2&before={page["next_before"]}').get_json()
+    assert [tweet['id'] for tweet in page['results']] == newest_first[2:]
+    assert page['next_before'] is None
@@ -0,0 +1,75 @@
+# era/tests/test_trending.py
+from collections import Counter
+
+from conftest import auth_headers, create_user
+from models import TagTrendBucket
+import trending
+
+
+def _post(client, headers, body):
+    response = client.post('/api/tweets', json={'body': body}, headers=headers)
+    assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def test_committed_tags_are_flushed_by_background_thread(make_app):
+    app = make_app(TRENDING_FLUSH_INTERVAL_SECONDS=0.01)
+    with app.app_context():
+        create_user('alice')
+    client = app.test_client()
+    headers = auth_headers(app, 'alice')
+    _post(client, headers, 'hello #python #flask')
+    _post(client, headers, 'again #python')
+
+    buffer = app.extensions['trending'].buffer
+    thread = app.extensions['trending']._thread
+    assert thread is not None and thread.is_alive()
+    # リクエストの後処理では反映しない。反映スレッドがバッファを空にするまで待つ
+    for _ in range(200):
+        with app.app_context():
+            if sum(row.count for row in TagTrendBucket.query) == 3:
+                break
+        thread.join(0.01)
+    assert not buffer.has_pending()
+    response = client.get('/api/trending')
+    assert [(r['tag'], r['count']) for r in response.get_json()['results']] == [('python', 2), ('flask', 1)]
+
+
+def test_failed_flush_is_logged_and_retried(app, monkeypatch, caplog):
+    extension = app.extensions['trending']
+    extension.buffer.add(['python', 'python', 'flask'])
+    monkeypatch.setattr(trending, 'increment_upsert', lambda *args: None) # 非対応のDBと同じ扱い
+    with app.app_context():
+        assert extension.flush() is False
+    assert 'Failed to flush trending tags' in caplog.text
+    # 取り出した分はバッファに戻っていて、次の反映で書き込まれる
+    monkeypatch.undo()
+    with app.app_context():
+        assert extension.flush() is True
+        counts = {row.tag: row.count for row in TagTrendBucket.query}
+    assert counts == {'python': 2, 'flask': 1}
+
+
+def test_request_succeeds_when_flush_fails(app, monkeypatch):
+    with app.app_context():
+        create_user('alice')
+    monkeypatch.setattr(trending, 'increment_upsert', lambda *args: None)
+    client = app.test_client()
+    _post(client, auth_headers(app, 'alice'), 'hello #python')
+    response = client.get('/api/trending')
+    assert response.status_code == 200
+    assert response.get_json()['results'] == []
+
+
+def test_restore_keeps_newer_buckets():
+    buffer = trending.RingBuffer(slots=2, bucket_seconds=60)
+    buffer.add(['a'], now=0)
+    drained = buffer.drain()
+    buffer.add(['b'], now=60)
+    buffer.add(['c'], now=120) # バケット 0 と同じスロットを新しいバケットが使っている
+    buffer.restore(drained)
+    assert sorted((bucket, dict(counter)) for bucket, counter in buffer.drain()) == [(1, {'b': 1}), (2, {'c': 1})]
+    buffer.add(['a'], now=0)
+    drained = buffer.drain()
+    buffer.add(['a'], now=0)
+    buffer.restore(drained)
+    assert buffer.drain() == [(0, Counter({'a': 2}))]
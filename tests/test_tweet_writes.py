@@ -0,0 +1,149 @@
+# era/tests/test_tweet_writes.py
+import itertools
+import threading
+from datetime import datetime
+
+import pytest
+
+from conftest import auth_headers, create_user
+from db_instance import db
+from models import Tweet, User
+import snowflake
+import tweet_writes
+from tweet_writes import GroupCommitTimeout, GroupCommitWriter, create_tweets, publish_tweet
+
+
+@pytest.fixture
+def group_app(make_app):
+    app = make_app(TWEET_GROUP_COMMIT=True, TWEET_GROUP_COMMIT_TIMEOUT_SECONDS=5)
+    with app.app_context():
+        create_user('alice')
+    return app
+
+
+def _user_id(app):
+    with app.app_context():
+        return User.query.filter_by(username='alice').one().id
+
+
+def test_group_commit_writes_concurrent_posts(group_app):
+    user_id = _user_id(group_app)
+    results = []
+
+    def post(i):
+        with group_app.app_context():
+            results.append(publish_tweet(user_id, f'post {i}'))
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with group_app.app_context():
+        assert sorted(results) == sorted(db.session.scalars(db.select(Tweet.id)))
+    assert len(set(results)) == 10
+
+
+def test_failed_batch_is_reported_and_writer_keeps_running(group_app, monkeypatch):
+    user_id = _user_id(group_app)
+    calls = []
+
+    def broken_write(self, batch):
+        calls.append(len(batch))
+        raise RuntimeError('rollback failed')
+
+    writer = group_app.extensions['tweet_group_commit']
+    with monkeypatch.context() as patch:
+        patch.setattr(GroupCommitWriter, '_write', broken_write)
+        future = writer.submit(user_id, 'lost')
+        with pytest.raises(RuntimeError, match='rollback failed'):
+            future.result(timeout=5)
+    assert calls == [1]
+    # 同じ書き込みスレッドが次の投稿を処理する
+    thread = writer._thread
+    with group_app.app_context():
+        tweet_id = publish_tweet(user_id, 'after failure')
+        assert writer._thread is thread
+        assert db.session.scalars(db.select(Tweet.body)).all() == ['after failure']
+    assert tweet_id
+
+
+def test_failed_app_context_is_reported(group_app, monkeypatch):
+    user_id = _user_id(group_app)
+    writer = group_app.extensions['tweet_group_commit']
+
+    class BrokenApp:
+        logger = group_app.logger
+
+        def app_context(self):
+            raise RuntimeError('no app context')
+
+    monkeypatch.setattr(writer, 'app', BrokenApp())
+    with pytest.raises(RuntimeError, match='no app context'):
+        writer.submit(user_id, 'lost').result(timeout=5)
+
+
+def test_failed_rows_get_their_own_exception(group_app, monkeypatch):
+    user_id = _user_id(group_app)
+    real_insert = tweet_writes.insert_tweets
+
+    def insert_tweets(rows, count_trending=True):
+        if any(row['body'] == 'bad' for row in rows):
+            raise ValueError('bad row')
+        return real_insert(rows, count_trending)
+
+    monkeypatch.setattr(tweet_writes, 'insert_tweets', insert_tweets)
+    writer = group_app.extensions['tweet_group_commit']
+    writer.window_seconds = 0.2 # 2件を同じバッチにまとめる
+    good, bad = writer.submit(user_id, 'good'), writer.submit(user_id, 'bad')
+    with pytest.raises(ValueError, match='bad row'):
+        bad.result(timeout=5)
+    assert good.result(timeout=5)
+
+
+def test_wait_for_started_write_is_bounded(make_app, monkeypatch):
+    app = make_app(TWEET_GROUP_COMMIT=True, TWEET_GROUP_COMMIT_TIMEOUT_SECONDS=0.2)
+    with app.app_context():
+        create_user('alice')
+    user_id = _user_id(app)
+    release = threading.Event()
+    real_write = GroupCommitWriter._write
+
+    def slow_write(self, batch):
+        release.wait(5)
+        real_write(self, batch)
+
+    monkeypatch.setattr(GroupCommitWriter, '_write', slow_write)
+    with app.app_context():
+        with pytest.raises(GroupCommitTimeout) as excinfo:
+            publish_tweet(user_id, 'slow')
+    assert excinfo.value.started
+    release.set()
+
+
+def test_batch_api_is_rate_limited_before_user_lookup(make_app):
+    app = make_app(RATE_LIMITS={'tweet_write': {'capacity': 2, 'period_seconds': 60}})
+    client = app.test_client()
+    # 存在しないユーザーのトークンでも、制限を超えていれば検索する前に 429 になる
+    headers = auth_headers(app, 'ghost')
+    response = client.post('/api/tweets/batch', json={'tweets': [{'body': 'a'}, {'body': 'b'}, {'body': 'c'}]},
+                           headers=headers)
+    assert response.status_code == 429
+    response = client.post('/api/tweets/batch', json={'tweets': [{'body': 'a'}]}, headers=headers)
+    assert response.status_code == 404
+
+
+def test_ids_from_timestamps_avoid_existing_ids(app, monkeypatch):
+    with app.app_context():
+        user_id = create_user('alice')
+        timestamp = datetime(2024, 5, 1, 12, 0, 0)
+        monkeypatch.setattr(snowflake, '_past_sequence', itertools.count(7))
+        first, = create_tweets(user_id, [('first', timestamp)])
+        # 下位ビットの連番が同じ値から始まっても、発行済みのIDは使わない
+        monkeypatch.setattr(snowflake, '_past_sequence', itertools.count(7))
+        second, third = create_tweets(user_id, [('second', timestamp), ('third', None)])
+        db.session.commit()
+        assert second == first + 1
+        assert snowflake.datetime_of(second) == timestamp
+        assert third > second
+        assert db.session.scalars(db.select(Tweet.body).order_by(Tweet.id)).all() == ['first', 'second', 'third']
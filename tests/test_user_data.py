@@ -0,0 +1,99 @@
+# era/tests/test_user_data.py
+import json
+from datetime import datetime
+
+import pytest
+
+from conftest import auth_headers, create_user
+from db_instance import db
+from models import Follow, Tweet, User
+from tweet_writes import create_tweets
+import user_data
+
+
+@pytest.fixture
+def alice(app):
+    with app.app_context():
+        alice_id = create_user('alice')
+        carol_id = create_user('carol')
+        create_user('bob')
+        create_tweets(alice_id, [
+            ('first post', datetime(2024, 3, 1, 9, 0, 0)),
+            ('日本語の投稿 #tag', datetime(2024, 3, 2, 12, 30, 15, 250000)),
+            ('latest post', datetime(2024, 4, 1, 0, 0, 0)),
+        ])
+        db.session.add(Follow(follower_id=alice_id, followed_id=carol_id, timestamp=datetime(2024, 2, 1)))
+        db.session.commit()
+    return alice_id
+
+
+def _tweets(username):
+    user = User.query.filter_by(username=username).one()
+    return [(tweet.body, tweet.timestamp) for tweet in Tweet.query.filter_by(user_id=user.id).order_by(Tweet.id)]
+
+
+def test_export_import_round_trip(app, alice):
+    client = app.test_client()
+    response = client.get('/api/export', headers=auth_headers(app, 'alice'))
+    assert response.status_code == 200
+    exported = response.get_data()
+    records = [json.loads(line) for line in exported.splitlines()]
+    assert [record['type'] for record in records] == ['profile', 'tweet', 'tweet', 'tweet', 'follow']
+    assert records[4]['username'] == 'carol'
+
+    response = client.post('/api/import', data=exported, headers=auth_headers(app, 'bob'),
+                           content_type='application/x-ndjson')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['imported'] == {'tweets': 3, 'follows': 1}
+    with app.app_context():
+        assert _tweets('bob') == _tweets('alice')
+        bob = User.query.filter_by(username='bob').one()
+        assert [follow.followed.username for follow in bob.following] == ['carol']
+
+
+def test_imported_tweets_sort_by_original_timestamp(app, alice):
+    client = app.test_client()
+    bob_headers = auth_headers(app, 'bob')
+    client.post('/api/tweets', json={'body': 'bob today'}, headers=bob_headers)
+    assert 'bob today' in client.get('/profile/bob').get_data(as_text=True) # プロフィールをキャッシュさせる
+
+    exported = client.get('/api/export', headers=auth_headers(app, 'alice')).get_data()
+    assert all(isinstance(json.loads(line).get('id', ''), str) for line in exported.splitlines())
+    client.post('/api/import', data=exported, headers=bob_headers, content_type='application/x-ndjson')
+
+    mine = client.get('/api/my_tweets', headers=bob_headers).get_json()
+    assert [tweet['body'] for tweet in mine] == ['bob today', 'latest post', '日本語の投稿 #tag', 'first post']
+    assert [datetime.fromisoformat(tweet['timestamp']) for tweet in mine[1:]] == [
+        datetime(2024, 4, 1, 0, 0, 0), datetime(2024, 3, 2, 12, 30, 15, 250000), datetime(2024, 3, 1, 9, 0, 0)
+    ]
+    # 最新のツイートは変わらないが、インポートした投稿もプロフィールに表示される
+    assert 'first post' in client.get('/profile/bob').get_data(as_text=True)
+    # 同じデータをもう一度インポートしてもIDは重複しない
+    response = client.post('/api/import', data=exported, headers=bob_headers, content_type='application/x-ndjson')
+    assert response.get_json()['imported']['tweets'] == 3
+
+
+def test_timezone_aware_timestamps_are_stored_as_utc(app):
+    lines = [
+        json.dumps({'type': 'tweet', 'body': 'jst', 'timestamp': '2024-03-01T09:00:00+09:00'}),
+        json.dumps({'type': 'tweet', 'body': 'zulu', 'timestamp': '2024-03-01T01:00:00Z'}),
+        json.dumps({'type': 'tweet', 'body': 'naive', 'timestamp': '2024-03-01T02:00:00'}),
+    ]
+    with app.app_context():
+        user_id = create_user('dave')
+        user = db.session.get(User, user_id)
+        assert user_data.import_records(user, user_data.read_records(lines)) == {'tweets': 3, 'follows': 0}
+        assert _tweets('dave') == [
+            ('jst', datetime(2024, 3, 1, 0, 0, 0)),
+            ('zulu', datetime(2024, 3, 1, 1, 0, 0)),
+            ('naive', datetime(2024, 3, 1, 2, 0, 0)),
+        ]
+
+
+def test_invalid_timestamp_is_rejected(app):
+    lines = [json.dumps({'type': 'tweet', 'body': 'x', 'timestamp': 'yesterday'})]
+    with app.app_context():
+        user = db.session.get(User, create_user('erin'))
+        with pytest.raises(user_data.ImportFormatError) as excinfo:
+            user_data.import_records(user, user_data.read_records(lines))
+    assert excinfo.value.lineno == 1
@@ -0,0 +1,176 @@
+# era/trending.py
+# スライディングウィンドウのトレンドタグ集計
+#
+# 投稿のコミット時に、各ワーカーのプロセス内リングバッファ (時間バケットごとのタグ出現数) に加算する。
+# バッファはワーカーごとの反映スレッドが一定間隔で tag_trend_buckets テーブルへ加算 (UPSERT) してまとめ、
+# 全ワーカー分が合算される。反映はリクエストの処理とは切り離しているので、DBの失敗が応答に影響しない。
+# トレンドの読み出しはウィンドウ内のバケット行を合計するだけで、ツイート本体は集計しない。
+import threading
+import time
+from collections import Counter
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, select
+from db_instance import db, RoutingSession
+from models import TagTrendBucket
+from stats import increment_upsert
+
+SESSION_INFO_KEY = 'pending_trending_tags'
+
+
+class RingBuffer:
+    """直近 slots 個の時間バケットのタグ出現数を保持するリングバッファ (未反映分のみ)"""
+
+    def __init__(self, slots, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+        self._slots = [None] * slots # 各スロット: (バケット番号, Counter)
+        self._lock = threading.Lock()
+
+    def bucket_of(self, now):
+        return int(now // self.bucket_seconds)
+
+    def add(self, tags, now=None):
+        bucket = self.bucket_of(time.time() if now is None else now)
+        index = bucket % len(self._slots)
+        with self._lock:
+            slot = self._slots[index]
+            if slot is None or slot[0] != bucket:
+                # 一周前のバケットは反映済み (反映間隔 < ウィンドウ) なので上書きしてよい
+                slot = (bucket, Counter())
+                self._slots[index] = slot
+            slot[1].update(tags)
+
+    def drain(self):
+        """未反映の [(バケット番号, Counter), ...] を取り出してバッファを空にする"""
+        with self._lock:
+            drained = [slot for slot in self._slots if slot is not None and slot[1]]
+            self._slots = [None] * len(self._slots)
+        return drained
+
+    def has_pending(self):
+        with self._lock:
+            return any(slot is not None and slot[1] for slot in self._slots)
+
+    def restore(self, drained):
+        """反映に失敗した drain() の結果をバッファに戻す (スロットが新しいバケットに使われていれば捨てる)"""
+        with self._lock:
+            for bucket, counter in drained:
+                index = bucket % len(self._slots)
+                slot = self._slots[index]
+                if slot is None:
+                    self._slots[index] = (bucket, counter)
+                elif slot[0] == bucket:
+                    slot[1].update(counter)
+
+
+class Trending:
+    def __init__(self, app):
+        self.app = app
+        self.bucket_seconds = app.config['TRENDING_BUCKET_SECONDS']
+        self.window_buckets = max(1, app.config['TRENDING_WINDOW_SECONDS'] // self.bucket_seconds)
+        self.flush_interval = app.config['TRENDING_FLUSH_INTERVAL_SECONDS']
+        self.cache_seconds = app.config['TRENDING_CACHE_SECONDS']
+        self.buffer = RingBuffer(self.window_buckets, self.bucket_seconds)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._cache = {} # limit -> (期限, 結果)
+
+    def add(self, tags):
+        """コミットされた投稿のタグをバッファに加算する (反映スレッドは最初の加算時に起動する)"""
+        self.buffer.add(tags)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._flush_loop, name='trending-flush', daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self.buffer.has_pending():
+                with self.app.app_context():
+                    self.flush()
+
+    def flush(self):
+        """バッファの内容をDBのバケットに加算し、ウィンドウから外れたバケットを削除する
+
+        失敗しても例外は投げずにログに出し、取り出した分はバッファに戻して次の反映で書き直す。反映できたら True を返す。
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return False # 他のスレッドが反映中
+        drained = []
+        try:
+            drained = self.buffer.drain()
+            oldest = self.buffer.bucket_of(time.time()) - self.window_buckets
+            rows = [{'bucket': bucket, 'tag': tag, 'count': count}
+                    for bucket, counter in drained if bucket > oldest
+                    for tag, count in sorted(counter.items())]
+            # リクエストのセッションとは別の接続・トランザクションで書く
+            with db.engine.begin() as conn:
+                if rows:
+                    stmt = increment_upsert(TagTrendBucket.__table__, rows, ['bucket', 'tag'], 'count', conn.dialect.name)
+                    if stmt is None:
+                        raise RuntimeError(f'Trending counters are not supported on {conn.dialect.name}')
+                    conn.execute(stmt)
+                conn.execute(delete(TagTrendBucket).where(TagTrendBucket.bucket <= oldest))
+            return True
+        except Exception:
+            self.app.logger.exception('Failed to flush trending tags')
+            self.buffer.restore(drained)
+            return False
+        finally:
+            self._flush_lock.release()
+
+    def top(self, limit):
+        """ウィンドウ内の出現数が多いタグを [(tag, count), ...] で返す (TRENDING_CACHE_SECONDS の間キャッシュする)"""
+        now = time.monotonic()
+        cached = self._cache.get(limit)
+        if cached and cached[0] > now:
+            return cached[1]
+        self.flush() # 自ワーカーの未反映分も含める
+        total = func.sum(TagTrendBucket.count)
+        oldest = self.buffer.bucket_of(time.time()) - self.window_buckets
+        result = [tuple(row) for row in db.session.execute(
+            select(TagTrendBucket.tag, total)
+            .where(TagTrendBucket.bucket > oldest)
+            .group_by(TagTrendBucket.tag)
+            .order_by(total.desc(), TagTrendBucket.tag)
+            .limit(limit)
+        )]
+        self._cache[limit] = (now + self.cache_seconds, result)
+        return result
+
+
+def init_app(app):
+    # 反映スレッドは最初のタグの加算時に起動する
+    app.extensions['trending'] = Trending(app)
+
+
+def record_tags(tags):
+    """現在のトランザクションがコミットされたらトレンドに加算するタグを登録する"""
+    db.session.info.setdefault(SESSION_INFO_KEY, []).extend(tags)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _count_committed_tags(session):
+    tags = session.info.pop(SESSION_INFO_KEY, None)
+    if tags and has_app_context() and 'trending' in current_app.extensions:
+        current_app.extensions['trending'].add(tags)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_rolled_back_tags(session):
+    session.info.pop(SESSION_INFO_KEY, None)
+
+
+def top_tags(limit):
+    return current_app.extensions['trending'].top(limit)
+
+
+def window_seconds():
+    trending = current_app.extensions['trending']
+    return trending.window_buckets * trending.bucket_seconds
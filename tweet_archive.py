@@ -0,0 +1,214 @@
+# era/tweet_archive.py
+# 古いパーティションのツイートを退避する圧縮列指向のアーカイブファイル
+#
+# ファイル形式 (1パーティション = 1ファイル、整数はすべてリトルエンディアン):
+#
+#   | MAGIC | ユーザーごとのブロック ... | フッター (zlib 圧縮した JSON) | フッター長 (8バイト) | MAGIC |
+#
+# ブロックは1ユーザー分のツイートを新しい順に並べ、列ごとにまとめて zlib で圧縮したもの:
+#
+#   | 件数 (4バイト) | ID (int64 x 件数) | 投稿日時 (UNIXエポックからのマイクロ秒, int64 x 件数)
+#   | 本文のバイト長 (uint32 x 件数) | 本文 (UTF-8 を連結) |
+#
+# フッターにはユーザーIDごとのブロックの位置・件数を持たせ、プロフィールの表示では
+# 対象ユーザーのブロックだけを読んで展開する。
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+MAGIC = b'ERATWA1\n'
+FILE_SUFFIX = '.twa'
+FORMAT_VERSION = 1
+
+_EPOCH = datetime(1970, 1, 1)
+_NULL_TIMESTAMP = -(1 << 63) # 投稿日時が NULL のツイート
+_LENGTH = struct.Struct('<Q')
+_COUNT = struct.Struct('<I')
+
+# アーカイブから読んだツイート。テンプレートからは Tweet と同じ属性で参照できる
+ArchivedTweet = namedtuple('ArchivedTweet', ['id', 'body', 'timestamp', 'user_id', 'author'])
+
+
+class ArchiveFormatError(ValueError):
+    pass
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _encode_timestamp(ts):
+    if ts is None:
+        return _NULL_TIMESTAMP
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def _decode_timestamp(value):
+    return None if value == _NULL_TIMESTAMP else _EPOCH + timedelta(microseconds=value)
+
+
+def _encode_block(rows):
+    bodies = [body.encode('utf-8') for _, _, body in rows]
+    ids = _to_little_endian(array('q', [tweet_id for tweet_id, _, _ in rows]))
+    timestamps = _to_little_endian(array('q', [_encode_timestamp(ts) for _, ts, _ in rows]))
+    lengths = _to_little_endian(array('I', [len(body) for body in bodies]))
+    return zlib.compress(b''.join([
+        _COUNT.pack(len(rows)), ids.tobytes(), timestamps.tobytes(), lengths.tobytes(), *bodies
+    ]))
+
+def _decode_block(data):
+    raw = zlib.decompress(data)
+    count, = _COUNT.unpack_from(raw)
+    offset = _COUNT.size
+    columns = []
+    for typecode in ('q', 'q', 'I'):
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(raw[offset:offset + size])
+        columns.append(_to_little_endian(values))
+        offset += size
+    ids, timestamps, lengths = columns
+    rows = []
+    for tweet_id, ts, length in zip(ids, timestamps, lengths):
+        rows.append((tweet_id, _decode_timestamp(ts), raw[offset:offset + length].decode('utf-8')))
+        offset += length
+    return rows
+
+
+def write_archive(path, rows, meta=None):
+    """(user_id, id, timestamp, body) を user_id 順・同じユーザー内はID降順で受け取り、アーカイブファイルを書く
+
+    rows はサーバーサイドカーソルからそのまま流し込めるよう1行ずつ読み、メモリには1ユーザー分だけ保持する。
+    一時ファイルに書いてから rename するので、途中で失敗しても壊れたファイルは残らない。書き込んだ件数を返す。
+    """
+    users = {}
+    total = 0
+    min_id = max_id = None
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+
+        def flush(user_id, block_rows):
+            data = _encode_block(block_rows)
+            users[str(user_id)] = [f.tell(), len(data), len(block_rows), block_rows[0][0]]
+            f.write(data)
+
+        current_user, block_rows = None, []
+        for user_id, tweet_id, ts, body in rows:
+            if user_id != current_user:
+                if block_rows:
+                    flush(current_user, block_rows)
+                current_user, block_rows = user_id, []
+            block_rows.append((tweet_id, ts, body))
+            total += 1
+            min_id = tweet_id if min_id is None else min(min_id, tweet_id)
+            max_id = tweet_id if max_id is None else max(max_id, tweet_id)
+        if block_rows:
+            flush(current_user, block_rows)
+
+        footer = zlib.compress(json.dumps({
+            'version': FORMAT_VERSION,
+            'rows': total,
+            'min_id': min_id,
+            'max_id': max_id,
+            'users': users, # ユーザーID -> [オフセット, バイト長, 件数, 最新ツイートID]
+            **(meta or {}),
+        }).encode('utf-8'))
+        f.write(footer)
+        f.write(_LENGTH.pack(len(footer)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return total
+
+
+class ArchiveFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ArchiveFormatError(f'{path}: not a tweet archive')
+            f.seek(-(len(MAGIC) + _LENGTH.size), os.SEEK_END)
+            footer_length, = _LENGTH.unpack(f.read(_LENGTH.size))
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ArchiveFormatError(f'{path}: truncated archive')
+            f.seek(-(len(MAGIC) + _LENGTH.size + footer_length), os.SEEK_END)
+            footer = json.loads(zlib.decompress(f.read(footer_length)))
+        if footer.get('version') != FORMAT_VERSION:
+            raise ArchiveFormatError(f'{path}: unsupported archive version {footer.get("version")}')
+        self.meta = footer
+        self.users = footer['users']
+
+    @property
+    def min_id(self):
+        return self.meta['min_id']
+
+    @property
+    def max_id(self):
+        return self.meta['max_id']
+
+    def has_user(self, user_id):
+        return str(user_id) in self.users
+
+    def user_rows(self, user_id):
+        """ユーザーのツイートを (id, timestamp, body) のID降順で返す"""
+        entry = self.users.get(str(user_id))
+        if entry is None:
+            return []
+        offset, length = entry[0], entry[1]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return _decode_block(f.read(length))
+
+
+@lru_cache(maxsize=256)
+def _open_archive(path, mtime_ns):
+    # フッターの読み込みはファイルの更新日時ごとに1回だけ行う
+    return ArchiveFile(path)
+
+
+def list_archives(archive_dir):
+    """アーカイブファイルを新しい順 (最大IDの降順) に返す"""
+    try:
+        names = os.listdir(archive_dir)
+    except FileNotFoundError:
+        return []
+    archives = []
+    for name in names:
+        if not name.endswith(FILE_SUFFIX):
+            continue
+        path = os.path.join(archive_dir, name)
+        archive = _open_archive(path, os.stat(path).st_mtime_ns)
+        if archive.max_id is not None:
+            archives.append(archive)
+    return sorted(archives, key=lambda archive: archive.max_id, reverse=True)
+
+
+def user_tweets(archive_dir, user, before_id=None, limit=50):
+    """アーカイブ済みのユーザーのツイートを before_id より古い順に limit 件返す
+
+    新しいアーカイブから順に、必要な件数に達するまでそのユーザーのブロックだけを展開する。
+    """
+    tweets = []
+    for archive in list_archives(archive_dir):
+        if len(tweets) >= limit:
+            break
+        if before_id is not None and archive.min_id >= before_id:
+            continue
+        if not archive.has_user(user.id):
+            continue
+        for tweet_id, ts, body in archive.user_rows(user.id):
+            if before_id is not None and tweet_id >= before_id:
+                continue
+            tweets.append(ArchivedTweet(tweet_id, body, ts, user.id, user))
+            if len(tweets) >= limit:
+                break
+    return tweets
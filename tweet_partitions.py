@@ -0,0 +1,217 @@
+# era/tweet_partitions.py
+# PostgreSQL での tweets テーブルの月別パーティション管理とアーカイブ
+#
+# tweets は主キー (Snowflake ID) の範囲でパーティション分割する。IDの上位ビットが発行時刻なので、
+# 月の境界は snowflake.min_id_for_datetime で主キーの境界に変換できる。新着順のタイムラインは
+# 主キーの降順で読むため、直近の月のパーティションだけを走査して終わる。
+#
+#   tweets_legacy  : 月別パーティションより前のID範囲 (0007 のマイグレーション、または db.create_all で作成)
+#   tweets_pYYYY_MM: 月ごとのパーティション (flask create-partitions で事前に作成する)
+#
+# デフォルトパーティションは作らない。PostgreSQL 15 以前ではデフォルトパーティションがあると
+# 実行時のパーティション除外ができず、ORDER BY id DESC LIMIT が全パーティションの Merge Append になる
+# (0009 のマイグレーションで削除)。パーティションが無い月のツイートは挿入できないので、
+# create-partitions を定期的に実行して先の月まで作っておく。
+#
+# 一定期間より古いパーティションは tweet_archive のファイルに書き出してから切り離して削除する
+# (flask archive-partitions)。アーカイブ済みのツイートはプロフィールのツイート一覧からだけ読める。
+# flask restore-partition でアーカイブファイルからテーブルに戻せる。
+import os
+import re
+from datetime import datetime
+from sqlalchemy import insert, text
+from db_instance import db
+from models import Tweet
+import hashtags
+import snowflake
+import stats
+import tweet_archive
+
+PARENT_TABLE = 'tweets'
+LEGACY_PARTITION = 'tweets_legacy'
+_PARTITION_NAME_RE = re.compile(r'^tweets_p(\d{4})_(\d{2})$')
+_BOUND_RE = re.compile(r"FOR VALUES FROM \('?(MINVALUE|-?\d+)'?\) TO \('?(MAXVALUE|-?\d+)'?\)")
+
+
+def is_supported():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'tweets_p{month:%Y_%m}'
+
+def month_of(name):
+    """パーティション名から月を返す (月別パーティションでなければ None)"""
+    match = _PARTITION_NAME_RE.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def id_bounds(month):
+    """その月に発行されたIDの範囲 [下限, 上限) を返す"""
+    return snowflake.min_id_for_datetime(month), snowflake.min_id_for_datetime(add_months(month, 1))
+
+def archive_path(archive_dir, name):
+    return os.path.join(archive_dir, name + tweet_archive.FILE_SUFFIX)
+
+
+def list_partitions(connection):
+    """tweets のパーティションを (名前, 下限, 上限) で返す。下限・上限は MINVALUE/MAXVALUE なら None"""
+    rows = connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:parent AS regclass) ORDER BY c.relname"
+    ), {'parent': PARENT_TABLE})
+    partitions = []
+    for name, bound in rows:
+        lower, upper = _BOUND_RE.search(bound).groups()
+        partitions.append((name, None if lower == 'MINVALUE' else int(lower), None if upper == 'MAXVALUE' else int(upper)))
+    return partitions
+
+
+def _covered(partitions, lower, upper):
+    for _, part_lower, part_upper in partitions:
+        if (part_lower is None or part_lower < upper) and (part_upper is None or lower is None or lower < part_upper):
+            return True
+    return False
+
+
+def live_floor_id(partitions):
+    """最新のパーティションから切れ目なく続く範囲の下限のIDを返す (MINVALUE まで続いていれば None)
+
+    これより小さいIDのパーティションはアーカイブ済みで、その範囲のIDは挿入できない。
+    """
+    floor = None
+    for _, lower, upper in sorted(partitions, key=lambda p: float('inf') if p[2] is None else p[2], reverse=True):
+        if floor is not None and upper != floor:
+            break
+        if lower is None:
+            return None
+        floor = lower
+    return floor
+
+
+def _create_monthly_partitions(connection, months_ahead, now, echo):
+    current = month_start(now or datetime.utcnow())
+    created = []
+    partitions = list_partitions(connection)
+    for i in range(months_ahead + 1):
+        month = add_months(current, i)
+        lower, upper = id_bounds(month)
+        if _covered(partitions, lower, upper):
+            continue
+        name = partition_name(month)
+        connection.execute(text(
+            f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM ({lower}) TO ({upper})'
+        ))
+        partitions.append((name, lower, upper))
+        created.append(name)
+        echo(f'{name}: created')
+    return created
+
+
+def create_partitions(months_ahead, now=None, echo=print):
+    """今月から months_ahead か月先までの月別パーティションを作成する (既にある範囲は飛ばす)。作成した名前を返す"""
+    with db.engine.begin() as connection:
+        return _create_monthly_partitions(connection, months_ahead, now, echo)
+
+
+def create_initial_partitions(connection, months_ahead, now=None):
+    """db.create_all で作った空の tweets に、今月より前の範囲 (tweets_legacy) と今月以降の月別パーティションを作る"""
+    lower, _ = id_bounds(month_start(now or datetime.utcnow()))
+    connection.execute(text(
+        f'CREATE TABLE {LEGACY_PARTITION} PARTITION OF {PARENT_TABLE} FOR VALUES FROM (MINVALUE) TO ({lower})'
+    ))
+    _create_monthly_partitions(connection, months_ahead, now, echo=lambda message: None)
+
+
+def archive_candidates(older_than_months, now=None):
+    """アーカイブ対象 (上限が older_than_months か月前の月初以前) のパーティションを古い順に返す"""
+    cutoff = snowflake.min_id_for_datetime(add_months(month_start(now or datetime.utcnow()), -older_than_months))
+    with db.engine.connect() as connection:
+        partitions = list_partitions(connection)
+    candidates = [p for p in partitions if p[2] is not None and p[2] <= cutoff]
+    return sorted(candidates, key=lambda p: p[2])
+
+
+def _detach_pending(connection, name):
+    return bool(connection.execute(text(
+        "SELECT i.inhdetachpending FROM pg_inherits i "
+        "WHERE i.inhrelid = CAST(:name AS regclass) AND i.inhparent = CAST(:parent AS regclass)"
+    ), {'name': name, 'parent': PARENT_TABLE}).scalar())
+
+
+def archive_partition(partition, archive_dir, yield_per=1000):
+    """パーティションをアーカイブファイルに書き出してから、タグ・メンションの索引ごと削除する。書き出した件数を返す
+
+    ファイルを書き終えるまでは何も削除しないので、途中で失敗した場合はもう一度実行すればよい
+    (書き出し済みのファイルが同じ内容ならそのまま使う。違う内容のファイルは上書きしない)。
+    切り離しは DETACH PARTITION ... CONCURRENTLY で行い、tweets を読み書きするクエリを止めない。
+    """
+    name, lower, upper = partition
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, name)
+
+    with db.engine.connect() as connection:
+        pending = _detach_pending(connection, name)
+        count, min_id, max_id = connection.execute(text(f'SELECT count(*), min(id), max(id) FROM {name}')).one()
+        if os.path.exists(path):
+            archive = tweet_archive.ArchiveFile(path)
+            if (archive.meta['rows'], archive.min_id, archive.max_id) != (count, min_id, max_id):
+                raise FileExistsError(f'{path} already exists with different tweets; restore it first')
+        else:
+            rows = connection.execution_options(yield_per=yield_per).execute(text(
+                f'SELECT user_id, id, timestamp, body FROM {name} ORDER BY user_id, id DESC'
+            ))
+            count = tweet_archive.write_archive(path, rows, meta={'partition': name, 'lower': lower, 'upper': upper})
+
+    # 参照している行が残っていると切り離せないので、先にタグ・メンションの索引を削除してコミットする
+    id_range = 'tweet_id < :upper' if lower is None else 'tweet_id >= :lower AND tweet_id < :upper'
+    params = {'lower': lower, 'upper': upper}
+    db.session.execute(text(f'DELETE FROM tweet_tags WHERE {id_range}'), params)
+    db.session.execute(text(f'DELETE FROM tweet_mentions WHERE {id_range}'), params)
+    db.session.commit()
+
+    # CONCURRENTLY はトランザクションの中では実行できない。前回の切り離しが途中で止まっていたら FINALIZE で完了させる
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(
+            f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} {"FINALIZE" if pending else "CONCURRENTLY"}'
+        ))
+    db.session.execute(text(f'DROP TABLE {name}'))
+    # ツイート総数のカウンターは再集計時に、アーカイブ済みの件数を足して数える
+    stats.incr({stats.TWEETS_ARCHIVED_KEY: count})
+    db.session.commit()
+    return count
+
+
+def restore_partition(path):
+    """アーカイブファイルのツイートを tweets に戻し、タグ・メンションの索引を作り直してからファイルを削除する。戻した件数を返す
+
+    パーティションが無ければ書き出したときの範囲で作り直す。同じ範囲のパーティションがあればそこに戻す。
+    """
+    archive = tweet_archive.ArchiveFile(path)
+    name, lower, upper = archive.meta['partition'], archive.meta['lower'], archive.meta['upper']
+    # パーティションの作成から索引の作り直しまでを1つのトランザクションで行う
+    if not _covered(list_partitions(db.session), lower, upper):
+        db.session.execute(text(
+            f'CREATE TABLE {name} PARTITION OF {PARENT_TABLE} '
+            f'FOR VALUES FROM ({"MINVALUE" if lower is None else lower}) TO ({upper})'
+        ))
+    count = 0
+    for user_id in archive.users:
+        rows = archive.user_rows(user_id)
+        db.session.execute(insert(Tweet), [
+            {'id': tweet_id, 'body': body, 'timestamp': ts, 'user_id': int(user_id)} for tweet_id, ts, body in rows
+        ])
+        hashtags.index_tweets([(tweet_id, body) for tweet_id, _, body in rows], count_trending=False)
+        count += len(rows)
+    stats.incr({stats.TWEETS_ARCHIVED_KEY: -count})
+    db.session.commit()
+    # コミットしてから削除する (削除できなかった場合、プロフィールには同じツイートが重ねて表示される)
+    os.remove(path)
+    return count
@@ -0,0 +1,204 @@
+# era/tweet_writes.py
+# ツイート投稿の共通処理 (Web画面・API・一括インポートから使う)
+#
+# TWEET_GROUP_COMMIT を有効にすると、1件ずつの投稿をワーカー内の書き込みスレッドに渡し、
+# 短い時間窓 (TWEET_GROUP_COMMIT_WINDOW_MS) に集まった他のリクエストの投稿とまとめて
+# 1回の INSERT・1回のコミットで書き込む (グループコミット)。各リクエストは自分の投稿の
+# コミット完了 (または失敗) を待ってから応答するので、成否はリクエストごとに正しく返る。
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from flask import current_app, g, has_request_context
+from sqlalchemy import insert, select
+from db_instance import db
+from models import Tweet
+import hashtags
+import metrics
+import snowflake
+import stats
+
+
+class GroupCommitTimeout(Exception):
+    """グループコミットの書き込み待ちが時間切れになった
+
+    started が False なら投稿は取り消されて書き込まれていない。True なら書き込みが始まってから
+    待ちきれなかったので、投稿されたかどうかは分からない。
+    """
+
+    def __init__(self, started=False):
+        super().__init__('group commit is still in progress' if started else 'group commit timed out before writing')
+        self.started = started
+
+
+def create_tweet(user_id, body):
+    """ツイートを追加し、タグ・メンションのインデックスとダッシュボードのカウンターを更新する
+
+    コミットは呼び出し元で行う。
+    """
+    tweet = Tweet(body=body, user_id=user_id)
+    db.session.add(tweet)
+    db.session.flush() # インデックスの行にツイートIDが必要
+    hashtags.index_tweets([(tweet.id, body)])
+    stats.record_tweets()
+    return tweet
+
+
+def insert_tweets(rows, count_trending=True):
+    """[{'user_id': ..., 'body': ..., 'timestamp': ...}, ...] を複数行の INSERT でまとめて追加し、IDを同じ順で返す
+
+    タグ・メンションのインデックスとダッシュボードのカウンターも更新する。コミットは呼び出し元で行う。
+    """
+    if not rows:
+        return []
+    # RETURNING 付きの executemany は複数行の INSERT ... VALUES にまとめて送られる (IDは入力順に並べ直される)
+    tweet_ids = db.session.scalars(
+        insert(Tweet).returning(Tweet.id, sort_by_parameter_order=True), rows
+    ).all()
+    hashtags.index_tweets([(tweet_id, row['body']) for tweet_id, row in zip(tweet_ids, rows)],
+                          count_trending=count_trending)
+    stats.record_tweet_timestamps([row['timestamp'] for row in rows])
+    return tweet_ids
+
+
+def create_tweets(user_id, tweets, count_trending=True, min_id=None):
+    """[(body, timestamp), ...] を user_id の投稿としてまとめて追加し、追加したツイートIDを同じ順で返す
+
+    timestamp を指定すると投稿日時をそのまま保存し、IDもその時刻から作る (インポート用。
+    過去の投稿が新着として並ばないようにする)。None なら現在時刻。min_id を指定すると、IDが
+    それより小さくなる投稿日時 (アーカイブ済みでパーティションが無い範囲) は min_id の時刻でIDを作る。
+    コミットは呼び出し元で行う。
+    """
+    now = datetime.utcnow()
+    floor = None if min_id is None else snowflake.datetime_of(min_id)
+    rows = []
+    past_rows = []
+    for body, timestamp in tweets:
+        row = {'body': body, 'timestamp': timestamp or now, 'user_id': user_id}
+        if timestamp is None:
+            row['id'] = snowflake.next_id()
+        else:
+            id_time = timestamp if floor is None else max(timestamp, floor)
+            row['id'] = snowflake.id_for_past(id_time)
+            past_rows.append((row, id_time))
+        rows.append(row)
+    _avoid_existing_ids(past_rows)
+    return insert_tweets(rows, count_trending=count_trending)
+
+
+def _avoid_existing_ids(past_rows):
+    # 過去の時刻から作ったIDは、同じミリ秒に発行済みのIDと重なることがあるので作り直す
+    while past_rows:
+        ids = [row['id'] for row, _ in past_rows]
+        taken = set(db.session.scalars(select(Tweet.id).where(Tweet.id.in_(ids))))
+        past_rows = [(row, id_time) for row, id_time in past_rows if row['id'] in taken]
+        for row, id_time in past_rows:
+            row['id'] = snowflake.id_for_past(id_time)
+
+
+def publish_tweet(user_id, body):
+    """ツイートを1件投稿してコミットし、ツイートIDを返す (TWEET_GROUP_COMMIT が有効ならまとめてコミットする)"""
+    if not current_app.config['TWEET_GROUP_COMMIT']:
+        tweet = create_tweet(user_id, body)
+        db.session.commit()
+        return tweet.id
+
+    timeout = current_app.config['TWEET_GROUP_COMMIT_TIMEOUT_SECONDS']
+    future = current_app.extensions['tweet_group_commit'].submit(user_id, body)
+    try:
+        tweet_id = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.cancel():
+            raise GroupCommitTimeout() from None
+        # 書き込みが始まっている場合は、もう一度だけ同じ時間まで結果を待つ
+        try:
+            tweet_id = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise GroupCommitTimeout(started=True) from None
+    if has_request_context():
+        g.db_wrote = True # 書き込みは別スレッドのセッションで行われるので、リードレプリカの振り分け用に記録する
+    return tweet_id
+
+
+class GroupCommitWriter:
+    def __init__(self, app, window_seconds, max_batch):
+        self.app = app
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, user_id, body):
+        """投稿を書き込みスレッドに渡し、ツイートIDが結果になる Future を返す"""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((future, {'user_id': user_id, 'body': body, 'timestamp': datetime.utcnow()}))
+        return future
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='tweet-group-commit', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # 待ち時間切れで取り消されたリクエストの投稿は書き込まない
+        return [(future, row) for future, row in batch if future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception as e:
+                # ロールバックやアプリコンテキストの失敗でスレッドが止まると、待っているリクエストが戻らなくなる。
+                # 結果の決まっていない投稿に例外を返して、次の投稿の処理を続ける
+                self.app.logger.exception('Group commit failed')
+                for future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write(self, batch):
+        try:
+            tweet_ids = insert_tweets([row for _, row in batch])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # まとめた書き込みが失敗したら1件ずつ書き直し、失敗した投稿のリクエストにだけ例外を返す
+            for future, row in batch:
+                try:
+                    tweet_id, = insert_tweets([row])
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(tweet_id)
+            return
+        metrics.observe('tweet_group_commit_batch_size', len(batch))
+        for (future, _), tweet_id in zip(batch, tweet_ids):
+            future.set_result(tweet_id)
+
+
+def init_app(app):
+    # 書き込みスレッドは最初の投稿時に起動する
+    app.extensions['tweet_group_commit'] = GroupCommitWriter(
+        app,
+        window_seconds=app.config['TWEET_GROUP_COMMIT_WINDOW_MS'] / 1000,
+        max_batch=app.config['TWEET_GROUP_COMMIT_MAX_BATCH']
+    )
@@ -0,0 +1,170 @@
+# era/user_data.py
+# ユーザーデータ (プロフィール・ツイート・フォロー) の NDJSON エクスポートと一括インポート
+#
+# 1行1レコードで、先頭の "type" で種類を表す:
+#   {"type": "profile", "username": ..., "email": ..., "user_age": ..., "bio": ..., "profile_image": ..., "created_at": ...}
+#   {"type": "tweet", "id": "<ツイートID (文字列)>", "body": ..., "timestamp": ...}
+#   {"type": "follow", "username": <フォロー先>, "timestamp": ...}
+# エクスポートはサーバーサイドカーソルで少しずつ読み、インポートは一定件数ごとにまとめて書くので、
+# どちらもメモリ使用量は件数に依存しない。
+import itertools
+import json
+from datetime import datetime, timezone
+from sqlalchemy import insert, select
+from db_instance import db
+from models import Follow, Tweet, User
+import fragment_cache
+import stats
+import tweet_partitions
+from tweet_writes import create_tweets
+
+TWEET_MAX_LENGTH = 280
+
+
+class ImportFormatError(ValueError):
+    """インポートデータの形式が不正 (lineno は1始まりの行番号)"""
+
+    def __init__(self, lineno, message):
+        super().__init__(f'line {lineno}: {message}')
+        self.lineno = lineno
+
+
+# --- エクスポート ---
+
+def export_records(user, yield_per=1000):
+    """user のプロフィール・ツイート (古い順)・フォロー先をレコードの dict として順に返す"""
+    yield {
+        'type': 'profile',
+        'username': user.username,
+        'email': user.email,
+        'user_age': user.user_age,
+        'bio': user.bio,
+        'profile_image': user.profile_image,
+        'created_at': user.created_at,
+    }
+    tweets = db.session.execute(
+        select(Tweet.id, Tweet.body, Tweet.timestamp)
+        .where(Tweet.user_id == user.id)
+        .order_by(Tweet.id)
+        .execution_options(yield_per=yield_per)
+    )
+    for tweet_id, body, timestamp in tweets:
+        yield {'type': 'tweet', 'id': str(tweet_id), 'body': body, 'timestamp': timestamp}
+
+    follows = db.session.execute(
+        select(User.username, Follow.timestamp)
+        .join(User, User.id == Follow.followed_id)
+        .where(Follow.follower_id == user.id)
+        .order_by(Follow.followed_id)
+        .execution_options(yield_per=yield_per)
+    )
+    for username, timestamp in follows:
+        yield {'type': 'follow', 'username': username, 'timestamp': timestamp}
+
+
+# --- インポート ---
+
+def read_records(lines):
+    """NDJSON の行 (str / bytes) を (行番号, dict) にして返す。空行は読み飛ばす"""
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ImportFormatError(lineno, f'invalid JSON ({e})') from None
+        if not isinstance(record, dict) or 'type' not in record:
+            raise ImportFormatError(lineno, 'each line must be an object with a "type" field')
+        yield lineno, record
+
+
+def _parse_timestamp(lineno, value):
+    if value is None:
+        return None
+    try:
+        # Python 3.10 以前の fromisoformat は末尾の 'Z' を解釈しない
+        timestamp = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except (AttributeError, TypeError, ValueError):
+        raise ImportFormatError(lineno, f'invalid timestamp {value!r}') from None
+    if timestamp.tzinfo is not None:
+        # DBの日時はタイムゾーンなしの UTC なので、オフセット付きの値は UTC に直してから外す
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _parse_tweet(lineno, record):
+    body = record.get('body')
+    if not isinstance(body, str) or not body:
+        raise ImportFormatError(lineno, 'tweet body is required')
+    if len(body) > TWEET_MAX_LENGTH:
+        raise ImportFormatError(lineno, f'tweet body must be {TWEET_MAX_LENGTH} characters or less')
+    return body, _parse_timestamp(lineno, record.get('timestamp'))
+
+
+def _import_follows(user, follows):
+    """[(username, timestamp), ...] のうち、存在して未フォローのユーザーへのフォローを追加する"""
+    names = {username for username, _ in follows}
+    user_ids = dict(db.session.execute(select(User.username, User.id).where(User.username.in_(names))).all())
+    already = set(db.session.scalars(
+        select(Follow.followed_id).where(Follow.follower_id == user.id, Follow.followed_id.in_(user_ids.values()))
+    ))
+    rows = {}
+    for username, timestamp in follows:
+        followed_id = user_ids.get(username)
+        if followed_id is None or followed_id == user.id or followed_id in already:
+            continue
+        rows.setdefault(followed_id, {
+            'follower_id': user.id, 'followed_id': followed_id, 'timestamp': timestamp or datetime.utcnow()
+        })
+    if rows:
+        db.session.execute(insert(Follow), list(rows.values()))
+        stats.record_follow(len(rows))
+    return len(rows)
+
+
+def import_records(user, records, chunk_size=1000):
+    """read_records() のレコードを user のツイート・フォローとして chunk_size 件ごとにまとめて書き込む
+
+    ツイートの投稿日時は元の値を保持する。チャンクごとにコミットするので、途中で形式エラーになった場合は
+    それまでのチャンクは取り込まれたままになる (件数は例外の imported 属性に入る)。profile レコードは読み飛ばす。
+    戻り値は {'tweets': 追加件数, 'follows': 追加件数}。
+    """
+    counts = {'tweets': 0, 'follows': 0}
+    min_id = None
+    if tweet_partitions.is_supported():
+        # アーカイブ済みの期間の投稿日時は、残っている最も古いパーティションの先頭のIDにする
+        min_id = tweet_partitions.live_floor_id(tweet_partitions.list_partitions(db.session))
+    try:
+        _import_chunks(user, iter(records), chunk_size, counts, min_id)
+    except ImportFormatError as e:
+        db.session.rollback()
+        e.imported = counts
+        raise
+    return counts
+
+
+def _import_chunks(user, records, chunk_size, counts, min_id):
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        tweets = []
+        follows = []
+        for lineno, record in chunk:
+            kind = record['type']
+            if kind == 'tweet':
+                tweets.append(_parse_tweet(lineno, record))
+            elif kind == 'follow':
+                if not isinstance(record.get('username'), str):
+                    raise ImportFormatError(lineno, 'follow username is required')
+                follows.append((record['username'], _parse_timestamp(lineno, record.get('timestamp'))))
+            elif kind != 'profile':
+                raise ImportFormatError(lineno, f'unknown record type {kind!r}')
+        # 過去の投稿なのでトレンドには加算しない
+        counts['tweets'] += len(create_tweets(user.id, tweets, count_trending=False, min_id=min_id))
+        if tweets:
+            # 投稿日時のIDで古い位置に入るので、最新ツイートIDが変わらなくてもプロフィールのキャッシュを使わないようにする
+            fragment_cache.bump_profile_version(user)
+        if follows:
+            counts['follows'] += _import_follows(user, follows)
+        db.session.commit()